@@ -27,6 +27,7 @@ SOFTWARE.
 #include <stdio.h>
 #include <string.h>
 #include <math.h>
+#include <stdint.h>
 
 #ifdef MATLAB
 #include "matrix.h"
@@ -34,16 +35,24 @@ SOFTWARE.
 
 #ifdef MATLAB
 #define MALLOC mxMalloc
+#define FREE mxFree
 #else
 #define MALLOC malloc
+#define FREE free
 #endif
 
+/* Up to this many columns, weighted sums are computed with the columns
+ * packed as bits of a single integer (see solve_basis) */
+#define PACKED_DIM 40
+
 /* A global variable for progress printing */
 char progress[] = {'|', '/', '-', '\\'};
 
-smatrix calculate_association(matrix S, int size, int dim, options *opti);
+uint64_t *column_bitsets(matrix S, int size, int dim, int words);
+
+int calculate_association(double *assoc, int dim, options *opti, csrmatrix *D);
 
-int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
+int solve_basis(matrix S, int size, int dim, matrix B, int k, csrmatrix *D,
         matrix O, options *opti);
 
 int vect_max(int *vect, int size);
@@ -51,147 +60,267 @@ int vect_max(int *vect, int size);
 int approximate(matrix S, int size, int dim, matrix B, int k, matrix O,
         options *opti)
 {
-    smatrix D; /* let D be a sparse matrix */
+    double *assoc;
+    int result;
 
     if (opti->verbose > 0) {
         fprintf(stderr, "Calculating associations...\n");
     }
-    D = calculate_association(S, size, dim, opti);
+    assoc = association_matrix(S, size, dim, opti->row_weight);
+    if (assoc == NULL)
+        return 0;
 
-    if (D == NULL)
+    result = approximate_association(S, size, dim, assoc, B, k, O, opti);
+    FREE(assoc);
+    return result;
+
+}
+
+/* Same as approximate, with the result of association_matrix(S) given */
+int approximate_association(matrix S, int size, int dim, double *assoc,
+        matrix B, int k, matrix O, options *opti)
+{
+    csrmatrix D; /* let D be a sparse matrix */
+    int result;
+
+    if (calculate_association(assoc, dim, opti, &D) == 0)
         return 0;
 
     if (opti->verbose > 0) {
         fprintf(stderr, "Solving basis...\n");
     }
-    return solve_basis(S, size, dim, B, k, D, O, opti);
+    result = solve_basis(S, size, dim, B, k, &D, O, opti);
+    FREE(D.start);
+    FREE(D.col);
+    return result;
+}
 
+/* Store S column-major, as one bitset of 'words' 64-bit words per column */
+uint64_t *column_bitsets(matrix S, int size, int dim, int words)
+{
+    uint64_t *cols;
+    int i, j;
+
+    cols = (uint64_t *)MALLOC(((size_t)dim * words + 1) * sizeof(uint64_t));
+    if (cols == NULL) {
+        perror("Error while allocating space for column bitsets");
+        return NULL;
+    }
+    memset(cols, 0, ((size_t)dim * words + 1) * sizeof(uint64_t));
+
+    for (i = 0; i < size; i++) {
+        for (j = 0; j < dim; j++) {
+            if (S[i][j])
+                cols[(size_t)j * words + i / 64] |= (uint64_t)1 << (i % 64);
+        }
+    }
+    return cols;
 }
 
-smatrix calculate_association(matrix S, int size, int dim, options *opti)
+/*
+ * Normalized association matrix of S, independent of the threshold:
+ * entry (i, j) is the number of rows with ones in columns i and j,
+ * divided by the number of rows with a one in column i. If weight is
+ * not NULL, row r counts weight[r] times.
+ */
+double *association_matrix(matrix S, int size, int dim, const unsigned long int *weight)
 {
-    int i, j, bit;
-    double *A; /* We only need a row at a time */
-    double sum;
-    smatrix D;
-    selement *ptr, *tmp;
-
-    A = (double *)MALLOC(dim * sizeof(double));
-    if (A == NULL) {
+    int i, j, w, words;
+    uint64_t *cols, *count, sum, *a, *b;
+    double *assoc;
+
+    words = (size + 63) / 64;
+    cols = weight == NULL ? column_bitsets(S, size, dim, words) : NULL;
+    count = (uint64_t *)MALLOC(((size_t)dim * dim + 1) * sizeof(uint64_t));
+    assoc = (double *)MALLOC(((size_t)dim * dim + 1) * sizeof(double));
+    if ((weight == NULL && cols == NULL) || count == NULL || assoc == NULL) {
         perror("Error while allocating space for association matrix");
+        FREE(cols);
+        FREE(count);
+        FREE(assoc);
         return NULL;
     }
 
+    /* Weighted rows are few (distinct rows of a truthtable); add them up
+     * one by one */
+    if (weight != NULL) {
+        memset(count, 0, (size_t)dim * dim * sizeof(uint64_t));
+        for (w = 0; w < size; w++) {
+            for (i = 0; i < dim; i++) {
+                if (!S[w][i]) continue;
+                for (j = i; j < dim; j++)
+                    if (S[w][j]) count[(size_t)i * dim + j] += weight[w];
+            }
+        }
+        for (i = 0; i < dim; i++)
+            for (j = 0; j < i; j++)
+                count[(size_t)i * dim + j] = count[(size_t)j * dim + i];
+    }
+
+    /* Co-occurrences are symmetric; count each pair once */
+    for (i = 0; weight == NULL && i < dim; i++) {
+        a = cols + (size_t)i * words;
+        for (j = i; j < dim; j++) {
+            b = cols + (size_t)j * words;
+            sum = 0;
+            for (w = 0; w < words; w++)
+                sum += __builtin_popcountll(a[w] & b[w]);
+            count[(size_t)i * dim + j] = count[(size_t)j * dim + i] = sum;
+        }
+    }
+
+    /* 'normalize' counts, count[i][i] is allways largest */
+    for (i = 0; i < dim; i++) {
+        sum = count[(size_t)i * dim + i];
+        for (j = 0; j < dim; j++)
+            assoc[(size_t)i * dim + j] = (double)count[(size_t)i * dim + j] / (double)sum;
+    }
+
+    FREE(cols);
+    FREE(count);
+    return assoc;
+}
+
+/* Cut the association matrix at opti->threshold into the sparse matrix D */
+int calculate_association(double *assoc, int dim, options *opti, csrmatrix *D)
+{
+    int i, bit, nnz;
+
     /* Allocate space for sparse matrix D */
-    D = (smatrix)MALLOC(dim * sizeof(selement *));
-    if (D == NULL) {
+    D->start = (int *)MALLOC((dim + 1) * sizeof(int));
+    D->col = (int *)MALLOC(((size_t)dim * dim + 1) * sizeof(int));
+    if (D->start == NULL || D->col == NULL) {
         perror("Error while allocating space for sparse association matrix");
-        return NULL;
+        FREE(D->start);
+        FREE(D->col);
+        return 0;
     }
-    /* Set D to be empty matrix, i.e., full of NULLs */
-    memset(D, 0, dim * sizeof(selement *));
 
+    nnz = 0;
     for (bit = 0; bit < dim; bit++) {
         if (opti->verbose > 0) {
             fprintf(stderr, "\r  column %i   ", bit+1);
         }
-        /* set A as zero vector */
-        memset(A, 0, dim * sizeof(double));
-
-        /* summarize over set */
-        for (i = 0; i < size; i++) {
-            if (S[i][bit]) {
-                for (j = 0; j < dim; j++)
-                    A[j] += S[i][j];
-            }
-        }
-
-        /* 'normalize' sums, A[bit] is allways largest; calculate D */
-        sum = A[bit];
-        ptr = tmp = NULL;
+        D->start[bit] = nnz;
         for (i = 0; i < dim; i++) {
-            A[i] /= sum;
-            /* Build sparse matrix D */
-            if (A[i] > opti->threshold) {
-                tmp = (selement *)MALLOC(sizeof(selement));
-                if (tmp == NULL) {
-                    perror("Error while allocating space for sparse matrix element");
-                    return NULL;
-                }
-                tmp->c = i;
-                tmp->n = NULL;
-                if (D[bit] == NULL) {
-                    /* This is the first 1 in this row */
-                    D[bit] = ptr = tmp;
-                } else {
-                    ptr->n=tmp;
-                    ptr = tmp;
-                }
-            }
+            if (assoc[(size_t)bit * dim + i] > opti->threshold)
+                D->col[nnz++] = i;
         }
     }
+    D->start[dim] = nnz;
     if (opti->verbose > 0) {
         fprintf(stderr, "\n");
     }
 
-    return D;
+    return 1;
 }
 
-int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
+int solve_basis(matrix S, int size, int dim, matrix B, int k, csrmatrix *D,
         matrix O, options *opti)
 {
-    int i, basis, row;
-    matrix covered;
-    int best;
-    int *best_rowcount, *rowcount;
-    int best_covers, covers;
-    selement *element;
+    int i, c, e, basis, row;
+    int best, result;
+    int64_t *best_rowcount, *rowcount, *tmp;
+    int64_t best_covers, covers, bonus, penalty;
+    uint64_t *rows, *covered, *masks, open;
+    int *bit;
+    double *weight, sum;
+    matrix covered_bytes;
     FILE *fp, *decompfp;
 
+    /* Everything below is owned by this call and freed at cleanup */
+    result = 0;
+    best_rowcount = rowcount = NULL;
+    rows = covered = masks = NULL;
+    bit = NULL;
+    weight = NULL;
+    covered_bytes = NULL;
+    fp = decompfp = NULL;
+
     /* Open basis file */
     if (opti->original_basis != NULL) {
         fp = fopen(opti->original_basis, "w");
         if (fp == NULL) {
             perror("Error when opening file for printing basis");
+            goto cleanup;
         }
-    } else fp = NULL;
+    }
 
     /* Open decomposition file */
     if (opti->decomp_matrix != NULL) {
         decompfp = fopen(opti->decomp_matrix, "w");
         if (decompfp == NULL) {
             perror("Error when opening file for printing decomp");
+            goto cleanup;
         }
         /* Print #rows and #cols; this is a transpose */
         fprintf(decompfp, "%i\n%i\n", k, size);
-    } else decompfp = NULL;
+    }
 
-    covered = (matrix)MALLOC(size * sizeof(vector));
-    if (covered == NULL) {
-        perror("Error while allocating space for covered matrix");
-        return 0;
+    bonus = opti->bonus_covered;
+    penalty = opti->penalty_overcovered;
+
+    /* Column c weighs 2^(dim-c) (Soheil), or 2^column_bit[c] if the caller
+     * dropped columns. With few columns, a row is packed into an integer
+     * with column c at that bit, so that the weighted sum over a set of
+     * columns is the integer itself. */
+    bit = (int *)MALLOC((dim + 1) * sizeof(int));
+    if (bit == NULL) {
+        perror("Error while allocating space for column weights");
+        goto cleanup;
     }
-    for (i = 0; i < size; i++) {
-        covered[i] = (vector)MALLOC(dim * sizeof(char));
-        if (covered[i] == NULL) {
+    for (c = 0; c < dim; c++)
+        bit[c] = opti->column_bit != NULL ? opti->column_bit[c] : dim - c;
+    if (dim == 0 || bit[0] <= PACKED_DIM) {
+        rows = (uint64_t *)MALLOC((size + 1) * sizeof(uint64_t));
+        covered = (uint64_t *)MALLOC((size + 1) * sizeof(uint64_t));
+        masks = (uint64_t *)MALLOC((dim + 1) * sizeof(uint64_t));
+        if (rows == NULL || covered == NULL || masks == NULL) {
+            perror("Error while allocating space for covered matrix");
+            goto cleanup;
+        }
+        for (i = 0; i < size; i++) {
+            rows[i] = covered[i] = 0;
+            for (c = 0; c < dim; c++)
+                if (S[i][c]) rows[i] |= (uint64_t)1 << bit[c];
+        }
+        for (row = 0; row < dim; row++) {
+            masks[row] = 0;
+            for (e = D->start[row]; e < D->start[row+1]; e++)
+                masks[row] |= (uint64_t)1 << bit[D->col[e]];
+        }
+    } else {
+        weight = (double *)MALLOC((dim + 1) * sizeof(double));
+        covered_bytes = (matrix)MALLOC((size + 1) * sizeof(vector));
+        if (covered_bytes != NULL)
+            for (i = 0; i < size; i++) covered_bytes[i] = NULL;
+        if (weight == NULL || covered_bytes == NULL) {
             perror("Error while allocating space for covered matrix");
-            return 0;
+            goto cleanup;
+        }
+        for (c = 0; c < dim; c++) weight[c] = pow(2, bit[c]);
+        for (i = 0; i < size; i++) {
+            covered_bytes[i] = (vector)MALLOC(dim * sizeof(char));
+            if (covered_bytes[i] == NULL) {
+                perror("Error while allocating space for covered matrix");
+                goto cleanup;
+            }
+            memset(covered_bytes[i], 0, dim);
         }
-        memset(covered[i], 0, dim);
     }
 
     /* best is thus far an integer giving the correct row */
 
-    best_rowcount = (int *)MALLOC(size * sizeof(int));
+    best_rowcount = (int64_t *)MALLOC((size + 1) * sizeof(int64_t));
     if (best_rowcount == NULL) {
         perror("Error while allocating space for 'best_rowcount' vector");
-        return 0;
+        goto cleanup;
     }
 
-    rowcount = (int *)MALLOC(size * sizeof(int));
+    rowcount = (int64_t *)MALLOC((size + 1) * sizeof(int64_t));
     if (rowcount == NULL) {
         perror("Error while allocating space for 'rowcount' vector");
-        return 0;
+        goto cleanup;
     }
 
     /* iterate thru all asked basis vectors */
@@ -202,7 +331,7 @@ int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
 
         best = -1;
         best_covers = 0;
-        memset(best_rowcount, 0, size * sizeof(int));
+        memset(best_rowcount, 0, size * sizeof(int64_t));
 
         /* iterate thru all rows in D */
         for (row = 0; row < dim; row++) {
@@ -211,22 +340,30 @@ int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
             if (opti->verbose > 0) fprintf(stderr, "\b%c", progress[row%4]);
 
             covers = 0;
-            memset(rowcount, 0, size * sizeof(int));
 
-            for (i = 0; i < size; i++) {
-                element = D[row];
-                while (element != NULL) {
-                    /* UPDATE: penalize covered 0s only when somebody else doesn't
-                     * cover them already! */
-                    if (S[i][element->c] == 0) rowcount[i] -= opti->penalty_overcovered
-                    * pow(2,(dim-element->c))   /*Soheil*/
-                    * (1 - covered[i][element->c]);
-                    else rowcount[i] += opti->bonus_covered
-                    * pow(2,(dim-element->c))   /*Soheil*/
-                    * (S[i][element->c] - covered[i][element->c]);
-                    element = element->n;
+            /* UPDATE: penalize covered 0s only when somebody else doesn't
+             * cover them already! */
+            if (masks != NULL) {
+                for (i = 0; i < size; i++) {
+                    open = masks[row] & ~covered[i];
+                    rowcount[i] = bonus * (int64_t)(rows[i] & open)
+                        - penalty * (int64_t)(~rows[i] & open);
+                    if (rowcount[i] > 0)
+                        covers += opti->row_weight != NULL ? rowcount[i] * (int64_t)opti->row_weight[i] : rowcount[i];
+                }
+            } else {
+                for (i = 0; i < size; i++) {
+                    sum = 0;
+                    for (e = D->start[row]; e < D->start[row+1]; e++) {
+                        c = D->col[e];
+                        if (covered_bytes[i][c]) continue;
+                        if (S[i][c] == 0) sum -= penalty * weight[c];
+                        else sum += bonus * weight[c];
+                    }
+                    rowcount[i] = (int64_t)sum;
+                    if (rowcount[i] > 0)
+                        covers += opti->row_weight != NULL ? rowcount[i] * (int64_t)opti->row_weight[i] : rowcount[i];
                 }
-                if (rowcount[i] > 0) covers += rowcount[i];
             }
 
             if (covers > best_covers) {
@@ -234,7 +371,9 @@ int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
                 best_covers = covers;
                 /* 'best' is this row */
                 best = row;
-                memcpy(best_rowcount, rowcount, size*sizeof(int));
+                tmp = best_rowcount;
+                best_rowcount = rowcount;
+                rowcount = tmp;
             }
         }
 
@@ -245,18 +384,15 @@ int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
              */
             for (i = 0; i < size; i++) {
                 if (best_rowcount[i] > 0) {
-                    element = D[best];
-                    while (element != NULL) {
-                        covered[i][element->c] = 1;
-                        element = element->n;
+                    if (masks != NULL) covered[i] |= masks[best];
+                    else {
+                        for (e = D->start[best]; e < D->start[best+1]; e++)
+                            covered_bytes[i][D->col[e]] = 1;
                     }
                 }
             }
-            element = D[best];
-            while (element != NULL) {
-                B[basis][element->c] = 1;
-                element = element->n;
-            }
+            for (e = D->start[best]; e < D->start[best+1]; e++)
+                B[basis][D->col[e]] = 1;
         }
 
         /* And finally, let's print each basis vector as soon as they are ready */
@@ -282,11 +418,26 @@ int solve_basis(matrix S, int size, int dim, matrix B, int k, smatrix D,
     if (opti->verbose > 0) {
         fprintf(stderr, "\n");
     }
+    result = 1;
 
+cleanup:
     if (fp != NULL) fclose(fp);
     if (decompfp != NULL) fclose(decompfp);
 
-    return 1;
+    if (rowcount != NULL) FREE(rowcount);
+    if (best_rowcount != NULL) FREE(best_rowcount);
+    if (bit != NULL) FREE(bit);
+    if (rows != NULL) FREE(rows);
+    if (covered != NULL) FREE(covered);
+    if (masks != NULL) FREE(masks);
+    if (covered_bytes != NULL) {
+        for (i = 0; i < size; i++)
+            if (covered_bytes[i] != NULL) FREE(covered_bytes[i]);
+        FREE(covered_bytes);
+    }
+    if (weight != NULL) FREE(weight);
+
+    return result;
 }
 
 
@@ -39,6 +39,8 @@ struct options_s {
   unsigned int bonus_covered;
   unsigned int penalty_overcovered;
   char *decomp_matrix;
+  const unsigned long int *row_weight; /* multiplicity of each row, NULL if 1 */
+  const int *column_bit;  /* column c weighs 2^column_bit[c], NULL if 2^(dim-c) */
 };
 
 /* type definitions */
@@ -52,6 +54,13 @@ typedef unsigned long int ** imatrix; /*       "        matrices */
 #endif
 typedef struct options_s options;
 
+/* Sparse association matrix in compressed sparse row format: row r has
+ * ones in columns col[start[r]] ... col[start[r+1]-1] */
+typedef struct {
+    int *start;
+    int *col;
+} csrmatrix;
+
 /* procedures */
 
 int approximate(matrix Set, 
@@ -62,6 +71,17 @@ int approximate(matrix Set,
 		matrix O,
 		options *opti);
 
+double *association_matrix(matrix Set, int size, int dim, const unsigned long int *weight);
+
+int approximate_association(matrix Set,
+		int size,
+		int dim,
+		double *assoc,
+		matrix B,
+		int k,
+		matrix O,
+		options *opti);
+
 void approx_help();
 
 #endif
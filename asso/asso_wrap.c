@@ -3318,7 +3318,9 @@ SWIGINTERN PyObject *_wrap_asso(PyObject *SWIGUNUSEDPARM(self), PyObject *args)
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "asso" "', argument " "2"" of type '" "int""'");
   } 
   arg2 = (int)(val2);
+  Py_BEGIN_ALLOW_THREADS
   result = (int)asso(arg1,arg2);
+  Py_END_ALLOW_THREADS
   resultobj = SWIG_From_int((int)(result));
   if (alloc1 == SWIG_NEWOBJ) free((char*)buf1);
   return resultobj;
@@ -3328,9 +3330,81 @@ fail:
 }
 
 
+/* Check the optional row weights (uint64, n) and column bits (int32, m) of a call */
+static int asso_weights_ok(Py_buffer *weight, Py_buffer *bit, int n, int m) {
+  return (weight->buf == NULL || weight->len >= (Py_ssize_t)(n * sizeof(unsigned long int)))
+      && (bit->buf == NULL || bit->len >= (Py_ssize_t)(m * sizeof(int)));
+}
+
+/* asso_buffer(D, n, m, k, W, H, WH[, weight, column_bit]) -> error; D, W, H, WH are
+ * contiguous uint8 buffers, weight and column_bit may be None */
+SWIGINTERN PyObject *_wrap_asso_buffer(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  Py_buffer d, w, h, wh, weight = {NULL}, bit = {NULL};
+  int n, m, k, result;
+  unsigned long int error = 0;
+
+  if (!PyArg_ParseTuple(args,(char *)"y*iiiw*w*w*|z*z*:asso_buffer",&d,&n,&m,&k,&w,&h,&wh,&weight,&bit)) return NULL;
+  if (n < 0 || m < 0 || k < 1 || d.len < (Py_ssize_t)n * m || w.len < (Py_ssize_t)n * k
+      || h.len < (Py_ssize_t)k * m || wh.len < (Py_ssize_t)n * m || !asso_weights_ok(&weight, &bit, n, m)) {
+    PyErr_SetString(PyExc_ValueError, "buffer sizes do not match the matrix dimensions");
+    result = -2;
+  } else {
+    Py_BEGIN_ALLOW_THREADS
+    result = asso_buffer((const unsigned char *)d.buf, n, m, k, (const unsigned long int *)weight.buf,
+                         (const int *)bit.buf, (unsigned char *)w.buf,
+                         (unsigned char *)h.buf, (unsigned char *)wh.buf, &error);
+    Py_END_ALLOW_THREADS
+    if (result != 0) PyErr_NoMemory();
+  }
+  PyBuffer_Release(&d);
+  PyBuffer_Release(&w);
+  PyBuffer_Release(&h);
+  PyBuffer_Release(&wh);
+  if (weight.obj != NULL) PyBuffer_Release(&weight);
+  if (bit.obj != NULL) PyBuffer_Release(&bit);
+  if (result != 0) return NULL;
+  return PyLong_FromUnsignedLong(error);
+}
+
+
+/* asso_sweep(D, n, m, K, S, B, best, error[, weight, column_bit, threads]) with S, B uint8,
+ * best int32 and error uint64 buffers, weight and column_bit as in asso_buffer, and at
+ * most threads threads (0: one per core) */
+SWIGINTERN PyObject *_wrap_asso_sweep(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  Py_buffer d, s, b, best, error, weight = {NULL}, bit = {NULL};
+  int n, m, k, threads = 0, result;
+
+  if (!PyArg_ParseTuple(args,(char *)"y*iiiw*w*w*w*|z*z*i:asso_sweep",&d,&n,&m,&k,&s,&b,&best,&error,&weight,&bit,&threads)) return NULL;
+  if (n < 0 || m < 0 || k < 1 || d.len < (Py_ssize_t)n * m
+      || s.len < (Py_ssize_t)N_THRESHOLDS * n * k || b.len < (Py_ssize_t)N_THRESHOLDS * k * m
+      || best.len < (Py_ssize_t)(k * sizeof(int)) || error.len < (Py_ssize_t)(k * sizeof(unsigned long int))
+      || !asso_weights_ok(&weight, &bit, n, m)) {
+    PyErr_SetString(PyExc_ValueError, "buffer sizes do not match the matrix dimensions");
+    result = -2;
+  } else {
+    Py_BEGIN_ALLOW_THREADS
+    result = asso_sweep_buffer((const unsigned char *)d.buf, n, m, k, (const unsigned long int *)weight.buf,
+                               (const int *)bit.buf, (unsigned char *)s.buf,
+                               (unsigned char *)b.buf, (int *)best.buf, (unsigned long int *)error.buf, threads);
+    Py_END_ALLOW_THREADS
+    if (result != 0) PyErr_NoMemory();
+  }
+  PyBuffer_Release(&d);
+  PyBuffer_Release(&s);
+  PyBuffer_Release(&b);
+  PyBuffer_Release(&best);
+  PyBuffer_Release(&error);
+  if (weight.obj != NULL) PyBuffer_Release(&weight);
+  if (bit.obj != NULL) PyBuffer_Release(&bit);
+  if (result != 0) return NULL;
+  Py_RETURN_NONE;
+}
+
 static PyMethodDef SwigMethods[] = {
 	 { (char *)"SWIG_PyInstanceMethod_New", (PyCFunction)SWIG_PyInstanceMethod_New, METH_O, NULL},
 	 { (char *)"asso", _wrap_asso, METH_VARARGS, NULL},
+	 { (char *)"asso_buffer", _wrap_asso_buffer, METH_VARARGS, NULL},
+	 { (char *)"asso_sweep", _wrap_asso_sweep, METH_VARARGS, NULL},
 	 { NULL, NULL, 0, NULL }
 };
 
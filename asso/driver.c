@@ -20,80 +20,45 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 */
 
+#define _POSIX_C_SOURCE 200809L
 #include "driver.h"
 #include "stdlib.h"
+#include <stdint.h>
+#include <pthread.h>
+#include <unistd.h>
 //#define DEBUG
 
+/* Thresholds tried by Asso, in the order ties are resolved */
+static const double thresholds[N_THRESHOLDS] = {0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1};
+
 /* The Main function */
 int asso(char *filename, int k)
 {
     // char *filename;	
     // int	k;
-    mwSize n, m, t_length, b_length;
-    int i, ti, bi, bestBonusCovered, bestPenaltyOvercovered;
-    unsigned long int error, bestError;
-    double bp, bn, bestThreshold;
-    matrix D, S, B, bestS, bestB;
-    options opti = {0,     /* error_max */
-		10,    /* cut_size */
-		0,     /* noisy_vectors */
-		0,     /* iterations */
-		1,     /* remove_covered */
-		0,     /* seed */
-		0,     /* verbose */
-		NULL,  /* original_basis */
-		1.0,   /* threshold */
-		0,     /* majority */
-		1,     /* bonus_covered */
-		1,     /* penalty_overcovered */
-		NULL}; /* decomp matrix */  
+    mwSize n, m;
+    matrix D, bestS, bestB;
+    arena a = {NULL}; /* everything allocated below */
 
     /* allocate memory and fill the matrix*/
     FILE *f;
+    int packed;
     // filename=argv[1];
     // k=atoi(argv[2]);
-    f = fopen(filename, "r");
+    f = fopen(filename, "rb");
     if(f==NULL){
         printf("Could not fine the input file...\n");
         return -1;
     }
-    D = (matrix)malloc(sizeof(vector));
-    int ch;
-    n = 0;
-    ch = fgetc(f);
-    while (ch!=EOF) {
-        vector temp = (vector)malloc(sizeof(char));
-        //printf("grabbed Line: %c",ch);
-        m = 0;
-        while (ch!='\n') {
-            if(ch=='1' || ch=='0') {
-                temp = (vector)realloc(temp,(m+1) * sizeof(char));
-                temp[m] = ch-'0';
-                m++;
-                ch = fgetc(f);
-                //printf("%c",ch);
-
-
-            }
-            else{
-                printf("Entry %c gave error...\n",ch);
-                printf("Entry other than 0 and 1 detected in the truthtable.\n");
-                return -1;
-            }
-        }
-        D = (matrix)realloc(D,(n+1) * sizeof(vector));
-        D[n] = temp;
-        n++;
-        ch=fgetc(f);
-    }
+    packed = is_packed(f);
+    if (packed) D = read_packed(f, &n, &m, &a);
+    else D = read_text(f, &n, &m, &a);
     fclose(f);
-
-    /* threshold t */
-    t_length = 10;
-    double t[10] = {0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1};
-
-    b_length = 1;
-    double b[1] = {1};
+    if (D == NULL) {
+        printf("Could not read truthtable %s.\n", filename);
+        arena_free(&a);
+        return -1;
+    }
 
 #ifdef DEBUG
     printf("n=%d and m=%d\n",n,m);
@@ -108,142 +73,405 @@ int asso(char *filename, int k)
 #endif
 
     /* Allocate memory for output arguments */
+    bestB = arena_matrix(&a, k, m, NULL);
+    bestS = arena_matrix(&a, n, k, NULL);
+    if (bestB == NULL || bestS == NULL) {
+        printf("Could not allocate memory for the factors.\n");
+        arena_free(&a);
+        return -1;
+    }
+
+    asso_factor(D, n, m, k, NULL, NULL, bestS, bestB);
+
+    char w_name[300];
+    sprintf(w_name, "%s_w_%d",filename,k);
+    write_matrix(w_name, bestS, n, k, packed);
+
+    char h_name[300];
+    sprintf(h_name, "%s_h_%d",filename,k);
+    write_matrix(h_name, bestB, k, m, packed);
+
+    char wh_name[300];
+    sprintf(wh_name, "%s_wh_%d",filename,k);
+    /* D is not needed anymore; reuse its rows for the Boolean product */
+    boolean_product(bestS, bestB, D, n, m, k);
+    write_matrix(wh_name, D, n, m, packed);
+
+    arena_free(&a);
+    //printf("Finished...\n");
+    return 0;
+    /* And that's all folks */
+}
+
 
-    B = (matrix)malloc(k * sizeof(vector));
-    for (i=0; i<k; i++) {
-        B[i] = (vector)malloc(m * sizeof(char));
-        memset(B[i], 0, m);
+/*
+ * Factorize the n x m matrix in the contiguous buffer data (one byte per
+ * entry, row-major). W (n x k), H (k x m) and their Boolean product WH
+ * (n x m) are written to buffers of the caller, in the same layout.
+ * weight and column_bit may be NULL, see options in approx.h.
+ * Does not touch any Python object, so it can run without the GIL.
+ */
+int asso_buffer(const unsigned char *data, mwSize n, mwSize m, int k,
+                const unsigned long int *weight, const int *column_bit,
+                unsigned char *w, unsigned char *h, unsigned char *wh,
+                unsigned long int *error)
+{
+    matrix D, S, B, P;
+    arena a = {NULL};
+
+    D = arena_matrix(&a, n, m, NULL);
+    S = arena_matrix(&a, n, k, w);
+    B = arena_matrix(&a, k, m, h);
+    P = arena_matrix(&a, n, m, wh);
+    if (D == NULL || S == NULL || B == NULL || P == NULL) {
+        arena_free(&a);
+        return -1;
     }
+    memcpy(D[0], data, (size_t)n * m);
 
-    S = (matrix)malloc(n * sizeof(vector));
-    for (i=0; i<n; i++) {
-        S[i] = (vector)malloc(k * sizeof(char));
-        memset(S[i], 0, k);
+    *error = asso_factor(D, n, m, k, weight, column_bit, S, B);
+    boolean_product(S, B, P, n, m, k);
+
+    arena_free(&a);
+    return 0;
+}
+
+
+/* Allocate size bytes owned by the arena a */
+void *arena_alloc(arena *a, size_t size)
+{
+    arena_block *block;
+
+    block = (arena_block *)malloc(sizeof(arena_block) + size + 1);
+    if (block == NULL) return NULL;
+    block->next = a->head;
+    a->head = block;
+    return (void *)(block + 1);
+}
+
+/*
+ * rows x cols matrix owned by the arena a, with rows consecutive in data,
+ * or in a new zero-filled block if data is NULL
+ */
+matrix arena_matrix(arena *a, mwSize rows, mwSize cols, unsigned char *data)
+{
+    matrix M;
+    mwSize i;
+
+    M = (matrix)arena_alloc(a, (rows + 1) * sizeof(vector));
+    if (M == NULL) return NULL;
+    if (data == NULL) {
+        data = (unsigned char *)arena_alloc(a, (size_t)rows * cols);
+        if (data == NULL) return NULL;
+        memset(data, 0, (size_t)rows * cols);
     }
+    for (i=0; i<rows; i++) M[i] = (vector)data + (size_t)i * cols;
+    return M;
+}
 
-    bestB = (matrix)malloc(k * sizeof(vector));
-    for (i=0; i<k; i++) {
-        bestB[i] = (vector)malloc(m * sizeof(char));
-        memset(bestB[i], 0, m);
+/* Free everything allocated in the arena a */
+void arena_free(arena *a)
+{
+    arena_block *next;
+
+    while (a->head != NULL) {
+        next = a->head->next;
+        free(a->head);
+        a->head = next;
     }
+}
 
-    bestS = (matrix)malloc(n * sizeof(vector));
-    for (i=0; i<n; i++) {
-        bestS[i] = (vector)malloc(k * sizeof(char));
-        memset(bestS[i], 0, k);
+
+/*
+ * State shared by the threads of a threshold sweep. Threads take the
+ * thresholds in increasing order. Once some threshold reaches zero error,
+ * later thresholds cannot be chosen anymore (ties go to the first one) and
+ * are skipped.
+ */
+typedef struct {
+    matrix D;
+    mwSize n, m;
+    int k;
+    const unsigned long int *weight;  /* multiplicity of each row of D */
+    const int *column_bit;         /* objective weight of each column */
+    int all_prefixes;              /* zero error means zero for every prefix */
+    int threads;                   /* most threads to run, 0 for one per core */
+    double *assoc;                 /* association matrix of D */
+    matrix S[N_THRESHOLDS];        /* n x k factor of every threshold */
+    matrix B[N_THRESHOLDS];        /* k x m factor of every threshold */
+    unsigned long int *err[N_THRESHOLDS]; /* prefix errors of every threshold */
+    int ran[N_THRESHOLDS];
+    int next;                      /* next threshold to run */
+    int zero;                      /* first threshold with zero error */
+    pthread_mutex_t lock;
+} sweep;
+
+static void *sweep_worker(void *arg)
+{
+    sweep *sw = (sweep *)arg;
+    int ti, l, zero;
+    options opti = {0,     /* error_max */
+		10,    /* cut_size */
+		0,     /* noisy_vectors */
+		0,     /* iterations */
+		1,     /* remove_covered */
+		0,     /* seed */
+		0,     /* verbose */
+		NULL,  /* original_basis */
+		1.0,   /* threshold */
+		0,     /* majority */
+		1,     /* bonus_covered */
+		1,     /* penalty_overcovered */
+		NULL,  /* decomp matrix */
+		sw->weight,     /* row_weight */
+		sw->column_bit}; /* column_bit */
+
+    for (;;) {
+        pthread_mutex_lock(&sw->lock);
+        ti = sw->next++;
+        if (ti > sw->zero) ti = N_THRESHOLDS;
+        pthread_mutex_unlock(&sw->lock);
+        if (ti >= N_THRESHOLDS) break;
+
+        opti.threshold = thresholds[ti];
+        if (approximate_association(sw->D, sw->n, sw->m, sw->assoc, sw->B[ti], sw->k, sw->S[ti], &opti) != 1)
+            printf("Asso failed.\n");
+        prefix_errors(sw->D, sw->weight, sw->S[ti], sw->B[ti], sw->n, sw->m, sw->k, sw->err[ti]);
+        sw->ran[ti] = 1;
+
+        zero = sw->err[ti][sw->k-1] == 0;
+        for (l=0; sw->all_prefixes && l<sw->k; l++) zero = zero && sw->err[ti][l] == 0;
+        if (zero) {
+            pthread_mutex_lock(&sw->lock);
+            if (ti < sw->zero) sw->zero = ti;
+            pthread_mutex_unlock(&sw->lock);
+        }
     }
+    return NULL;
+}
 
-    /* make bestError big enough */
-    bestError = ULONG_MAX;
-    bestThreshold = -1;
-    bestBonusCovered = -1;
-    bestPenaltyOvercovered = -1;
-
-    /* Iterate over all values of t and bonus */
-    for (ti=0; ti<t_length; ti++) {
-        /* set threshold */
-        opti.threshold = t[ti];
-#ifdef DEBUG
-        printf("\nTi set to: %f\n",t[ti]);
-#endif
-        for (bi=0; bi<b_length; bi++) {
+/* Run Asso on sw->D for every threshold, in up to sw->threads threads */
+static int run_sweep(sweep *sw)
+{
+    pthread_t threads[N_THRESHOLDS];
+    long cores;
+    int i, nthreads, started;
+
+    sw->assoc = association_matrix(sw->D, sw->n, sw->m, sw->weight);
+    if (sw->assoc == NULL) return -1;
+    memset(sw->ran, 0, sizeof(sw->ran));
+    sw->next = 0;
+    sw->zero = N_THRESHOLDS;
+    pthread_mutex_init(&sw->lock, NULL);
+
+    cores = sw->threads > 0 ? sw->threads : sysconf(_SC_NPROCESSORS_ONLN);
+    nthreads = (cores < 1) ? 1 : (cores > N_THRESHOLDS) ? N_THRESHOLDS : (int)cores;
+    started = 0;
+    for (i=1; i<nthreads; i++) {
+        if (pthread_create(&threads[started], NULL, sweep_worker, sw) != 0) break;
+        started++;
+    }
+    /* The calling thread works too */
+    sweep_worker(sw);
+    for (i=0; i<started; i++) pthread_join(threads[i], NULL);
 
+    pthread_mutex_destroy(&sw->lock);
+    free(sw->assoc);
+    return 0;
+}
 
-            // Divide b to positive and negative bonus, b = bp / bn 
-            // bn = modf(b[bi], &bp);
-            if (b[bi] >= 0) {bp = b[bi]; bn = 1;}
-            else {bp = 1; bn = -1*b[bi];}
+/* Allocate the per-threshold factors and errors of a sweep in the arena a */
+static int alloc_sweep(sweep *sw, unsigned char *s, unsigned char *b, arena *a)
+{
+    int ti;
+
+    if (s == NULL) s = (unsigned char *)arena_alloc(a, (size_t)N_THRESHOLDS * sw->n * sw->k);
+    if (b == NULL) b = (unsigned char *)arena_alloc(a, (size_t)N_THRESHOLDS * sw->k * sw->m);
+    if (s == NULL || b == NULL) return -1;
+    memset(s, 0, (size_t)N_THRESHOLDS * sw->n * sw->k);
+    memset(b, 0, (size_t)N_THRESHOLDS * sw->k * sw->m);
+    for (ti=0; ti<N_THRESHOLDS; ti++) {
+        sw->S[ti] = arena_matrix(a, sw->n, sw->k, s + (size_t)ti * sw->n * sw->k);
+        sw->B[ti] = arena_matrix(a, sw->k, sw->m, b + (size_t)ti * sw->k * sw->m);
+        sw->err[ti] = (unsigned long int *)arena_alloc(a, (sw->k + 1) * sizeof(unsigned long int));
+        if (sw->S[ti] == NULL || sw->B[ti] == NULL || sw->err[ti] == NULL) return -1;
+    }
+    return 0;
+}
 
-            // DEBUG
-#ifdef DEBUG
-            printf("b[bi] = %f, bn = %f, bp = %f, 1/bn=%f\n", b[bi], bn, bp, 1/bn);
-#endif
-            opti.bonus_covered = (bp < 1)?1:(int)bp;
-            opti.penalty_overcovered = (bn < 1)?1:(int)bn;
 
-            // DEBUG
-#ifdef DEBUG
-            printf("t = %f, b_covered = %i, b_overcovered = %i\n", opti.threshold,\
-		            opti.bonus_covered, opti.penalty_overcovered);
-#endif
+/*
+ * Run Asso on D for all thresholds and keep the factorization with the
+ * smallest error in bestS (n x k) and bestB (k x m). Return that error.
+ * Row i of D stands for weight[i] equal rows if weight is not NULL.
+ */
+unsigned long int asso_factor(matrix D, mwSize n, mwSize m, int k,
+                              const unsigned long int *weight, const int *column_bit,
+                              matrix bestS, matrix bestB)
+{
+    sweep sw;
+    unsigned long int bestError;
+    mwSize i;
+    int ti, best;
+    arena a = {NULL};
+
+    sw.D = D;
+    sw.n = n;
+    sw.m = m;
+    sw.k = k;
+    sw.weight = weight;
+    sw.column_bit = column_bit;
+    sw.all_prefixes = 0;
+    sw.threads = 0;
+    if (alloc_sweep(&sw, NULL, NULL, &a) != 0 || run_sweep(&sw) != 0) {
+        printf("Asso failed.\n");
+        arena_free(&a);
+        return ULONG_MAX;
+    }
 
-            if (approximate(D, n, m, B, k, S, &opti) != 1) 
-	            printf("Asso failed.\n");
+    /* make bestError big enough */
+    bestError = ULONG_MAX;
+    best = 0;
+    for (ti=0; ti<N_THRESHOLDS; ti++) {
+        if (sw.ran[ti] && sw.err[ti][k-1] < bestError) {
+            bestError = sw.err[ti][k-1];
+            best = ti;
+        }
+    }
+    for (i=0; i<(mwSize)k; i++) memcpy(bestB[i], sw.B[best][i], m);
+    for (i=0; i<n; i++) memcpy(bestS[i], sw.S[best][i], k);
 
-            error = sab(D, S, B, n, m, k, "uniform");
+    arena_free(&a);
+    return bestError;
+}
 
-            // DEBUG
-#ifdef DEBUG
-            printf("bestError = %lu, error = %lu\n", bestError, error);
-#endif
 
-            if (error < bestError) {
-	            bestError = error;
-	            bestThreshold = opti.threshold;
-	            bestBonusCovered = opti.bonus_covered;
-	            bestPenaltyOvercovered = opti.penalty_overcovered;
-	            for (i=0; i<k; i++) {
-	                memcpy(bestB[i], B[i], m);
-	            }
-	            for (i=0; i<n; i++) {
-	                memcpy(bestS[i], S[i], k);
-	            }
-	            // DEBUG
-#ifdef DEBUG
-	            printf("bestError = %lu was bigger than error = %lu\n", \
-		                bestError, error);
-#endif
+/*
+ * Factorize the n x m matrix in data (as in asso_buffer) to every degree
+ * 1..K with a single threshold sweep at degree K. Basis vectors are chosen
+ * greedily, so the first k of them are the degree-k answer of the same
+ * threshold. weight and column_bit are as in asso_buffer. s (N_THRESHOLDS x n x K) and b (N_THRESHOLDS x K x m) receive
+ * the factors of every threshold; best[k-1] is the threshold with the
+ * smallest error for degree k (the first one on ties, like asso_factor)
+ * and error[k-1] is that error. The sweep runs in at most threads threads
+ * (0: one per core), so that callers running several sweeps at once can
+ * share the cores between them.
+ */
+int asso_sweep_buffer(const unsigned char *data, mwSize n, mwSize m, int K,
+                      const unsigned long int *weight, const int *column_bit,
+                      unsigned char *s, unsigned char *b, int *best,
+                      unsigned long int *error, int threads)
+{
+    sweep sw;
+    int ti, k, result;
+    arena a = {NULL};
 
+    sw.D = arena_matrix(&a, n, m, NULL);
+    if (sw.D == NULL) {
+        arena_free(&a);
+        return -1;
+    }
+    memcpy(sw.D[0], data, (size_t)n * m);
+    sw.n = n;
+    sw.m = m;
+    sw.k = K;
+    sw.weight = weight;
+    sw.column_bit = column_bit;
+    sw.all_prefixes = 1;
+    sw.threads = threads;
+    result = -1;
+    if (alloc_sweep(&sw, s, b, &a) == 0 && run_sweep(&sw) == 0) {
+        for (k=0; k<K; k++) {
+            error[k] = ULONG_MAX;
+            best[k] = 0;
+            for (ti=0; ti<N_THRESHOLDS; ti++) {
+                if (sw.ran[ti] && sw.err[ti][k] < error[k]) {
+                    error[k] = sw.err[ti][k];
+                    best[k] = ti;
+                }
             }
+        }
+        result = 0;
+    }
 
-            // Clear B and S
-            for (i=0; i<k; i++) memset(B[i], 0, m);
-            for (i=0; i<n; i++) memset(S[i], 0, k);
+    arena_free(&a);
+    return result;
+}
 
-        }
+/*
+ * err[k-1] = sab(D, S, B) for the first k columns of S and rows of B,
+ * for every k = 1..K at once. Row i counts weight[i] times if weight is
+ * not NULL.
+ */
+void prefix_errors(matrix D, const unsigned long int *weight, matrix S, matrix B,
+                   mwSize n, mwSize m, int K, unsigned long int *err)
+{
+    unsigned long int *hist0, *hist1, ones, zeros, wi;
+    uint64_t *bcol, srow;
+    mwSize i, j;
+    int l, k, first;
+
+    /* Entry (i, j) is covered by every prefix longer than the first basis
+     * vector covering it; count those per data value */
+    hist0 = (unsigned long int *)calloc(K + 1, sizeof(unsigned long int));
+    hist1 = (unsigned long int *)calloc(K + 1, sizeof(unsigned long int));
+    bcol = (uint64_t *)calloc(m + 1, sizeof(uint64_t));
+    if (K < 64) {
+        for (l=0; l<K; l++)
+            for (j=0; j<m; j++)
+                if (B[l][j]) bcol[j] |= (uint64_t)1 << l;
     }
 
-    char w_name[300];
-    sprintf(w_name, "%s_w_%d",filename,k);
-    f=fopen(w_name,"w");
-    for(int i=0;i<n;i++){
-        for(int j=0;j<k;j++){
-            fprintf(f,"%d ",bestS[i][j]);
+    for (i=0; i<n; i++) {
+        wi = weight != NULL ? weight[i] : 1;
+        srow = 0;
+        if (K < 64) {
+            for (l=0; l<K; l++)
+                if (S[i][l]) srow |= (uint64_t)1 << l;
+        }
+        for (j=0; j<m; j++) {
+            if (K < 64) {
+                first = (srow & bcol[j]) ? __builtin_ctzll(srow & bcol[j]) : K;
+            } else {
+                for (first=0; first<K; first++)
+                    if (S[i][first] == 1 && B[first][j] == 1) break;
+            }
+            if (D[i][j]) hist1[first] += wi;
+            else hist0[first] += wi;
         }
-        fprintf(f,"\n");
     }
-    fclose(f);
 
-    char h_name[300];
-    sprintf(h_name, "%s_h_%d",filename,k);
-    f=fopen(h_name,"w");
-    for(int i=0;i<k;i++){
-        for(int j=0;j<m;j++){
-            fprintf(f,"%d ",bestB[i][j]);
-        }
-        fprintf(f,"\n");
+    /* err[k-1] = uncovered 1s (first >= k) + covered 0s (first < k) */
+    ones = 0;
+    for (l=0; l<=K; l++) ones += hist1[l];
+    zeros = 0;
+    for (k=1; k<=K; k++) {
+        ones -= hist1[k-1];
+        zeros += hist0[k-1];
+        err[k-1] = ones + zeros;
     }
-    fclose(f);
 
-    char wh_name[300];
-    int element;
-    sprintf(wh_name, "%s_wh_%d",filename,k);
-    f=fopen(wh_name,"w");
-    for(int i=0;i<n;i++){
-        for(int j=0;j<m;j++){
+    free(hist0);
+    free(hist1);
+    free(bcol);
+}
+
+
+/* P = S o B, the Boolean product of S (n x k) and B (k x m) */
+void boolean_product(matrix S, matrix B, matrix P, mwSize n, mwSize m, int k)
+{
+    mwSize i, j;
+    int l, element;
+
+    for (i=0; i<n; i++) {
+        for (j=0; j<m; j++) {
             element=0;
-            for(int l=0;l<k;l++){
-                element+=bestS[i][l]*bestB[l][j];
+            for (l=0; l<k; l++) {
+                element+=S[i][l]*B[l][j];
             }
-            fprintf(f,"%d ",(element!=0));
+            P[i][j] = (element!=0);
         }
-        fprintf(f,"\n");
     }
-    fclose(f);
-
-    //printf("Finished...\n");
-    return 0;
-    /* And that's all folks */
 }
 
 
@@ -286,3 +514,170 @@ unsigned long int sab(matrix A, matrix B, matrix C, int n, int m, int k, char* m
     }
     return error;
 }
+
+
+/* Check for the header of a bit-packed truthtable (see utils/truthtable.py) */
+int is_packed(FILE *f)
+{
+    char magic[TRUTH_MAGIC_LEN];
+    int packed;
+
+    packed = fread(magic, 1, TRUTH_MAGIC_LEN, f) == TRUTH_MAGIC_LEN
+        && memcmp(magic, TRUTH_MAGIC, TRUTH_MAGIC_LEN) == 0;
+    rewind(f);
+    return packed;
+}
+
+static unsigned long long get_le(const unsigned char *p, int bytes)
+{
+    unsigned long long value = 0;
+    int i;
+
+    for (i = bytes - 1; i >= 0; i--) value = (value << 8) | p[i];
+    return value;
+}
+
+static void put_le(unsigned char *p, unsigned long long value, int bytes)
+{
+    int i;
+
+    for (i = 0; i < bytes; i++) {
+        p[i] = value & 0xff;
+        value >>= 8;
+    }
+}
+
+/* Read a bit-packed truthtable into the arena a; bit b of a row is column cols-1-b */
+matrix read_packed(FILE *f, mwSize *rows, mwSize *cols, arena *a)
+{
+    unsigned char header[TRUTH_HEADER_LEN], *buf;
+    unsigned long long i, j, words, bit;
+    matrix M;
+
+    if (fread(header, 1, TRUTH_HEADER_LEN, f) != TRUTH_HEADER_LEN) return NULL;
+    *rows = get_le(header + 8, 8);
+    *cols = get_le(header + 16, 8);
+    words = (*cols + 63) / 64;
+
+    buf = (unsigned char *)arena_alloc(a, words * 8);
+    M = arena_matrix(a, *rows, *cols, NULL);
+    if (buf == NULL || M == NULL) return NULL;
+    for (i = 0; i < *rows; i++) {
+        if (fread(buf, 8, words, f) != words) return NULL;
+        for (j = 0; j < *cols; j++) {
+            bit = *cols - 1 - j;
+            M[i][j] = (buf[bit / 8] >> (bit % 8)) & 1;
+        }
+    }
+    return M;
+}
+
+/* Read a text truthtable (one line of 0/1 digits per row) into the arena a */
+matrix read_text(FILE *f, mwSize *rows, mwSize *cols, arena *a)
+{
+    unsigned char *text, *grown;
+    size_t size, len, i, row_start;
+    mwSize r;
+    matrix M;
+    int ch;
+
+    /* Slurp the file, then split it into rows */
+    size = 4096;
+    len = 0;
+    text = (unsigned char *)malloc(size);
+    if (text == NULL) return NULL;
+    while ((ch = fgetc(f)) != EOF) {
+        if (len == size) {
+            size *= 2;
+            grown = (unsigned char *)realloc(text, size);
+            if (grown == NULL) {
+                free(text);
+                return NULL;
+            }
+            text = grown;
+        }
+        text[len++] = (unsigned char)ch;
+    }
+    if (len > 0 && text[len-1] != '\n') {
+        printf("Truthtable does not end with a newline.\n");
+        free(text);
+        return NULL;
+    }
+
+    *rows = 0;
+    *cols = 0;
+    for (i = 0; i < len; i++) {
+        if (text[i] == '\n') {
+            if (*rows == 0) *cols = i;
+            (*rows)++;
+        } else if (text[i] != '0' && text[i] != '1') {
+            printf("Entry %c gave error...\n",text[i]);
+            printf("Entry other than 0 and 1 detected in the truthtable.\n");
+            free(text);
+            return NULL;
+        }
+    }
+
+    M = arena_matrix(a, *rows, *cols, NULL);
+    if (M == NULL) {
+        free(text);
+        return NULL;
+    }
+    row_start = 0;
+    r = 0;
+    for (i = 0; i < len; i++) {
+        if (text[i] != '\n') continue;
+        if (i - row_start != *cols) {
+            printf("Rows of the truthtable differ in length.\n");
+            free(text);
+            return NULL;
+        }
+        for (size_t j = 0; j < *cols; j++) M[r][j] = text[row_start + j] - '0';
+        r++;
+        row_start = i + 1;
+    }
+    free(text);
+    return M;
+}
+
+/* Write a 0/1 matrix either as bit-packed truthtable or as text */
+int write_matrix(const char *name, matrix M, int rows, int cols, int packed)
+{
+    unsigned char header[TRUTH_HEADER_LEN], *buf;
+    int i, j, bit, words;
+    FILE *f;
+
+    f = fopen(name, packed ? "wb" : "w");
+    if (f == NULL) {
+        printf("Could not open %s for writing.\n", name);
+        return -1;
+    }
+    if (!packed) {
+        for (i = 0; i < rows; i++) {
+            for (j = 0; j < cols; j++) fprintf(f, "%d ", M[i][j]);
+            fprintf(f, "\n");
+        }
+        fclose(f);
+        return 0;
+    }
+
+    words = (cols + 63) / 64;
+    memcpy(header, TRUTH_MAGIC, TRUTH_MAGIC_LEN);
+    put_le(header + 4, TRUTH_VERSION, 4);
+    put_le(header + 8, rows, 8);
+    put_le(header + 16, cols, 8);
+    fwrite(header, 1, TRUTH_HEADER_LEN, f);
+
+    buf = (unsigned char *)malloc(words * 8 + 1);
+    for (i = 0; i < rows; i++) {
+        memset(buf, 0, words * 8);
+        for (j = 0; j < cols; j++) {
+            bit = cols - 1 - j;
+            if (M[i][j]) buf[bit / 8] |= 1 << (bit % 8);
+        }
+        fwrite(buf, 8, words, f);
+    }
+    free(buf);
+    fclose(f);
+    return 0;
+}
@@ -36,7 +36,48 @@ SOFTWARE.
  */
 typedef unsigned int mwSize;
 
+/* Header of bit-packed truthtables: magic, uint32 version, uint64 rows, uint64 cols */
+#define TRUTH_MAGIC "BLTT"
+#define TRUTH_MAGIC_LEN 4
+#define TRUTH_VERSION 1
+#define TRUTH_HEADER_LEN 24
+
+/* Number of thresholds in Asso's sweep */
+#define N_THRESHOLDS 10
+
+/* Memory of one call, released at once by arena_free */
+typedef struct arena_block {
+    struct arena_block *next;
+    double align;
+} arena_block;
+
+typedef struct {
+    arena_block *head;
+} arena;
+
+void *arena_alloc(arena *a, size_t size);
+matrix arena_matrix(arena *a, mwSize rows, mwSize cols, unsigned char *data);
+void arena_free(arena *a);
+
 unsigned long int sab(matrix A, matrix B, matrix C, int n, int m, int k, char *mode);
 int asso(char* filename, int k);
+int asso_buffer(const unsigned char *data, mwSize n, mwSize m, int k,
+                const unsigned long int *weight, const int *column_bit,
+                unsigned char *w, unsigned char *h, unsigned char *wh,
+                unsigned long int *error);
+unsigned long int asso_factor(matrix D, mwSize n, mwSize m, int k,
+                              const unsigned long int *weight, const int *column_bit,
+                              matrix bestS, matrix bestB);
+int asso_sweep_buffer(const unsigned char *data, mwSize n, mwSize m, int K,
+                      const unsigned long int *weight, const int *column_bit,
+                      unsigned char *s, unsigned char *b, int *best,
+                      unsigned long int *error, int threads);
+void prefix_errors(matrix D, const unsigned long int *weight, matrix S, matrix B,
+                   mwSize n, mwSize m, int K, unsigned long int *err);
+void boolean_product(matrix S, matrix B, matrix P, mwSize n, mwSize m, int k);
+int is_packed(FILE *f);
+matrix read_packed(FILE *f, mwSize *rows, mwSize *cols, arena *a);
+matrix read_text(FILE *f, mwSize *rows, mwSize *cols, arena *a);
+int write_matrix(const char *name, matrix M, int rows, int cols, int packed);
 
 #endif
@@ -0,0 +1,65 @@
+'''
+Compare the in-process BDD logic generator of utils/logic.py with ABC
+(bdd;order) on the W matrices of factorized arithmetic truth tables, e.g.
+
+    python3 bench/logic_bench.py -n 8,12,16 --abc /usr/local/bin/abc
+'''
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.bmf import asso_degrees
+from utils.logic import bdd_verilog, literals
+from utils.utils import abc_formulas
+
+
+def arithmetic_truth(n, op):
+    '''
+    Truth table (2^n x m) of op on the two halves of the input bits, the
+    most significant output bit first as in BLASYS truth tables
+    '''
+    j = np.arange(2 ** n, dtype=np.int64)
+    a, b = j >> (n // 2), j & ((1 << (n // 2)) - 1)
+    value = a + b if op == 'add' else a * b
+    m = max(1, int(value.max()).bit_length())
+    return np.stack([(value >> (m - 1 - c)) & 1 for c in range(m)], axis=1).astype(np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark logic generation of W')
+    parser.add_argument('-n', help='Numbers of inputs', default='8,12,16', dest='inputs')
+    parser.add_argument('--op', help='Arithmetic functions', default='add,mul', dest='op')
+    parser.add_argument('--abc', help='Path to ABC (default: abc on PATH)', default=shutil.which('abc'), dest='abc')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    truth_file = os.path.join(tmp, 'formula.truth')
+    print('{:>6}{:>6}{:>4}{:>12}{:>12}{:>12}{:>12}'.format('Op', 'n', 'k', 'Native', 'Native(s)', 'ABC', 'ABC(s)'))
+    for op in args.op.split(','):
+        for n in map(int, args.inputs.split(',')):
+            truth = arithmetic_truth(n, op)
+            for k, (W, _, _, _) in enumerate(asso_degrees(truth), 1):
+                columns = [i for i in range(k) if W[:, i].any()]
+                W = W[:, columns]
+
+                before = time.time()
+                native = literals(bdd_verilog(W, n, ['k'+str(i) for i in columns]))
+                native_time = time.time() - before
+
+                abc, abc_time = '-', '-'
+                if args.abc is not None:
+                    before = time.time()
+                    formulas = abc_formulas(n, W, truth_file, args.abc)
+                    abc_time = '{:.4f}'.format(time.time() - before)
+                    abc = literals(''.join('assign x = ' + f + ';' for f in formulas))
+
+                print('{:>6}{:>6}{:>4}{:>12}{:>12.4f}{:>12}{:>12}'.format(op, n, k, native, native_time, abc, abc_time))
+
+
+if __name__ == '__main__':
+    main()
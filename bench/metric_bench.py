@@ -0,0 +1,79 @@
+'''
+Compare the vectorized error metrics of utils/metric.py with the former
+per-character implementation on random truth tables, e.g.
+
+    python3 bench/metric_bench.py -n 10000,1000000 -m 16,64,130
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.metric import distance, Hamming_Distance, Weighted_HD
+from utils.truthtable import save_truth
+
+
+def legacy_distance(original_path, approximate_path):
+    '''
+    metric.distance as implemented before the vectorized kernels
+    '''
+    with open(original_path, 'r') as fo:
+        org_line_list = fo.readlines()
+    with open(approximate_path, 'r') as fa:
+        app_line_list = fa.readlines()
+    org = [list(filter(lambda a: a != ' ', list(i[:-1]))) for i in org_line_list]
+    app = [list(filter(lambda a: a != ' ', list(i[:-1]))) for i in app_line_list]
+    HD = Hamming_Distance(org, app)
+    MAE = Weighted_HD(org, app)[0]
+    MAE_P = Weighted_HD(org, app)[1]
+    return [HD, MAE, MAE_P]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark error metric kernels')
+    parser.add_argument('-n', help='Numbers of vectors', default='10000,1000000', dest='num')
+    parser.add_argument('-m', help='Output widths', default='16,64,130', dest='width')
+    parser.add_argument('--legacy-limit', help='Skip legacy kernels above this many bits', type=int, default=20000000, dest='limit')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tmp = tempfile.mkdtemp()
+    print('{:>10}{:>8}{:>14}{:>14}{:>14}{:>10}'.format('Vectors', 'Width', 'Legacy(s)', 'Text(s)', 'Packed(s)', 'Speedup'))
+    for num in map(int, args.num.split(',')):
+        for width in map(int, args.width.split(',')):
+            org = rng.integers(0, 2, (num, width), dtype=np.uint8)
+            app = org ^ (rng.random((num, width)) < 0.05)
+            paths = {}
+            for fmt, packed in (('text', False), ('packed', True)):
+                paths[fmt] = [os.path.join(tmp, '{}_{}.truth'.format(fmt, i)) for i in range(2)]
+                save_truth(paths[fmt][0], org, packed)
+                save_truth(paths[fmt][1], app, packed)
+
+            before = time.time()
+            _, text_result = distance(*paths['text'])
+            text_time = time.time() - before
+
+            before = time.time()
+            _, packed_result = distance(*paths['packed'])
+            packed_time = time.time() - before
+            assert text_result == packed_result
+
+            legacy = 'skipped'
+            speedup = '-'
+            # Legacy MAE overflows int64 beyond 63 output bits
+            if num * width <= args.limit and width < 64:
+                before = time.time()
+                legacy_result = legacy_distance(*paths['text'])
+                legacy_time = time.time() - before
+                assert np.allclose(legacy_result, packed_result)
+                legacy = '{:.4f}'.format(legacy_time)
+                speedup = '{:.1f}x'.format(legacy_time / packed_time)
+
+            print('{:>10}{:>8}{:>14}{:>14.4f}{:>14.4f}{:>10}'.format(num, width, legacy, text_time, packed_time, speedup))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 from utils.greedyWorker import GreedyWorker
 from utils.banner import print_banner
+from utils.utils import asso_api
+from utils.cache import FactorCache, SynthCache
 import yaml
 import argparse
 import os
@@ -29,6 +31,19 @@ def main():
     parser.add_argument('--weight', help='Use weight in error metric', dest='use_weight', action='store_true')
     parser.add_argument('--single', help='Factorize without partition', dest='single', action='store_true')
     parser.add_argument('--track', help='Number of tracks in greedy search', dest='track', type=int, default=3)
+    parser.add_argument('--iverilog', help='Simulate with iverilog instead of the built-in simulator', dest='iverilog', action='store_true')
+    parser.add_argument('--batch-sim', help='Simulate all candidates of an iteration in one iverilog run', dest='batch_sim', action='store_true')
+    parser.add_argument('--bmf', help='Factorization backend: compiled ASSO or NumPy', dest='bmf', choices=['asso', 'numpy'], default='asso')
+    parser.add_argument('--logic', help='Synthesize the W functions with ABC or in-process BDDs', dest='logic', choices=['abc', 'native'], default='abc')
+    parser.add_argument('--cache', help='Directory of a factorization cache shared across runs', dest='cache', default=None)
+    parser.add_argument('--synth-cache', help='Directory of a synthesis cache shared across runs', dest='synth_cache', default=None)
+    parser.add_argument('--cache-size', help='Size limit of each cache in MB', dest='cache_size', type=int, default=1024)
+    parser.add_argument('--hier-synth', help='Rank candidates by separately synthesized partitions and synthesize only the ranked ones flat', dest='hier_synth', action='store_true')
+    parser.add_argument('--screen', help='Synthesize only this many candidates per track, ranked by estimated area', dest='screen', type=int, default=None)
+    parser.add_argument('--light-abc', help='ABC script of a light synthesis tier for all candidates, e.g. "strash;dc2;map"', dest='light_abc', default=None)
+    parser.add_argument('--batch-sta', help='Analyze timing and power of all candidates in one long-lived OpenSTA process per core', dest='batch_sta', action='store_true')
+    parser.add_argument('--prefetch', help='Approximate all partitions at all reachable degrees before the search', dest='prefetch', action='store_true')
+    parser.add_argument('--text-truth', help='Store truth tables as text instead of bit-packed files', dest='text_truth', action='store_true')
 
     args = parser.parse_args()
 
@@ -45,6 +60,21 @@ def main():
         threshold_list = list(map(float, args.threshold.split(',')))
 
     worker = GreedyWorker(args.input, args.liberty, config, args.testbench)
+    worker.native_sim = not args.iverilog
+    worker.packed_truth = not args.text_truth
+    worker.batch_sim = args.batch_sim
+    worker.bmf_backend = args.bmf
+    worker.logic = args.logic
+    worker.hier_synth = args.hier_synth
+    worker.screen = args.screen
+    worker.light_abc = args.light_abc
+    worker.batch_sta = args.batch_sta
+    if args.cache is not None:
+        worker.cache = FactorCache(args.cache, args.cache_size << 20)
+    if args.synth_cache is not None:
+        worker.synth_cache = SynthCache(args.synth_cache, args.cache_size << 20)
+    if args.bmf == 'asso' and asso_api is None:
+        print('Cannot load _asso.so (run make). Factorizing with the NumPy backend.')
     worker.create_output_dir(args.output)
     pis, pos = worker.evaluate_initial()
     if args.single is not True:
@@ -54,10 +84,16 @@ def main():
         else:
             worker.recursive_partitioning(args.npart)
 
+        if args.prefetch:
+            worker.prefetch(args.stepsize)
         worker.greedy_opt(args.parallel, args.stepsize, threshold_list, use_weight=args.use_weight, track=args.track)
     else:
         worker.blasys(args.use_weight)
 
+    if worker.synth_cache is not None:
+        print(worker.synth_cache.report())
+        worker.synth_cache.close()
+
 
 if __name__ == '__main__':
     if len(sys.argv) == 1:
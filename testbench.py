@@ -1,18 +1,20 @@
 import regex as re
 import sys
-import random
 import os
 import argparse
 import subprocess
 import time
 import regex as re
 from utils.banner import print_banner
+from utils.create_tb import write_stimulus
+from utils.yosys import run_yosys
+from utils.cache import SynthCache
 import yaml
 
-def create_testbench(input_file, output_file, num, yosys):
+def create_testbench(input_file, output_file, num, yosys, seed=None, cache=None):
 
     f = open(output_file, 'w')
-    modulename, port_list, inp, n_inputs, out, n_outputs = module_info(input_file, yosys)
+    modulename, port_list, inp, n_inputs, out, n_outputs = module_info(input_file, yosys, cache)
 
     f.write("module "+modulename+"_tb;\n")
     f.write('reg ['+str(n_inputs-1)+':0] pi;\n')
@@ -78,39 +80,33 @@ def create_testbench(input_file, output_file, num, yosys):
     f.write(');\n')
         
 
-    f.write("initial\n")
-    f.write("begin\n")
     if n_inputs >= 17:
-        j=1
-        while j <= int(num):
-            f.write('# 1  pi='+str(n_inputs)+'\'b')
-            i=1
-            while i <= n_inputs:
-                n=random.randint(0, 1)
-                i+=1
-                f.write(str(n))
-            f.write(';\n')
-            f.write("#1 $display(\"%b\", po);\n")
-            j+=1
+        seed = write_stimulus(f, n_inputs, num, seed)
+        print('Random test vectors generated from seed', seed)
     else:
-        for j in range(2**n_inputs):
-            f.write('# 1  pi='+str(n_inputs)+'\'b')
-            f.write('{0:0>{1}}'.format(str(bin(j))[2:], n_inputs))
-            f.write(';\n')
-            f.write("#1 $display(\"%b\", po);\n")
-                       
-    f.write("end\n")
+        write_stimulus(f, n_inputs)
     f.write("endmodule\n")
 
     f.close()
 
 
 
-def module_info(fname, yosys_path):
+def module_info(fname, yosys_path, cache=None):
 
     tmp = time.strftime('%Y_%m_%d-%H_%m_%s') + '.v'
-    yosys_command = 'read_verilog ' + fname + '; synth -flatten; opt; opt_clean; techmap; write_verilog ' + tmp + ';\n'
-    subprocess.call([yosys_path, '-p', yosys_command], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    entry = None
+    if cache is not None:
+        key = cache.key('module_info', [fname])
+        entry = cache.get(key)
+    if entry is not None:
+        with open(tmp, 'w') as f:
+            f.write(entry['netlist'])
+    else:
+        yosys_command = 'read_verilog ' + fname + '; synth -flatten; opt; opt_clean; techmap; write_verilog ' + tmp + ';\n'
+        run_yosys(yosys_path, yosys_command)
+        if cache is not None:
+            with open(tmp) as f:
+                cache.put(key, {'netlist': f.read()})
 
     tmp_file = open(tmp)
     inp = {}
@@ -166,6 +162,9 @@ def main():
     parser.add_argument('-i', help='Input verilog file', required=True, dest='input')
     parser.add_argument('-o', help='Output testbench file', required=True, dest='output')
     parser.add_argument('-n', help='Number of test vectors', type=int, default=10000, dest='number')
+    parser.add_argument('-s', '--seed', help='Seed of random test vectors', type=int, dest='seed')
+    parser.add_argument('--synth-cache', help='Directory of a synthesis cache shared across runs', dest='synth_cache', default=None)
+    parser.add_argument('--cache-size', help='Size limit of the synthesis cache in MB', dest='cache_size', type=int, default=1024)
     args = parser.parse_args()
 
     print_banner()
@@ -175,7 +174,13 @@ def main():
     with open(os.path.join(app_path, 'config', 'params.yml'), 'r') as config_file:
         config = yaml.safe_load(config_file)
 
-    create_testbench(args.input, args.output, args.number, config['yosys'] )
+    cache = None
+    if args.synth_cache is not None:
+        cache = SynthCache(args.synth_cache, args.cache_size << 20)
+    create_testbench(args.input, args.output, args.number, config['yosys'], args.seed, cache)
+    if cache is not None:
+        print(cache.report())
+        cache.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+'''
+Parsing of the Verilog that ABC writes for read_truth, in the layout of
+its write_verilog: a single truth table (F over a, b, ...) and several
+(po<j> over pi<c>).
+'''
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.utils import parse_abc_formulas
+
+SINGLE = '''// Benchmark "truth" written by ABC on Sat Oct 17 12:00:00 2026
+
+module truth ( 
+    a, b, c,
+    F  );
+  input  a, b, c;
+  output F;
+  assign F = c ? (~a & b) : a;
+endmodule
+'''
+
+MULTI = '''// Benchmark "truth" written by ABC on Sat Oct 17 12:00:00 2026
+
+module truth ( 
+    pi0, pi1, pi2, pi3, pi10,
+    po0, po1, po2  );
+  input  pi0, pi1, pi2, pi3, pi10;
+  output po0, po1, po2;
+  assign po0 = pi1 & ~pi10;
+  assign po2 = 1'b0;
+  assign po1 = pi0 ? pi3 :
+    ~pi2;
+endmodule
+'''
+
+
+def test_single_output():
+    assert parse_abc_formulas(SINGLE, 3, 1) == ['in2 ? (~in0 & in1) : in0']
+
+
+def test_multi_output():
+    assert parse_abc_formulas(MULTI, 11, 3) == ['in1 & ~in10', 'in0 ? in3 : ~in2', "1'b0"]
+
+
+def test_only_declared_inputs_are_renamed():
+    text = SINGLE.replace('assign F = c ? (~a & b) : a;', 'assign F = d | a;')
+    assert parse_abc_formulas(text, 3, 1) == ['d | in0']
+
+
+def test_missing_output():
+    with pytest.raises(ValueError):
+        parse_abc_formulas(MULTI, 11, 4)
+
+
+def test_input_out_of_range():
+    with pytest.raises(ValueError):
+        parse_abc_formulas(MULTI, 4, 3)
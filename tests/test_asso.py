@@ -0,0 +1,24 @@
+'''
+The compiled ASSO sweep returns the same factors with any thread budget,
+and the same factors as the NumPy backend.
+'''
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils import bmf
+try:
+    from utils import asso_api
+except ImportError:
+    asso_api = None
+
+
+@pytest.mark.skipif(asso_api is None, reason='_asso.so has not been built')
+@pytest.mark.parametrize('threads', [0, 1, 3])
+def test_thread_budget(threads):
+    truth = (np.random.RandomState(2).rand(256, 8) < 0.4).astype(np.uint8)
+    for (W, H, WH, error), (_, _, WH_np, error_np) in zip(asso_api.asso_degrees(truth, threads=threads), bmf.asso_degrees(truth)):
+        assert (WH == WH_np).all()
+        assert error == error_np
@@ -0,0 +1,51 @@
+'''
+Size accounting and eviction of the persistent caches.
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.cache import SynthCache, LOW_WATER
+
+
+def entries(directory):
+    return [os.path.join(d, f) for d, _, files in os.walk(directory) for f in files if f.endswith('.json')]
+
+
+def test_puts_scan_only_past_the_limit(tmp_path, monkeypatch):
+    cache = SynthCache(str(tmp_path), max_size=100000)
+    scans = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, '_evict', lambda: scans.append(1) or evict())
+    written = 0
+    for i in range(400):
+        cache.put('{:064x}'.format(i), {'netlist': 'x' * 500})
+        written += os.path.getsize(cache._path('{:064x}'.format(i), '.json'))
+    total = sum(os.path.getsize(p) for p in entries(str(tmp_path)))
+    assert total <= cache.max_size
+    assert cache._read_size() == total
+    # One scan to count the empty cache, then one per refill above LOW_WATER
+    assert len(scans) <= 1 + written / (cache.max_size * (1 - LOW_WATER))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = SynthCache(str(tmp_path), max_size=2500)
+    keys = ['{:064x}'.format(i) for i in range(4)]
+    for key in keys[:3]:
+        cache.put(key, {'netlist': 'x' * 700})
+    old = time.time() - 100
+    for key in keys[1:3]:
+        os.utime(cache._path(key, '.json'), (old, old))
+    assert cache.get(keys[1]) is not None
+    cache.put(keys[3], {'netlist': 'x' * 700})
+    assert cache.get(keys[2]) is None
+    assert all(cache.get(key) is not None for key in (keys[0], keys[1], keys[3]))
+    cache.close()
+
+
+def test_replacing_an_entry_keeps_the_count(tmp_path):
+    cache = SynthCache(str(tmp_path))
+    cache.put('ab' * 32, {'netlist': 'x' * 100})
+    cache.put('ab' * 32, {'netlist': 'x' * 300})
+    assert cache._read_size() == os.path.getsize(cache._path('ab' * 32, '.json'))
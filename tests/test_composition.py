@@ -0,0 +1,22 @@
+'''
+The per-process cache of compositional evaluation stays bounded.
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils import composition
+
+
+def test_cache_drops_least_recently_used(monkeypatch):
+    monkeypatch.setattr(composition, 'CACHE_ENTRIES', 2)
+    monkeypatch.setattr(composition, '_cache', composition.OrderedDict())
+    loads = []
+
+    def load(key):
+        return lambda: loads.append(key) or key
+
+    for key in ['a', 'b', 'a', 'c', 'a', 'b']:
+        assert composition._cached(key, load(key)) == key
+    assert loads == ['a', 'b', 'c', 'b']
+    assert list(composition._cache) == ['a', 'b']
@@ -0,0 +1,103 @@
+'''
+Area of the glue logic of a two-level hierarchy: the top module and its
+own submodules count, the partitions do not.
+'''
+import os
+import sys
+import shutil
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.utils import glue_area, part_area, chip_area
+from utils.yosys import run_yosys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+LIBERTY = '''library(tiny) {
+  delay_model : table_lookup;
+  time_unit : "1ns";
+  capacitive_load_unit (1,pf);
+  cell(INV) {
+    area : 1;
+    pin(A) { direction : input; }
+    pin(Y) { direction : output; function : "!A"; }
+  }
+  cell(NAND2) {
+    area : 2;
+    pin(A) { direction : input; }
+    pin(B) { direction : input; }
+    pin(Y) { direction : output; function : "!(A&B)"; }
+  }
+}
+'''
+
+PART = '''module part0(a, b, y);
+input a, b;
+output y;
+assign y = a ^ b;
+endmodule
+'''
+
+TOP = '''module top(a, b, c, d, y);
+input a, b, c, d;
+output y;
+wire t, u;
+part0 p0(.a(a), .b(b), .y(t));
+helper h0(.x(c), .z(d), .y(u));
+assign y = t & u;
+endmodule
+
+module helper(x, z, y);
+input x, z;
+output y;
+assign y = x | z;
+endmodule
+'''
+
+# Glue logic of TOP with the output of part0 as an input
+FLAT = '''module flat(t, c, d, y);
+input t, c, d;
+output y;
+assign y = t & (c | d);
+endmodule
+'''
+
+HIERARCHY_LOG = '''
+=== helper ===
+   Chip area for module '\\helper': 3.000000
+
+=== top ===
+   Chip area for module '\\top': 4.000000
+
+=== design hierarchy ===
+   Chip area for top module '\\top': 7.000000
+'''
+
+
+def test_chip_area_of_hierarchy():
+    assert chip_area(HIERARCHY_LOG.splitlines(True)) == 7.
+    assert chip_area(HIERARCHY_LOG.splitlines(True)[:6]) == 4.
+    assert chip_area([]) == 0.
+
+
+@pytest.mark.skipif(shutil.which('yosys') is None, reason='yosys is not installed')
+def test_glue_area_counts_submodules(tmp_path):
+    part_dir = tmp_path / 'partition'
+    part_dir.mkdir()
+    (part_dir / 'part0.v').write_text(PART)
+    (part_dir / 'top.v').write_text(TOP)
+    (tmp_path / 'flat.v').write_text(FLAT)
+    (tmp_path / 'tiny.lib').write_text(LIBERTY)
+    worker = SimpleNamespace(output=str(tmp_path), modulename='top', modulenames=['part0'],
+            library=str(tmp_path / 'tiny.lib'), script=os.path.join(ROOT, 'config', 'abc.script'),
+            path={'yosys': shutil.which('yosys')})
+
+    flat = chip_area(run_yosys(worker.path['yosys'], 'read_verilog ' + str(tmp_path / 'flat.v')
+            + '; synth -flatten -top flat; opt_clean -purge; abc -liberty ' + worker.library
+            + ' -script ' + worker.script + '; stat -liberty ' + worker.library + ';'))
+    assert flat > 0
+    assert glue_area(worker) == pytest.approx(flat)
+    assert part_area(str(part_dir / 'part0.v'), SimpleNamespace(synth_cache=None, **vars(worker))) > 0
+    # Areas and netlists stay out of the partition sources
+    assert sorted(os.listdir(str(part_dir))) == ['part0.v', 'top.v']
@@ -0,0 +1,82 @@
+'''
+The W modules written with the in-process BDD logic and with ABC must
+compute W under the port order of the flow, checked by exhaustive
+simulation.
+'''
+import os
+import sys
+import shutil
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.utils import create_w
+from utils.logic import variable_order
+from utils.simulator import partition_truth
+from utils.bmf import asso_degrees
+
+
+ABC = shutil.which('abc')
+
+LOGIC = ['native', pytest.param('abc', marks=pytest.mark.skipif(ABC is None, reason='abc is not installed'))]
+
+
+def simulate_w(tmp_path, n, W, logic='native'):
+    k = W.shape[1]
+    fname = str(tmp_path / 'part_w{}.v'.format(k))
+    with open(fname, 'w') as f:
+        create_w(n, k, W, f, 'part', str(tmp_path / 'formula.truth'), ABC, logic)
+    inputs, outputs, truth = partition_truth(fname)
+    assert (inputs, outputs) == (n, k)
+    return truth
+
+
+def minterm_bits(n):
+    j = np.arange(2 ** n)
+    return [(j >> b) & 1 for b in range(n)]
+
+
+@pytest.mark.parametrize('logic', LOGIC)
+def test_single_inputs(tmp_path, logic):
+    # Minterm bit b is input in<b>, in both generators
+    x = minterm_bits(3)
+    W = np.stack([x[0], x[2]], axis=1)
+    assert (simulate_w(tmp_path, 3, W, logic) == W).all()
+
+
+@pytest.mark.parametrize('logic', LOGIC)
+def test_single_and(tmp_path, logic):
+    # W = in0 & in1 over three inputs does not depend on in2
+    x = minterm_bits(3)
+    W = np.stack([x[0] & x[1]], axis=1).astype(int)
+    assert (simulate_w(tmp_path, 3, W, logic) == W).all()
+
+
+@pytest.mark.parametrize('logic', LOGIC)
+def test_constant_and_asymmetric_columns(tmp_path, logic):
+    x = minterm_bits(4)
+    W = np.stack([np.ones(16, dtype=int), x[3] & ~x[0] & 1, np.zeros(16, dtype=int), x[2] | x[1]], axis=1)
+    assert (simulate_w(tmp_path, 4, W, logic) == W).all()
+
+
+@pytest.mark.parametrize('logic', LOGIC)
+@pytest.mark.parametrize('seed', range(10))
+def test_random(tmp_path, seed, logic):
+    rng = np.random.RandomState(seed)
+    n = rng.randint(1, 7)
+    W = (rng.rand(2 ** n, rng.randint(1, 5)) < rng.choice([0.05, 0.5, 0.95])).astype(int)
+    assert (simulate_w(tmp_path, n, W, logic) == W).all()
+
+
+@pytest.mark.parametrize('logic', LOGIC)
+def test_asso_factors(tmp_path, logic):
+    rng = np.random.RandomState(1)
+    n = 6
+    truth = (rng.rand(2 ** n, 5) < 0.3).astype(np.uint8)
+    for W, _, _, _ in asso_degrees(truth):
+        W = np.asarray(W, dtype=int)
+        assert (simulate_w(tmp_path, n, W, logic) == W).all()
+
+
+def test_order_of_constant_table():
+    assert sorted(variable_order(np.ones((8, 2), dtype=int), 3)) == [0, 1, 2]
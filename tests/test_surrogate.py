@@ -0,0 +1,19 @@
+'''
+Errors of the estimating tiers are kept and reported separately.
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.surrogate import AreaModel
+
+
+def test_errors_per_tier():
+    model = AreaModel()
+    model.check('light', 90., 100.)
+    model.check('light', 130., 100.)
+    model.check('surrogate', 100., 100.)
+    assert model.errors['light'] == [0.1, 0.3]
+    assert model.errors['surrogate'] == [0.]
+    assert model.report('light') == 'Light synthesis area error over 2 designs: mean 20.00%, max 30.00%'
+    assert model.report('hier') == 'Hierarchical synthesis: no estimate checked yet'
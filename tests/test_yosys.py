@@ -0,0 +1,66 @@
+'''
+Yosys sessions: jobs in one process, and recovery from a hung process.
+'''
+import os
+import sys
+import shutil
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from utils.yosys import YosysSession
+
+# Stand-in for yosys that answers 'log' like it, prompt included, and
+# hangs on the command 'hang'
+FAKE_YOSYS = '''#!{python}
+import sys, time
+for line in sys.stdin:
+    command = line.split()
+    sys.stdout.write('yosys> ')
+    if command == ['hang']:
+        sys.stdout.flush()
+        time.sleep(60)
+    elif command[:1] == ['log']:
+        sys.stdout.write('\\n-- Running command `' + line.strip() + "' --\\n" + ' '.join(command[1:]) + '\\n')
+    sys.stdout.flush()
+'''
+
+
+@pytest.fixture
+def fake_yosys(tmp_path):
+    path = tmp_path / 'yosys'
+    path.write_text(FAKE_YOSYS.format(python=sys.executable))
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_jobs_share_a_process(fake_yosys):
+    session = YosysSession(fake_yosys)
+    assert 'hello\n' in session.run(['log hello'])
+    process = session.process
+    assert 'again\n' in session.run(['log again'])
+    assert session.process is process
+    session.close()
+
+
+def test_hung_job_times_out_and_restarts(fake_yosys):
+    session = YosysSession(fake_yosys, timeout=1)
+    with pytest.raises(ValueError, match='timed out'):
+        session.run(['hang'])
+    assert session.process is None
+    assert 'back\n' in session.run(['log back'])
+    session.close()
+
+
+@pytest.mark.skipif(shutil.which('yosys') is None, reason='yosys is not installed')
+def test_yosys_session(tmp_path):
+    design = tmp_path / 'm.v'
+    design.write_text('module m(a, b, y);\ninput a, b;\noutput y;\nassign y = a & b;\nendmodule\n')
+    session = YosysSession(shutil.which('yosys'), timeout=60)
+    for _ in range(2):
+        lines = session.run(['read_verilog ' + str(design), 'synth -top m', 'stat'])
+        assert any('Number of cells' in line for line in lines)
+    with pytest.raises(ValueError):
+        session.run(['read_verilog ' + str(tmp_path / 'missing.v')])
+    lines = session.run(['read_verilog ' + str(design), 'synth -top m', 'stat'])
+    assert any('Number of cells' in line for line in lines)
+    session.close()
@@ -0,0 +1,75 @@
+'''
+In-memory interface to the compiled ASSO engine (_asso.so, built by make).
+
+asso_matrix and asso_degrees factorize truth tables held in NumPy arrays
+with the same results as bmf.py, without going through truth table files.
+Importing this module raises ImportError if _asso.so has not been built.
+'''
+import numpy as np
+from .asso import _asso
+from .truthtable import unpack_rows
+from .bmf import reduce_truth
+
+# Number of thresholds in the sweep of asso/driver.c (N_THRESHOLDS)
+N_THRESHOLDS = 10
+
+
+def asso_matrix(truth, k, width=None):
+    '''
+    Factorize a truth table held in memory, without touching the filesystem.
+    truth is a 0/1 uint8 matrix (vector x bit), or rows of packed uint64
+    words (see truthtable.py) if width is given. Return W, H, their Boolean
+    product WH as uint8 matrices and the number of mismatching bits.
+    '''
+    if width is not None:
+        truth = unpack_rows(truth, width)
+    truth = np.ascontiguousarray(truth, dtype=np.uint8)
+    n, m = truth.shape
+    rows, weight, inverse, columns, bits = reduce_truth(truth)
+    u, c = rows.shape
+    W = np.zeros((u, k), dtype=np.uint8)
+    H = np.zeros((k, m), dtype=np.uint8)
+    error = 0
+    if c > 0:
+        Hc = np.zeros((k, c), dtype=np.uint8)
+        WHc = np.zeros((u, c), dtype=np.uint8)
+        error = _asso.asso_buffer(rows, u, c, k, W, Hc, WHc, weight, bits)
+        H[:, columns] = Hc
+    WH = (W.astype(np.int32) @ H.astype(np.int32) > 0).astype(np.uint8)
+    return W[inverse], H, WH[inverse], error
+
+
+def asso_degrees(truth, K=None, width=None, threads=0):
+    '''
+    Factorize a truth table held in memory to every degree 1..K (default:
+    its number of columns minus one) with a single threshold sweep, run by
+    at most threads threads (0: one per core). Return a list whose (k-1)-th
+    entry is W, H, WH, error as asso_matrix(truth, k) returns them.
+    '''
+    if width is not None:
+        truth = unpack_rows(truth, width)
+    truth = np.ascontiguousarray(truth, dtype=np.uint8)
+    n, m = truth.shape
+    if K is None:
+        K = m - 1
+    if K < 1:
+        return []
+    # Factorize the distinct rows, weighted by multiplicity
+    rows, weight, inverse, columns, bits = reduce_truth(truth)
+    u, c = rows.shape
+    S = np.zeros((N_THRESHOLDS, u, K), dtype=np.uint8)
+    B = np.zeros((N_THRESHOLDS, K, m), dtype=np.uint8)
+    best = np.zeros(K, dtype=np.intc)
+    errors = np.zeros(K, dtype='L')
+    if c > 0:
+        Bc = np.zeros((N_THRESHOLDS, K, c), dtype=np.uint8)
+        _asso.asso_sweep(rows, u, c, K, S, Bc, best, errors, weight, bits, threads)
+        B[:, :, columns] = Bc
+
+    factors = []
+    for k in range(1, K + 1):
+        W = S[best[k-1], :, :k]
+        H = np.ascontiguousarray(B[best[k-1], :k, :])
+        WH = (W.astype(np.int32) @ H.astype(np.int32) > 0).astype(np.uint8)
+        factors.append((W[inverse], H, WH[inverse], int(errors[k-1])))
+    return factors
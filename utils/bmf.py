@@ -0,0 +1,175 @@
+'''
+ASSO Boolean matrix factorization in NumPy.
+
+Makes the same choices as the compiled engine in asso/ (association
+matrix, thresholding at every value of THRESHOLDS, greedy cover with the
+columns weighted by 2^(m-c)), so both backends return the same factors.
+It needs no compiler, and it factorizes a whole batch of truth tables, for
+all thresholds and all degrees, with one array operation per basis vector.
+'''
+import numpy as np
+from .truthtable import unpack_rows
+
+# Thresholds of the sweep, in the order ties are resolved (asso/driver.c)
+THRESHOLDS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+# Largest number of entries of the per-step score array of one batch
+BATCH_ENTRIES = 1 << 22
+
+
+def reduce_truth(truth):
+    '''
+    Collapse identical rows of a 0/1 uint8 matrix and drop its constant-zero
+    columns. Return the reduced matrix, the multiplicity of each of its rows
+    (uint64), the reduced row of every original row, the kept columns and
+    their ASSO column weights (int32 exponents, 2^(m-c) for column c), so
+    that ASSO on the reduced matrix makes the same choices as on truth.
+    '''
+    n, m = truth.shape
+    columns = np.flatnonzero(truth.any(axis=0))
+    reduced = np.ascontiguousarray(truth[:, columns])
+    # Rows compare as one opaque key of their packed bytes
+    keys = np.zeros((n, max(1, (len(columns) + 7) // 8)), dtype=np.uint8)
+    keys[:, :(len(columns) + 7) // 8] = np.packbits(reduced, axis=1)
+    keys = keys.view(np.dtype((np.void, keys.shape[1]))).reshape(-1)
+    _, first, inverse, counts = np.unique(keys, return_index=True,
+            return_inverse=True, return_counts=True)
+    return (reduced[first], counts.astype(np.uint64), inverse.reshape(-1),
+            columns, (m - columns).astype(np.int32))
+
+
+def _sweep(X, w, bits, K):
+    '''
+    ASSO on a batch of P reduced tables padded to U rows and C columns:
+    X (P, U, C) 0/1, w (P, U) row weights (0 for padding) and bits (P, C).
+    Return the factors O (P, T, U, K) and B (P, T, K, C) of every threshold
+    and the errors (P, T, K) of every prefix of the basis.
+    '''
+    P, U, C = X.shape
+    T = len(THRESHOLDS)
+    w = w.astype(np.int64)
+    Xi = X.astype(np.int64)
+
+    # Association matrix, the same for all thresholds
+    count = np.matmul(np.swapaxes(Xi * w[:, :, None], 1, 2), Xi)
+    diag = np.diagonal(count, axis1=1, axis2=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        assoc = count / diag[:, :, None].astype(np.float64)
+    thresholds = np.array(THRESHOLDS).reshape(1, T, 1, 1)
+    cand = assoc[:, None, :, :] > thresholds            # (P, T, R, C)
+
+    # Signed weight of each entry: covering a 1 gains it, a 0 loses it
+    dtype = np.int64 if bits.max(initial=0) < 62 else np.float64
+    value = np.where(X == 1, 1, -1) * np.power(2, bits.astype(dtype))[:, None, :]
+    value = np.broadcast_to(value[:, None], (P, T, U, C))
+    candT = np.swapaxes(cand, 2, 3).astype(dtype)       # (P, T, C, R)
+
+    covered = np.zeros((P, T, U, C), dtype=bool)
+    product = np.zeros((P, T, U, C), dtype=bool)
+    O = np.zeros((P, T, U, K), dtype=np.uint8)
+    B = np.zeros((P, T, K, C), dtype=np.uint8)
+    errors = np.zeros((P, T, K), dtype=np.int64)
+    ones = X.astype(bool)[:, None]
+    for basis in range(K):
+        rowcount = np.matmul(np.where(covered, 0, value), candT).astype(np.int64)
+        gain = rowcount > 0
+        covers = np.einsum('ptur,pu->ptr', np.where(gain, rowcount, 0), w)
+        # First candidate with the largest positive gain, if any
+        best = np.argmax(covers, axis=2)
+        found = np.take_along_axis(covers, best[:, :, None], 2)[:, :, 0] > 0
+        rows = np.take_along_axis(gain, best[:, :, None, None], 3)[:, :, :, 0]
+        rows &= found[:, :, None]
+        vector = np.take_along_axis(cand, best[:, :, None, None], 2)[:, :, 0, :]
+        vector &= found[:, :, None]
+
+        O[:, :, :, basis] = rows
+        B[:, :, basis, :] = vector
+        cover = rows[:, :, :, None] & vector[:, :, None, :]
+        covered |= cover
+        product |= cover
+        errors[:, :, basis] = np.einsum('ptu,pu->pt', (product != ones).sum(axis=3), w)
+    return O, B, errors
+
+
+def _batches(sizes):
+    '''
+    Split table indices, sorted by (rows, columns), into batches whose
+    padded score array stays below BATCH_ENTRIES
+    '''
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    batch, rows, cols = [], 0, 0
+    for i in order:
+        u, c = sizes[i]
+        r, q = max(rows, u), max(cols, c)
+        if batch and (len(batch) + 1) * len(THRESHOLDS) * r * q * q > BATCH_ENTRIES:
+            yield batch
+            batch, r, q = [], u, c
+        batch.append(i)
+        rows, cols = r, q
+    if batch:
+        yield batch
+
+
+def asso_batch(truths, K=None):
+    '''
+    Factorize a list of truth tables (0/1 uint8 matrices) to every degree
+    1..K (default: number of columns minus one, per table). Return one list
+    per table whose (k-1)-th entry is W, H, WH, error as asso_degrees of
+    asso_api.py returns them.
+    '''
+    reduced = [reduce_truth(np.asarray(t, dtype=np.uint8)) for t in truths]
+    degrees = [t.shape[1] - 1 if K is None else K for t in truths]
+    results = [[] for _ in truths]
+
+    todo = [i for i in range(len(truths)) if degrees[i] >= 1]
+    sizes = [reduced[i][0].shape for i in todo]
+    for batch in _batches(sizes):
+        batch = [todo[j] for j in batch]
+        P = len(batch)
+        U = max(reduced[i][0].shape[0] for i in batch)
+        C = max(reduced[i][0].shape[1] for i in batch)
+        Kmax = max(degrees[i] for i in batch)
+        X = np.zeros((P, U, C), dtype=np.uint8)
+        w = np.zeros((P, U), dtype=np.uint64)
+        bits = np.zeros((P, C), dtype=np.int32)
+        for p, i in enumerate(batch):
+            rows, weight, _, _, bit = reduced[i]
+            X[p, :rows.shape[0], :rows.shape[1]] = rows
+            w[p, :rows.shape[0]] = weight
+            bits[p, :rows.shape[1]] = bit
+        if C > 0:
+            O, B, errors = _sweep(X, w, bits, Kmax)
+        else:
+            O = np.zeros((P, len(THRESHOLDS), U, Kmax), dtype=np.uint8)
+            B = np.zeros((P, len(THRESHOLDS), Kmax, 0), dtype=np.uint8)
+            errors = np.zeros((P, len(THRESHOLDS), Kmax), dtype=np.int64)
+
+        for p, i in enumerate(batch):
+            rows, _, inverse, columns, _ = reduced[i]
+            u, c = rows.shape
+            m = truths[i].shape[1]
+            for k in range(1, degrees[i] + 1):
+                # First threshold with the smallest error, as in the sweep
+                t = int(np.argmin(errors[p, :, k-1]))
+                W = O[p, t, :u, :k]
+                H = np.zeros((k, m), dtype=np.uint8)
+                H[:, columns] = B[p, t, :k, :c]
+                WH = (W.astype(np.int32) @ H.astype(np.int32) > 0).astype(np.uint8)
+                results[i].append((W[inverse], H, WH[inverse], int(errors[p, t, k-1])))
+    return results
+
+
+def asso_degrees(truth, K=None, width=None, threads=0):
+    '''
+    NumPy counterpart of asso_degrees in asso_api.py (threads is ignored)
+    '''
+    if width is not None:
+        truth = unpack_rows(truth, width)
+    return asso_batch([truth], K)[0]
+
+
+def asso_matrix(truth, k, width=None):
+    '''
+    NumPy counterpart of asso_matrix in asso_api.py
+    '''
+    return asso_degrees(truth, k, width)[k-1]
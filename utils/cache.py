@@ -0,0 +1,288 @@
+'''
+Persistent caches shared across runs.
+
+FactorCache addresses entries by the hash of a truth table (and the degree
+k for Verilog), so identical partitions of different runs, thresholds or
+designs share their factors. SynthCache addresses synthesis results by the
+hash of the synthesized Verilog, liberty file and ABC script. An entry is
+written to a temporary file and renamed into place, so concurrent BLASYS
+processes never see partial entries. Reading an entry refreshes its
+modification time. The total size of the entries is counted in the file
+.size as they are written, and the least recently used entries are
+evicted once the count exceeds the size limit.
+'''
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import numpy as np
+from contextlib import contextmanager
+
+# Versions of the cached results. Both BMF backends return the same
+# factors, so they share entries. Bump when the results change.
+FACTOR_VERSION = 'asso-1'
+VERILOG_VERSION = 'wh-3'
+SYNTH_VERSION = 'synth-1'
+
+# Eviction shrinks a cache to this fraction of its size limit, so the
+# entries are scanned again only after it has grown by the rest
+LOW_WATER = 0.9
+
+# Stands for the module name in cached Verilog
+MODULE_PLACEHOLDER = 'BLASYS_CACHED_MODULE'
+
+
+# Hashes of files by path, size and modification time, per process
+_file_hashes = {}
+
+
+def file_hash(path):
+    '''
+    SHA-256 of the contents of a file
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[key] = h.hexdigest()
+    return _file_hashes[key]
+
+
+class ContentCache():
+    '''
+    Directory of entries named by their hash, bounded to max_size bytes
+    '''
+    def __init__(self, directory, max_size=1 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _write(self, path, write):
+        '''
+        Create path atomically with the contents written by write(file)
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            size = os.path.getsize(tmp)
+            with self._locked():
+                try:
+                    size -= os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+                os.replace(tmp, path)
+                total = self._read_size()
+                if total is None or total + size > self.max_size:
+                    total = self._evict()
+                else:
+                    total += size
+                self._write_size(total)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read_size(self):
+        '''
+        Total size of the entries as last counted, or None
+        '''
+        try:
+            with open(os.path.join(self.directory, '.size')) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_size(self, total):
+        with open(os.path.join(self.directory, '.size'), 'w') as f:
+            f.write(str(total))
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the cache fits max_size
+        '''
+        with self._locked():
+            self._write_size(self._evict())
+
+    def _evict(self):
+        '''
+        Scan the entries and remove the least recently used ones down to
+        LOW_WATER of max_size. Return the size of the remaining entries.
+        '''
+        entries = []
+        total = 0
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_size:
+            return total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size * LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+
+class FactorCache(ContentCache):
+    def key(self, truth, k=None, logic='abc'):
+        '''
+        Hash of a 0/1 truth table, and of the degree k and the logic
+        generator of its Verilog if k is given
+        '''
+        truth = np.asarray(truth, dtype=np.uint8)
+        h = hashlib.sha256()
+        if k is None:
+            h.update(FACTOR_VERSION.encode())
+        else:
+            h.update('{} k={}'.format(VERILOG_VERSION, k).encode())
+            if logic != 'abc':
+                h.update(' logic={}'.format(logic).encode())
+        h.update('{}x{}'.format(*truth.shape).encode())
+        h.update(np.packbits(truth, axis=None).tobytes())
+        return h.hexdigest()
+
+    def get_factors(self, truth):
+        '''
+        List of W, H, WH, error of every degree of truth, or None
+        '''
+        path = self._path(self.key(truth), '.npz')
+        try:
+            with np.load(path) as data:
+                K = int(data['K'])
+                factors = [(data['W'+str(k)], data['H'+str(k)], data['WH'+str(k)],
+                            int(data['error'][k-1])) for k in range(1, K + 1)]
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return factors
+
+    def put_factors(self, truth, factors):
+        arrays = {'K': np.array(len(factors)),
+                  'error': np.array([f[3] for f in factors], dtype=np.uint64)}
+        for k, (W, H, WH, _) in enumerate(factors, 1):
+            arrays['W'+str(k)] = np.asarray(W, dtype=np.uint8)
+            arrays['H'+str(k)] = np.asarray(H, dtype=np.uint8)
+            arrays['WH'+str(k)] = np.asarray(WH, dtype=np.uint8)
+        self._write(self._path(self.key(truth), '.npz'), lambda f: np.savez(f, **arrays))
+
+    def get_verilog(self, truth, k, modulename, logic='abc'):
+        '''
+        Verilog of the degree-k approximation of truth as module
+        modulename, or None
+        '''
+        path = self._path(self.key(truth, k, logic), '.v')
+        try:
+            with open(path) as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return text.replace(MODULE_PLACEHOLDER, modulename)
+
+    def put_verilog(self, truth, k, text, logic='abc'):
+        '''
+        Store Verilog written for module MODULE_PLACEHOLDER
+        '''
+        self._write(self._path(self.key(truth, k, logic), '.v'), lambda f: f.write(text.encode()))
+
+
+class SynthCache(ContentCache):
+    '''
+    Results of synthesis runs. Hits and misses of a run are counted in a
+    file, so that the processes of a multiprocessing pool add up.
+    '''
+    def __init__(self, directory, max_size=1 << 30):
+        super().__init__(directory, max_size)
+        self.stats = os.path.join(directory, 'run_{}_{}.stats'.format(os.getpid(), int(time.time())))
+
+    def key(self, kind, files, options=()):
+        '''
+        Hash of a kind of synthesis run on the contents of files (Verilog
+        inputs, liberty file, ABC script) and further options
+        '''
+        h = hashlib.sha256()
+        h.update('{} {}'.format(SYNTH_VERSION, kind).encode())
+        for f in files:
+            h.update(file_hash(f).encode())
+        for option in options:
+            h.update(str(option).encode())
+        return h.hexdigest()
+
+    def _count(self, event):
+        with open(self.stats, 'ab') as f:
+            f.write(event)
+
+    def get(self, key):
+        '''
+        Dictionary stored under key, or None
+        '''
+        path = self._path(key, '.json')
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self._count(b'm')
+            return None
+        self._touch(path)
+        self._count(b'h')
+        return entry
+
+    def put(self, key, entry):
+        self._write(self._path(key, '.json'), lambda f: f.write(json.dumps(entry).encode()))
+
+    def counts(self):
+        '''
+        Number of hits and misses of this run
+        '''
+        try:
+            with open(self.stats, 'rb') as f:
+                events = f.read()
+        except FileNotFoundError:
+            return 0, 0
+        return events.count(b'h'), events.count(b'm')
+
+    def report(self):
+        hits, misses = self.counts()
+        return 'Synthesis cache: {} hits, {} misses'.format(hits, misses)
+
+    def close(self):
+        '''
+        Remove the counters of this run
+        '''
+        if os.path.exists(self.stats):
+            os.remove(self.stats)
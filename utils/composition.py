@@ -0,0 +1,80 @@
+'''
+Compositional evaluation of candidate designs. The top-level netlist is
+simulated with the built-in simulator and every partition is replaced by a
+lookup into its exact (.truth) or approximated (.truth_wh_k) truth table.
+'''
+import os
+import numpy as np
+from collections import OrderedDict
+from .simulator import Netlist, read_testbench, simulate_testbench, pack_bits, unpack_bits
+from .truthtable import load_truth
+
+
+# Parsed netlists, testbenches and truth tables, cached per process. The
+# least recently used ones are dropped beyond CACHE_ENTRIES.
+CACHE_ENTRIES = 128
+_cache = OrderedDict()
+
+
+def _cached(key, load):
+    if key in _cache:
+        _cache.move_to_end(key)
+    else:
+        _cache[key] = load()
+        if len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return _cache[key]
+
+
+def lookup(mod, table):
+    '''
+    Simulation override that reads the outputs of mod from its truth table
+    '''
+    in_bits = mod.input_bits()
+    out_bits = mod.output_bits()
+    n = len(in_bits)
+
+    def evaluate(inputs, nwords):
+        num = nwords * 64
+        index = np.zeros(num, dtype=np.uint32)
+        for i, key in enumerate(in_bits):
+            index |= unpack_bits(inputs[key], num).astype(np.uint32) << (n - 1 - i)
+        rows = table[index]
+        return {key: pack_bits(rows[:, j]) for j, key in enumerate(out_bits)}
+
+    return evaluate
+
+
+def partition_table(worker, i, k):
+    '''
+    Truth table of partition i factorized to degree k
+    '''
+    modulename = worker.modulenames[i]
+    fname = os.path.join(worker.output, modulename, modulename + '.truth')
+    if k != worker.output_list[i]:
+        fname += '_wh_' + str(k)
+    return _cached(fname, lambda: load_truth(fname))
+
+
+def compose_outputs(k_stream, worker):
+    '''
+    Output vectors of the design in which partition i is factorized to
+    degree k_stream[i], simulated on the stimulus of worker.testbench
+    '''
+    top_file = os.path.join(worker.output, 'partition', worker.modulename + '.v')
+
+    def load_netlist():
+        netlist = Netlist([top_file])
+        for modulename in worker.modulenames:
+            netlist.read(os.path.join(worker.output, 'partition', modulename + '.v'))
+        return netlist
+
+    netlist = _cached(top_file, load_netlist)
+    testbench = _cached(worker.testbench, lambda: read_testbench(worker.testbench))
+
+    overrides = {}
+    for i, modulename in enumerate(worker.modulenames):
+        table = partition_table(worker, i, k_stream[i])
+        overrides[modulename] = lookup(netlist.modules[modulename], table)
+
+    return simulate_testbench(netlist, testbench, overrides)
@@ -1,8 +1,50 @@
 import regex as re
 import sys
-import random
+import os
+import numpy as np
+from .truthtable import save_truth
 
-def create_testbench(path, num, f):
+def write_stimulus(f, n_inputs, num=None, seed=None):
+    '''
+    Write the stimulus of a testbench driving reg pi, from the declarations
+    to the end of the initial block. If num is None, all 2^n_inputs patterns
+    are applied by a loop. Otherwise num random vectors, drawn with NumPy
+    from seed, are loaded by $readmemb from a .vec file next to f. Return
+    the seed used, which is also recorded in the testbench.
+    '''
+    if num is None:
+        f.write('integer i;\n')
+        f.write("initial\n")
+        f.write("begin\n")
+        f.write('for (i = 0; i < {}; i = i + 1)\n'.format(2**n_inputs))
+        f.write("begin\n")
+        f.write('# 1  pi=i;\n')
+        f.write("#1 $display(\"%b\", po);\n")
+        f.write("end\n")
+        f.write("end\n")
+        return None
+
+    num = int(num)
+    seed = np.random.SeedSequence(seed).entropy
+    vec_file = os.path.splitext(os.path.abspath(f.name))[0] + '.vec'
+    stimulus = np.random.default_rng(seed).integers(0, 2, (num, n_inputs), dtype=np.uint8)
+    save_truth(vec_file, stimulus, packed=False)
+
+    f.write('// {} random vectors from seed {}\n'.format(num, seed))
+    f.write('reg ['+str(n_inputs-1)+':0] vectors [0:'+str(num-1)+'];\n')
+    f.write('integer i;\n')
+    f.write("initial\n")
+    f.write("begin\n")
+    f.write('$readmemb("{}", vectors);\n'.format(vec_file))
+    f.write('for (i = 0; i < {}; i = i + 1)\n'.format(num))
+    f.write("begin\n")
+    f.write('# 1  pi=vectors[i];\n')
+    f.write("#1 $display(\"%b\", po);\n")
+    f.write("end\n")
+    f.write("end\n")
+    return seed
+
+def create_testbench(path, num, f, seed=None):
     modulename = None
     with open(path) as file:
 	    line = file.readline()
@@ -47,28 +89,10 @@ def create_testbench(path, num, f):
         f.write(', po[{}]'.format(i))
     f.write(');\n')
 
-    f.write("initial\n")
-    f.write("begin\n")
     if n_inputs >= 17:
-            j=1
-            while j <= int(num):
-	            f.write('# 1  pi='+str(n_inputs)+'\'b')
-	            i=1
-	            while i <= n_inputs:
-		            n=random.randint(0, 1)
-		            i+=1
-		            f.write(str(n))
-	            f.write(';\n')
-	            f.write("#1 $display(\"%b\", po);\n")
-	            j+=1
+        write_stimulus(f, n_inputs, num, seed)
     else:
-            for j in range(2**n_inputs):
- 	            f.write('# 1  pi='+str(n_inputs)+'\'b')
- 	            f.write('{0:0>{1}}'.format(str(bin(j))[2:], n_inputs))
- 	            f.write(';\n')
- 	            f.write("#1 $display(\"%b\", po);\n")
-                       
-    f.write("end\n")
+        write_stimulus(f, n_inputs)
     f.write("endmodule\n")
 
 	    
@@ -9,10 +9,13 @@ import multiprocessing as mp
 import shutil
 import time
 import ctypes
-from .utils import gen_truth, evaluate_design, synth_design, inpout, number_of_cell, write_aiger, get_delay, get_power, approximate, create_wrapper
+from .utils import gen_truth, evaluate_design, synthesize_design, analyze_timing_power, candidate_verilog, batch_simulate, prefactorize, prefetch, synth_design, inpout, number_of_cell, write_aiger, get_delay, get_power, approximate, create_wrapper
 from .optimizer import optimization, least_error_opt
+from .surrogate import AreaModel
 from .create_tb import create_testbench
 from .metric import distance
+from .simulator import partition_truth
+from .truthtable import save_truth, load_truth
 
 
 class GreedyWorker():
@@ -36,11 +39,41 @@ class GreedyWorker():
         self.error_list = [0.0]
         self.metric_list = [[.0, .0, .0]]
         self.area_list = []
+        # Synthesis tier behind each area of area_list
+        self.tier_list = []
         self.power_list = []
         self.delay_list = []
         self.design_list = []
         self.iter = 0
 
+        # Simulate in-process instead of iverilog
+        self.native_sim = True
+        # Store truth tables in bit-packed binary format
+        self.packed_truth = True
+        # With iverilog, simulate all candidates of an iteration in one run
+        self.batch_sim = False
+        # Factorize with the compiled ASSO ('asso') or with NumPy ('numpy')
+        self.bmf_backend = 'asso'
+        # Synthesize W with ABC ('abc') or in-process BDDs ('native')
+        self.logic = 'abc'
+        # FactorCache shared across runs, if any
+        self.cache = None
+        # Rank candidates by the areas of separately synthesized partitions
+        # and synthesize only the candidates kept by the ranking flat
+        self.hier_synth = False
+        # Synthesize only this many candidates per track, ranked by estimated
+        # area (None: all)
+        self.screen = None
+        self.area_model = AreaModel()
+        # ABC commands of the light synthesis tier run on every candidate
+        # before the full script reruns on the ranked ones (None: off)
+        self.light_abc = None
+        self.light_script = None
+        # SynthCache of synthesis results shared across runs, if any
+        self.synth_cache = None
+        # Analyze all candidates of a process in one long-lived sta
+        self.batch_sta = False
+
         self.modulename = None
         # Get modulename
         with open(self.input) as file:
@@ -82,6 +115,10 @@ class GreedyWorker():
             #file.write(';map')
             file.write('strash;ifraig;dc2;fraig;rewrite;refactor;resub;rewrite;refactor;resub;rewrite;rewrite -z;rewrite -z;rewrite -z;')
             file.write('balance;refactor -z;refactor -N 11;resub -K 10;resub -K 12;resub -K 14;resub -K 16;refactor;balance;map -a')
+        if self.light_abc is not None:
+            self.light_script = os.path.join(self.output, 'abc_light.script')
+            with open(self.light_script, 'w') as file:
+                file.write(self.light_abc)
 
     def convert2aig(self):
         print('Parsing input verilog into aig format ...')
@@ -133,16 +170,13 @@ class GreedyWorker():
             in_file = os.path.join(self.output, self.modulename+'_approx_k='+str(k)+'.v')
             out_file = os.path.join(self.output, self.modulename, self.modulename+'_approx_k='+str(k))
             gen_truth = os.path.join(self.output, self.modulename+'.truth_wh_'+str(k))
-            area = synth_design(in_file, out_file, self.library, self.script, self.path['yosys'])
+            area = synth_design(in_file, out_file, self.library, self.script, self.path['yosys'], self.synth_cache)
             err, err_sum = distance(truth_dir+'.truth', gen_truth, use_weight)
             err_list.append(err)
             area_list.append(area/self.initial_area)
             # print('Factorization level {}, Area {}, Error {}\n'.format(k, area, err))
             # f.write('{:.6f},{:.6f},Level{}'.format(err, area, k))
-            sta_script = os.path.join(self.output, 'sta.script')
-            sta_output = os.path.join(self.output, 'sta.out')
-            delay_iter = get_delay(self.path['OpenSTA'], sta_script, self.library, out_file+'_syn.v', self.modulename, sta_output)
-            power_iter = get_power(self.path['OpenSTA'], sta_script, self.library, out_file+'_syn.v', self.modulename, sta_output, self.delay)
+            delay_iter, power_iter = analyze_timing_power(out_file+'_syn.v', self)
 
             f.write('{},{:.6f},{:.6e},{:<.6f},{:.2f},{:.6f},{:.6f}\n'.format(k, err_sum[0], err_sum[1], err_sum[2], area, power_iter, delay_iter) )
             if use_weight:
@@ -169,13 +203,16 @@ class GreedyWorker():
         with open(output_truth, 'w') as f:
             subprocess.call([self.path['vvp'], self.modulename+'.iv'], stdout=f)
         os.remove(self.modulename + '.iv')
+        if self.packed_truth:
+            save_truth(output_truth, load_truth(output_truth))
 
         print('Synthesizing input design with original partitions...')
         output_synth = os.path.join(self.output, self.modulename)
-        input_area = synth_design(self.input, output_synth, self.library, self.script, self.path['yosys'])
+        input_area = synth_design(self.input, output_synth, self.library, self.script, self.path['yosys'], self.synth_cache)
         print('Original design area ', str(input_area))
         self.initial_area = input_area
         self.area_list.append(self.initial_area)
+        self.tier_list.append('full')
 
 
         return inpout(self.input)
@@ -266,6 +303,26 @@ class GreedyWorker():
                # self.output_list.append(-1)
                # continue
 
+            part_output_dir = os.path.join(self.output, modulename)
+            os.mkdir(part_output_dir)
+            truth_file = os.path.join(part_output_dir, modulename + '.truth')
+
+            if self.native_sim:
+                # Simulate all input patterns at once with packed words
+                print('Simulate truth table for partition '+str(i))
+                try:
+                    n, m, truth = partition_truth(file_path + '.v')
+                except ValueError as e:
+                    print('Built-in simulator failed on partition {} ({}); falling back to iverilog'.format(i, e))
+                else:
+                    if n > 16:
+                        print('BLASYS cannot handle more than 16 inputs per partition; reduce parition sizes')
+                        exit(-1)
+                    save_truth(truth_file, truth, self.packed_truth)
+                    self.input_list.append( n )
+                    self.output_list.append( m )
+                    continue
+
             # Create testbench for partition
             print('Create testbench for partition '+str(i))
             n, m = gen_truth(file_path, modulename)
@@ -274,18 +331,23 @@ class GreedyWorker():
 
             # Generate truthtable
             print('Generate truth table for partition '+str(i))
-            part_output_dir = os.path.join(self.output, modulename)
-            os.mkdir(part_output_dir)
             subprocess.call([self.path['iverilog'], '-o', file_path+'.iv', file_path+'.v', file_path+'_tb.v'])
-            with open( os.path.join(part_output_dir, modulename + '.truth'), 'w') as f:
+            with open( truth_file, 'w') as f:
                 subprocess.call([self.path['vvp'], file_path+'.iv'], stdout=f)
                 os.remove(file_path+'.iv')
+            if self.packed_truth:
+                save_truth(truth_file, load_truth(truth_file))
 
         self.curr_stream = self.output_list.copy()
         self.curr_streams = [self.output_list.copy()]
         self.explored_streams = [self.output_list.copy()]
 
 
+    def prefetch(self, step_size=1):
+        print('Prefetching approximations of all partitions...')
+        prefetch(self, step_size)
+
+
     def greedy_opt(self, parallel, step_size = 1, threshold=[1000000.], use_weight=False, track=3):
         threshold.sort()
         while True:
@@ -309,8 +371,8 @@ class GreedyWorker():
             self.power_list.append(power)
             self.delay_list.append(self.delay)
             with open(os.path.join(self.output, 'data.csv'), 'a') as data:
-                data.write('{},{},{},{},{},{},{}\n'.format('Iter','HD', 'MAE', 'MAE%', 'Area(um^2)', 'Power(uW)', 'Delay(ns)') )
-                data.write('{},{:.6f},{:.6e},{:<.6f},{:.2f},{:.6f},{:.6f}\n'.format('Org', 0, 0, 0, self.initial_area, power, self.delay) )
+                data.write('{},{},{},{},{},{},{},{}\n'.format('Iter','HD', 'MAE', 'MAE%', 'Area(um^2)', 'Power(uW)', 'Delay(ns)', 'Tier') )
+                data.write('{},{:.6f},{:.6e},{:<.6f},{:.2f},{:.6f},{:.6f},{}\n'.format('Org', 0, 0, 0, self.initial_area, power, self.delay, 'full') )
 
 
         print('Current stream of factorization degree:\n','\n'.join(map(str, self.curr_streams)))
@@ -319,6 +381,8 @@ class GreedyWorker():
 
             a = np.array(self.area_list)
             e = np.array(self.error_list)
+            # Results come from the full synthesis tier only
+            a[np.array(self.tier_list) != 'full'] = np.inf
             a[e > threshold[0]] = np.inf
             idx = np.argmin(a)
             source_file = os.path.join(self.output, 'tmp', '{}_syn.v'.format(self.design_list[idx]))
@@ -337,7 +401,8 @@ class GreedyWorker():
 
         print('--------------- Iteration ' + str(self.iter) + ' ---------------')
         before = time.time()
-        next_stream, streams, err, area, err_sum, delay, power, name_list, rank = self.evaluate_iter(self.curr_streams, self.iter, step_size, parallel, threshold[0], least_error, use_weight)
+        next_stream, streams, err, area, err_sum, delay, power, name_list, rank, tiers = self.evaluate_iter(self.curr_streams, self.iter, step_size, parallel, threshold[0], least_error, use_weight, max(threshold))
+        self.synthesize_ranked(streams, name_list, rank[:track], area, delay, power, tiers, parallel)
         after = time.time()
 
 
@@ -350,6 +415,8 @@ class GreedyWorker():
         else:
             met = 'HD'
         msg = 'Approximated {} error: {:.6f}%\tArea percentage: {:.6f}%\tTime used: {:.6f} sec\n'.format(met, 100*err[rank[0]], 100 * area[rank[0]] / self.initial_area, time_used)
+        if self.first_tier() != 'full':
+            msg += self.area_model.report(self.first_tier()) + '\n'
         print(msg)
         with open(os.path.join(self.output, 'log'), 'a') as log_file:
             log_file.write(str(next_stream))
@@ -390,12 +457,13 @@ class GreedyWorker():
             
             # if i == rank[0]:
         with open(os.path.join(self.output, 'data.csv'), 'a') as data:
-            data.write('{},{:.6f},{:.6e},{:<.6f},{:.2f},{:.6f},{:.6f}\n'.format(self.iter, err_sum[rank[0]][0], err_sum[rank[0]][1], err_sum[rank[0]][2], area[rank[0]], power[rank[0]], delay[rank[0]]) )
+            data.write('{},{:.6f},{:.6e},{:<.6f},{:.2f},{:.6f},{:.6f},{}\n'.format(self.iter, err_sum[rank[0]][0], err_sum[rank[0]][1], err_sum[rank[0]][2], area[rank[0]], power[rank[0]], delay[rank[0]], tiers[rank[0]]) )
 
         self.iter += 1
 
         self.error_list += err
         self.area_list += area
+        self.tier_list += tiers
         self.metric_list += err_sum
         self.design_list += name_list
         self.power_list += power
@@ -406,6 +474,8 @@ class GreedyWorker():
             print('Reach threshold on', ts)
             a = np.array(self.area_list)
             e = np.array(self.error_list)
+            # Results come from the full synthesis tier only
+            a[np.array(self.tier_list) != 'full'] = np.inf
             a[e > ts] = np.inf
             idx = np.argmin(a)
             source_file = os.path.join(self.output, 'tmp', '{}_syn.v'.format(self.design_list[idx]))
@@ -433,7 +503,45 @@ class GreedyWorker():
         return 0
 
 
-    def evaluate_iter(self, curr_k_streams, num_iter, step_size, parallel, threshold, least_error, use_weight):
+    def first_tier(self):
+        '''
+        Synthesis tier of every candidate before ranking
+        '''
+        if self.hier_synth:
+            return 'hier'
+        if self.light_abc is not None:
+            return 'light'
+        if self.screen is not None:
+            return 'surrogate'
+        return 'full'
+
+    def synthesize_ranked(self, streams, name_list, ranked, area, delay, power, tiers, parallel):
+        '''
+        Synthesize the ranked candidates with the full tier, unless already
+        done, and replace their area, delay and power. The synthesized
+        areas calibrate the surrogate area model.
+        '''
+        ranked = [r for r in ranked if tiers[r] != 'full']
+        if len(ranked) == 0:
+            return
+        print('Synthesizing', len(ranked), 'ranked candidates')
+        args = [(candidate_verilog(streams[r], self), self, name_list[r]) for r in ranked]
+        if parallel:
+            with mp.Pool(mp.cpu_count()) as pool:
+                results = pool.starmap(synthesize_design, args)
+        else:
+            results = [synthesize_design(*a) for a in args]
+        for r, (verilog_list, _, _), result in zip(ranked, args, results):
+            # Errors are kept per tier: only the surrogate tier predicted
+            # its area with the model
+            self.area_model.check(tiers[r], area[r], result[0])
+            if self.screen is not None:
+                self.area_model.add(verilog_list, result[0])
+            print('{}\tCircuit area ({}): {:.6f}\tCircuit area (full): {:.6f}\tCircuit delay: {:.6f}\tPower consumption: {:.6f}'.format(name_list[r], tiers[r], area[r], *result))
+            area[r], delay[r], power[r] = result
+            tiers[r] = 'full'
+
+    def evaluate_iter(self, curr_k_streams, num_iter, step_size, parallel, threshold, least_error, use_weight, last_threshold=np.inf):
     
         k_lists = []
         err_list = []
@@ -444,6 +552,15 @@ class GreedyWorker():
         name_list = []
         count = 0
         changed = {}
+        # Candidates above the largest threshold may stop simulating early:
+        # no later threshold accepts them. Least-error ranking still needs
+        # their exact error.
+        abort_at = last_threshold + 0.01 if np.isfinite(last_threshold) and not least_error else None
+        tier = self.first_tier()
+        tier_list = []
+        if self.screen is not None and len(self.area_model.samples) == 0:
+            # Calibrate the surrogate area model on the exact design
+            self.area_model.add(candidate_verilog(self.output_list, self), self.initial_area)
 
         for num_track, curr_k_stream in enumerate(curr_k_streams):
             print('==========TRACK {} =========='.format(num_track))
@@ -468,11 +585,22 @@ class GreedyWorker():
             # err_summary = []
             # area_list = []
             name_list += ['iter'+str(num_iter)+'track'+str(num_track)+'design'+str(i) for i in range((len(k_lists_tmp)))]
+
+            # Factorize the partitions touched by this track up front
+            prefactorize(k_lists_tmp, self, mp.cpu_count())
+
+            # Simulate all candidates of this track in one iverilog run
+            errors = [None] * len(k_lists_tmp)
+            if self.batch_sim and not self.native_sim and len(k_lists_tmp) > 0:
+                try:
+                    errors = batch_simulate(k_lists_tmp, self, 'iter'+str(num_iter)+'track'+str(num_track), use_weight)
+                except ValueError as e:
+                    print('Batch simulation failed ({}); simulating candidates one by one'.format(e))
         
             # Parallel mode
             if parallel:
                 pool = mp.Pool(mp.cpu_count())
-                results = [pool.apply_async(evaluate_design,args=(k_lists_tmp[i], self, 'iter'+str(num_iter)+'track'+str(num_track)+'design'+str(i), False, use_weight )) for i in range(len(k_lists_tmp))]
+                results = [pool.apply_async(evaluate_design,args=(k_lists_tmp[i], self, 'iter'+str(num_iter)+'track'+str(num_track)+'design'+str(i), False, use_weight, abort_at, errors[i], tier )) for i in range(len(k_lists_tmp))]
                 pool.close()
                 pool.join()
                 for result in results:
@@ -487,13 +615,26 @@ class GreedyWorker():
                     # Evaluate each list
                     print('======== Design number ' + str(i))
                     k_stream = k_lists_tmp[i]
-                    err, err_s, area, delay, power = evaluate_design(k_stream, self, 'iter'+str(num_iter)+'track'+str(num_track)+'design'+str(i))
+                    err, err_s, area, delay, power = evaluate_design(k_stream, self, 'iter'+str(num_iter)+'track'+str(num_track)+'design'+str(i), use_weight=use_weight, abort_at=abort_at, error=errors[i], tier=tier)
                     err_list.append(err)
                     err_summary.append(err_s)
                     area_list.append(area)
                     delay_list.append(delay)
                     power_list.append(power)
 
+            tier_list += [tier] * len(k_lists_tmp)
+
+            # Synthesize the candidates of this track that rank best by
+            # their estimated area
+            if self.screen is not None and len(k_lists_tmp) > 0:
+                start = len(k_lists)
+                errs, areas = np.array(err_list[start:]), np.array(area_list[start:])
+                if least_error:
+                    track_rank = least_error_opt(errs, areas / self.initial_area, threshold+0.01)
+                else:
+                    track_rank = optimization(errs, areas, self.initial_area, self.error_list[-1], self.area_list[-1], threshold+0.01)
+                self.synthesize_ranked(k_lists + k_lists_tmp, name_list, [start + r for r in track_rank[:self.screen]], area_list, delay_list, power_list, tier_list, parallel)
+
             k_lists += k_lists_tmp
 
         if least_error:
@@ -506,7 +647,7 @@ class GreedyWorker():
             # if e <= self.error_list[-1] and area_list[i] <= self.area_list[-1]:
                 # result[changed[i]] = k_lists[i][changed[i]]
             
-        return result, k_lists, err_list, area_list, err_summary, delay_list, power_list, name_list, rank
+        return result, k_lists, err_list, area_list, err_summary, delay_list, power_list, name_list, rank, tier_list
 
     def plot(self, error_list, area_list):
 
@@ -0,0 +1,167 @@
+'''
+In-process logic generation for small truth tables.
+
+The columns of a truth table over in0..in(n-1) are built into one reduced
+ordered BDD with a shared unique table, so subfunctions common to several
+columns are built once. Every BDD node is a multiplexer on one input;
+nodes used more than once become wires, the others are inlined, and the
+result is written as Verilog assignments.
+'''
+import regex as re
+import numpy as np
+
+
+def _tables(T, n):
+    '''
+    Columns of T (2^n x c, row j is minterm j) as arrays with axis a for
+    bit n-1-a of the minterm. Bit b is input in<b>: the first port of a
+    partition, in(n-1), is the most significant bit of the truth table row.
+    '''
+    return np.ascontiguousarray(T.T).astype(np.uint8).reshape((T.shape[1],) + (2,) * n)
+
+
+def _distinct(funcs):
+    '''
+    Distinct non-constant functions among the rows of funcs (s x 2^r)
+    '''
+    funcs = funcs[funcs.any(axis=1) & ~funcs.all(axis=1)]
+    if len(funcs) == 0:
+        return funcs
+    keys = np.ascontiguousarray(np.packbits(funcs, axis=1))
+    keys = keys.view(np.dtype((np.void, keys.shape[1]))).reshape(-1)
+    _, first = np.unique(keys, return_index=True)
+    return funcs[np.sort(first)]
+
+
+def variable_order(T, n):
+    '''
+    Greedy top-down variable order: at every level, split on the input
+    that leaves the fewest distinct subfunctions below it. Inputs left
+    once every subfunction is constant are appended in natural order.
+    '''
+    funcs = _distinct(_tables(T, n).reshape(T.shape[1], 2 ** n))
+    funcs = funcs.reshape((len(funcs),) + (2,) * n)
+    remaining = list(range(n))
+    order = []
+    while remaining and len(funcs) > 0:
+        best, best_funcs = None, None
+        for a in range(len(remaining)):
+            cofactors = np.concatenate([funcs.take(0, axis=a+1), funcs.take(1, axis=a+1)])
+            flat = _distinct(cofactors.reshape(len(cofactors), -1))
+            if best is None or len(flat) < len(best_funcs):
+                best, best_funcs = a, flat
+        order.append(remaining.pop(best))
+        funcs = best_funcs.reshape((len(best_funcs),) + (2,) * len(remaining))
+    return order + remaining
+
+
+class BDD():
+    def __init__(self, n, order):
+        self.n = n
+        self.order = order
+        # Node i+2 is nodes[i] = (axis, low, high); 0 and 1 are constants
+        self.nodes = []
+        self.unique = {}
+        self.memo = {}
+
+    def build(self, f, depth=0):
+        '''
+        Node of the function f, an array over the inputs order[depth:]
+        '''
+        if not f.any():
+            return 0
+        if f.all():
+            return 1
+        key = (depth, f.tobytes())
+        if key not in self.memo:
+            low = self.build(f[0], depth + 1)
+            high = self.build(f[1], depth + 1)
+            if low == high:
+                node = low
+            else:
+                triple = (self.order[depth], low, high)
+                if triple not in self.unique:
+                    self.nodes.append(triple)
+                    self.unique[triple] = len(self.nodes) + 1
+                node = self.unique[triple]
+            self.memo[key] = node
+        return self.memo[key]
+
+    def build_table(self, T):
+        '''
+        Nodes of the columns of T (2^n x c)
+        '''
+        tables = _tables(T, self.n).transpose([0] + [a + 1 for a in self.order])
+        return [self.build(np.ascontiguousarray(t)) for t in tables]
+
+
+def build_bdd(T, n):
+    '''
+    Shared BDD of the columns of T and its root nodes, with the smaller of
+    the greedy and the natural variable order
+    '''
+    best = None
+    for order in (variable_order(T, n), list(range(n))):
+        bdd = BDD(n, order)
+        roots = bdd.build_table(T)
+        if best is None or len(bdd.nodes) < len(best[0].nodes):
+            best = (bdd, roots)
+    return best
+
+
+def bdd_verilog(T, n, outputs, prefix='bdd'):
+    '''
+    Verilog wires and assignments computing the columns of T (2^n x c) over
+    in0..in(n-1), minterm bit b being in<b>, the j-th column driving the net outputs[j]. Shared
+    subfunctions are wires named prefix<i>.
+    '''
+    bdd, roots = build_bdd(T, n)
+
+    fanout = [0] * (len(bdd.nodes) + 2)
+    for low_high in bdd.nodes:
+        fanout[low_high[1]] += 1
+        fanout[low_high[2]] += 1
+    for r in roots:
+        fanout[r] += 1
+
+    exprs = {0: "1'b0", 1: "1'b1"}
+
+    def expr(node):
+        if node < 2 or fanout[node] > 1:
+            return exprs.get(node, prefix + str(node))
+        return mux(node)
+
+    def mux(node):
+        a, low, high = bdd.nodes[node - 2]
+        x = 'in' + str(n - 1 - a)
+        if (low, high) == (0, 1):
+            return x
+        if (low, high) == (1, 0):
+            return '~' + x
+        if low == 0:
+            return '(' + x + ' & ' + expr(high) + ')'
+        if high == 0:
+            return '(~' + x + ' & ' + expr(low) + ')'
+        if high == 1:
+            return '(' + x + ' | ' + expr(low) + ')'
+        if low == 1:
+            return '(~' + x + ' | ' + expr(high) + ')'
+        return '(' + x + ' ? ' + expr(high) + ' : ' + expr(low) + ')'
+
+    # Shared nodes, children before parents
+    shared = [i + 2 for i in range(len(bdd.nodes)) if fanout[i + 2] > 1]
+    lines = []
+    if shared:
+        lines.append('wire ' + ', '.join(prefix + str(i) for i in shared) + ';\n')
+    for i in sorted(shared):
+        lines.append('assign ' + prefix + str(i) + ' = ' + mux(i) + ';\n')
+    for name, r in zip(outputs, roots):
+        lines.append('assign ' + name + ' = ' + expr(r) + ';\n')
+    return ''.join(lines)
+
+
+def literals(text):
+    '''
+    Number of input literals in Verilog expressions over in0, in1, ...
+    '''
+    return len(re.findall(r'\bin\d+\b', ''.join(re.findall(r'assign[^=]*=([^;]*);', text))))
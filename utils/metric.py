@@ -1,26 +1,193 @@
+import itertools
 import numpy as np
+from .truthtable import load_words, pack_rows
+
+# Number of vectors processed at once by ErrorAccumulator
+CHUNK = 1 << 16
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    def popcount(words):
+        return _POPCOUNT[words.view(np.uint8)]
+
 
 def distance(original_path, approximate_path, use_weight=False):
-    with open(original_path, 'r') as fo:
-        org_line_list = fo.readlines()
-    with open(approximate_path, 'r') as fa:
-        app_line_list = fa.readlines()
-    
-    org = [list(filter(lambda a: a != ' ', list(i[:-1]))) for i in org_line_list]
-    app = [list(filter(lambda a: a != ' ', list(i[:-1]))) for i in app_line_list]
+    width, org = load_words(original_path)
+    app_width, app = load_words(approximate_path)
 
-    if len(org_line_list) != len(app_line_list):
+    if len(org) != len(app) or width != app_width:
         print('ERROR! sizes of input files are not equal! Aborting...')
         return -1
-    HD = Hamming_Distance(org,app)
-    MAE = Weighted_HD(org, app)[0]
-    MAE_P = Weighted_HD(org, app)[1]
+
+    acc = ErrorAccumulator(width)
+    for start in range(0, len(org), CHUNK):
+        acc.update(org[start:start+CHUNK], app[start:start+CHUNK])
+    HD, MAE, MAE_P = acc.result()
     if use_weight:
         return MAE_P, [HD, MAE, MAE_P]
     else:
         return HD, [HD, MAE, MAE_P]
 
 
+def stream_distance(original_path, stream, use_weight=False, abort_at=None):
+    '''
+    Same as distance, but compares against vectors read line by line from
+    stream (e.g. the stdout of vvp), one chunk at a time. If abort_at is
+    given, reading stops as soon as the error is known to exceed it; the
+    returned errors are then lower bounds. Also returns whether it stopped.
+    '''
+    width, org = load_words(original_path)
+    acc = ErrorAccumulator(width)
+    aborted = False
+    while True:
+        lines = list(itertools.islice(stream, CHUNK))
+        if len(lines) == 0:
+            break
+        if acc.num + len(lines) > len(org):
+            print('ERROR! sizes of input files are not equal! Aborting...')
+            return -1, None, False
+        app = _parse_lines(lines, width)
+        if app is None:
+            print('ERROR! sizes of input files are not equal! Aborting...')
+            return -1, None, False
+        acc.update(org[acc.num:acc.num+len(lines)], app)
+
+        if abort_at is not None:
+            HD, _, MAE_P = acc.result(len(org))
+            if (MAE_P if use_weight else HD) > abort_at:
+                aborted = True
+                break
+
+    if not aborted and acc.num != len(org):
+        print('ERROR! sizes of input files are not equal! Aborting...')
+        return -1, None, False
+
+    HD, MAE, MAE_P = acc.result(len(org))
+    if use_weight:
+        return MAE_P, [HD, MAE, MAE_P], aborted
+    else:
+        return HD, [HD, MAE, MAE_P], aborted
+
+
+def batch_stream_distance(original_path, stream, num_streams, use_weight=False):
+    '''
+    Same as stream_distance for num_streams designs simulated together.
+    Every vector is printed once per design as "<index> <output>", in order
+    of index. Return a list of (error, [HD, MAE, MAE%]) per design.
+    '''
+    width, org = load_words(original_path)
+    accs = [ErrorAccumulator(width) for _ in range(num_streams)]
+    tags = [str(i).encode() + b' ' for i in range(num_streams)]
+    # Keep the number of lines per chunk bounded
+    step = max(1, CHUNK // num_streams) * num_streams
+    num = 0
+    while True:
+        lines = list(itertools.islice(stream, step))
+        if len(lines) == 0:
+            break
+        rows = len(lines) // num_streams
+        if len(lines) % num_streams != 0 or num + rows > len(org):
+            print('ERROR! sizes of input files are not equal! Aborting...')
+            return [(-1, None)] * num_streams
+        for acc, tag, own in zip(accs, tags, (lines[i::num_streams] for i in range(num_streams))):
+            if not all(line.startswith(tag) for line in own):
+                print('ERROR! outputs of batch simulation are out of order! Aborting...')
+                return [(-1, None)] * num_streams
+            app = _parse_lines([line[len(tag):] for line in own], width)
+            if app is None:
+                print('ERROR! sizes of input files are not equal! Aborting...')
+                return [(-1, None)] * num_streams
+            acc.update(org[num:num+rows], app)
+        num += rows
+
+    if num != len(org):
+        print('ERROR! sizes of input files are not equal! Aborting...')
+        return [(-1, None)] * num_streams
+
+    results = []
+    for acc in accs:
+        HD, MAE, MAE_P = acc.result()
+        results.append((MAE_P if use_weight else HD, [HD, MAE, MAE_P]))
+    return results
+
+
+def _parse_lines(lines, width):
+    '''
+    Pack lines of 0/1 digits printed by vvp; None if they are not all width long
+    '''
+    data = np.frombuffer(b''.join(lines), dtype=np.uint8)
+    data = data[(data == ord('0')) | (data == ord('1'))]
+    if data.size != len(lines) * width:
+        return None
+    return pack_rows((data == ord('1')).reshape((len(lines), width)))
+
+
+class ErrorAccumulator():
+    '''
+    Accumulate HD and MAE over chunks of packed vectors (see truthtable.py).
+    MAE is summed exactly for any output width; as in Weighted_HD, vectors
+    whose original value is 0 do not contribute to it.
+    '''
+    def __init__(self, width):
+        self.width = width
+        self.num = 0
+        self.hd = 0
+        self.abs_sum = 0
+
+    def update(self, org, app):
+        org = np.asarray(org, dtype=np.uint64)
+        app = np.asarray(app, dtype=np.uint64)
+        self.num += len(org)
+        self.hd += int(popcount(org ^ app).sum(dtype=np.uint64))
+
+        if org.shape[1] == 1:
+            a, b = org[:, 0], app[:, 0]
+            diff = np.where(a > b, a - b, b - a)
+            diff[a == 0] = 0
+            self.abs_sum += _sum_words(diff)
+            return
+
+        # Order each pair by comparing words from the most significant one
+        greater = np.zeros(len(org), dtype=bool)
+        decided = np.zeros(len(org), dtype=bool)
+        for w in range(org.shape[1] - 1, -1, -1):
+            greater |= ~decided & (org[:, w] > app[:, w])
+            decided |= org[:, w] != app[:, w]
+        big = np.where(greater[:, None], org, app)
+        small = np.where(greater[:, None], app, org)
+        nonzero = org.any(axis=1)
+
+        # Multi-word subtraction big - small with borrow propagation
+        borrow = np.zeros(len(org), dtype=np.uint64)
+        for w in range(org.shape[1]):
+            diff = big[:, w] - small[:, w] - borrow
+            borrow = ((big[:, w] < small[:, w]) | ((big[:, w] == small[:, w]) & (borrow == 1))).astype(np.uint64)
+            diff[~nonzero] = 0
+            self.abs_sum += _sum_words(diff) << (64 * w)
+
+    def result(self, total=None):
+        '''
+        HD, MAE and MAE%. If total is larger than the number of vectors
+        accumulated so far, these are lower bounds for a run of total vectors.
+        '''
+        num = self.num if total is None else total
+        if num == 0:
+            return 0.0, 0.0, 0.0
+        maxnum = 2 ** self.width - 1
+        return self.hd / (num * self.width), self.abs_sum / num, self.abs_sum / (num * maxnum)
+
+
+def _sum_words(words):
+    '''
+    Exact sum of uint64 values as python int
+    '''
+    low = (words & np.uint64(0xFFFFFFFF)).sum(dtype=np.uint64)
+    high = (words >> np.uint64(32)).sum(dtype=np.uint64)
+    return int(low) + (int(high) << 32)
+
+
 
 def Hamming_Distance(org_line_list, app_line_list):
     org = np.array(org_line_list)
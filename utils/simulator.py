@@ -0,0 +1,658 @@
+'''
+Bit-parallel simulator for the structural verilog handled by BLASYS
+(LSOracle partitions, yosys netlists and benchmark circuits).
+
+Every signal bit is stored as a vector of uint64 words, where bit p of the
+vector holds the value of the signal under test pattern p. One numpy
+operation therefore evaluates a gate on 64 patterns per word.
+'''
+import os
+import regex as re
+import numpy as np
+from .truthtable import read_truth
+
+
+GATES = ('and', 'nand', 'or', 'nor', 'xor', 'xnor', 'not', 'buf')
+
+TOKEN = re.compile(r'''
+    (?P<esc>\\\S+)
+  | (?P<num>\d*\s*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ_]+|\d+)
+  | (?P<id>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>~\^|\^~|~&|~\||[()\[\]{},;:=~&|^!?.\#])
+  | (?P<bad>\S)
+''', re.VERBOSE)
+
+
+def _strip(text):
+    text = re.sub(r'/\*.*?\*/', ' ', text, flags=re.S)
+    text = re.sub(r'//[^\n]*', ' ', text)
+    text = re.sub(r'\(\*.*?\*\)', ' ', text, flags=re.S)
+    text = re.sub(r'^\s*`[^\n]*', ' ', text, flags=re.M)
+    return text
+
+
+def _tokenize(text):
+    tokens = []
+    for m in TOKEN.finditer(_strip(text)):
+        kind = m.lastgroup
+        if kind == 'bad':
+            raise ValueError('Unexpected character {!r} in verilog'.format(m.group()))
+        value = m.group()
+        if kind == 'esc':
+            kind, value = 'id', value[1:]
+        tokens.append((kind, value))
+    return tokens
+
+
+def _const_bits(literal):
+    '''
+    Return bits (LSB first) of a verilog number literal
+    '''
+    literal = literal.replace(' ', '').replace('_', '')
+    if "'" not in literal:
+        value = int(literal)
+        return [(value >> i) & 1 for i in range(max(value.bit_length(), 1))]
+    size, rest = literal.split("'")
+    base = rest.lstrip('sS')[0].lower()
+    digits = rest.lstrip('sS')[1:]
+    if re.search('[xXzZ]', digits):
+        raise ValueError('Unknown value in literal ' + literal)
+    value = int(digits, {'b': 2, 'o': 8, 'd': 10, 'h': 16}[base])
+    width = int(size) if size else max(value.bit_length(), 1)
+    return [(value >> i) & 1 for i in range(width)]
+
+
+class Module():
+    def __init__(self, name):
+        self.name = name
+        self.ports = []
+        self.inputs = []
+        self.outputs = []
+        self.ranges = {}
+        self.drivers = {}
+        self.instances = []
+        self.order = None
+
+    def bits(self, name):
+        '''
+        Bit names of a declared signal, LSB first
+        '''
+        if name not in self.ranges:
+            return [name]
+        msb, lsb = self.ranges[name]
+        step = 1 if msb >= lsb else -1
+        return ['{}[{}]'.format(name, i) for i in range(lsb, msb + step, step)]
+
+    def input_bits(self):
+        return [b for name in self.inputs for b in reversed(self.bits(name))]
+
+    def output_bits(self):
+        return [b for name in self.outputs for b in reversed(self.bits(name))]
+
+
+class _Parser():
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset=0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset][1]
+        return None
+
+    def next(self):
+        if self.pos >= len(self.tokens):
+            raise ValueError('Unexpected end of verilog')
+        self.pos += 1
+        return self.tokens[self.pos - 1][1]
+
+    def expect(self, value):
+        token = self.next()
+        if token != value:
+            raise ValueError('Expected {!r} but found {!r}'.format(value, token))
+
+    def parse_range(self):
+        self.expect('[')
+        msb = int(self.next())
+        self.expect(':')
+        lsb = int(self.next())
+        self.expect(']')
+        return msb, lsb
+
+    # ---------------- expressions ----------------
+
+    def primary(self, mod):
+        token = self.next()
+        kind = self.tokens[self.pos - 1][0]
+        if token == '(':
+            bits = self.expression(mod)
+            self.expect(')')
+            return bits
+        if token == '{':
+            parts = [self.expression(mod)]
+            while self.peek() == ',':
+                self.next()
+                parts.append(self.expression(mod))
+            if self.peek() == '{':
+                raise ValueError('Replication is not supported')
+            self.expect('}')
+            bits = []
+            for part in reversed(parts):
+                bits += part
+            return bits
+        if kind == 'num':
+            return [('const', b) for b in _const_bits(token)]
+        if kind != 'id':
+            raise ValueError('Unexpected token {!r} in expression'.format(token))
+        if self.peek() == '[':
+            self.next()
+            msb = int(self.next())
+            if self.peek() == ':':
+                self.next()
+                lsb = int(self.next())
+                self.expect(']')
+                step = 1 if msb >= lsb else -1
+                return [('sig', '{}[{}]'.format(token, i)) for i in range(lsb, msb + step, step)]
+            self.expect(']')
+            return [('sig', '{}[{}]'.format(token, msb))]
+        return [('sig', b) for b in mod.bits(token)]
+
+    def unary(self, mod):
+        if self.peek() in ('~', '!'):
+            op = self.next()
+            bits = self.unary(mod)
+            if op == '!':
+                bits = [_reduce('or', bits)]
+            return [('not', b) for b in bits]
+        if self.peek() in ('&', '|', '^', '~&', '~|', '~^', '^~'):
+            raise ValueError('Reduction operators are not supported')
+        return self.primary(mod)
+
+    def binary(self, mod, ops, sub):
+        bits = sub(mod)
+        while self.peek() in ops:
+            op = self.next()
+            rhs = sub(mod)
+            bits = _bitwise(ops[op], bits, rhs)
+        return bits
+
+    def expression(self, mod):
+        xor_ops = {'^': 'xor', '~^': 'xnor', '^~': 'xnor'}
+        and_level = lambda m: self.binary(m, {'&': 'and'}, self.unary)
+        xor_level = lambda m: self.binary(m, xor_ops, and_level)
+        bits = self.binary(mod, {'|': 'or'}, xor_level)
+        if self.peek() == '?':
+            self.next()
+            then_bits = self.expression(mod)
+            self.expect(':')
+            else_bits = self.expression(mod)
+            sel = _reduce('or', bits)
+            width = max(len(then_bits), len(else_bits))
+            then_bits = _extend(then_bits, width)
+            else_bits = _extend(else_bits, width)
+            bits = [('mux', sel, t, e) for t, e in zip(then_bits, else_bits)]
+        return bits
+
+    def lvalue(self, mod):
+        bits = self.primary(mod)
+        for b in bits:
+            if b[0] != 'sig':
+                raise ValueError('Illegal assignment target')
+        return [b[1] for b in bits]
+
+    # ---------------- module items ----------------
+
+    def declaration(self, mod, kind):
+        rng = None
+        if self.peek() in ('wire', 'reg'):
+            self.next()
+        if self.peek() == '[':
+            rng = self.parse_range()
+        while True:
+            name = self.next()
+            if rng is not None:
+                mod.ranges[name] = rng
+            if self.peek() == '=':
+                self.next()
+                lhs = mod.bits(name)
+                rhs = _extend(self.expression(mod), len(lhs))
+                for key, bit in zip(lhs, rhs):
+                    mod.drivers[key] = bit
+            if kind == 'input' and name not in mod.inputs:
+                mod.inputs.append(name)
+            elif kind == 'output' and name not in mod.outputs:
+                mod.outputs.append(name)
+            if self.peek() == ',' and self.peek(1) not in ('input', 'output'):
+                self.next()
+                continue
+            break
+
+    def assign(self, mod):
+        while True:
+            lhs = self.lvalue(mod)
+            self.expect('=')
+            rhs = _extend(self.expression(mod), len(lhs))
+            for key, bit in zip(lhs, rhs):
+                mod.drivers[key] = bit
+            if self.next() == ';':
+                break
+
+    def gate(self, mod, kind):
+        while True:
+            if self.peek() != '(':
+                self.next()
+            self.expect('(')
+            terms = [self.expression(mod)]
+            while self.peek() == ',':
+                self.next()
+                terms.append(self.expression(mod))
+            self.expect(')')
+            if kind in ('not', 'buf'):
+                for out in terms[:-1]:
+                    bit = terms[-1][0]
+                    mod.drivers[out[0][1]] = ('not', bit) if kind == 'not' else bit
+            else:
+                base = kind[1:] if kind in ('nand', 'nor', 'xnor') else kind
+                bit = _reduce(base, [t[0] for t in terms[1:]])
+                if base != kind:
+                    bit = ('not', bit)
+                mod.drivers[terms[0][0][1]] = bit
+            if self.next() == ';':
+                break
+
+    def instance(self, mod, child):
+        if self.peek() == '#':
+            self.next()
+            self.expect('(')
+            depth = 1
+            while depth:
+                token = self.next()
+                depth += (token == '(') - (token == ')')
+        while True:
+            if self.peek() != '(':
+                self.next()
+            self.expect('(')
+            conns = {} if self.peek() == '.' else []
+            while self.peek() != ')':
+                if self.peek() == '.':
+                    self.next()
+                    port = self.next()
+                    self.expect('(')
+                    conns[port] = self.expression(mod) if self.peek() != ')' else None
+                    self.expect(')')
+                else:
+                    conns.append(self.expression(mod))
+                if self.peek() == ',':
+                    self.next()
+            self.expect(')')
+            mod.instances.append((child, conns))
+            if self.next() == ';':
+                break
+
+    def module(self):
+        mod = Module(self.next())
+        if self.peek() == '#':
+            raise ValueError('Parameterized modules are not supported')
+        if self.peek() == '(':
+            self.next()
+            while self.peek() != ')':
+                token = self.peek()
+                if token in ('input', 'output'):
+                    self.next()
+                    self.declaration(mod, token)
+                    mod.ports += [p for p in (mod.inputs + mod.outputs) if p not in mod.ports]
+                    continue
+                if token != ',':
+                    mod.ports.append(token)
+                self.next()
+            self.next()
+        self.expect(';')
+
+        while True:
+            token = self.next()
+            if token == 'endmodule':
+                break
+            if token in ('input', 'output', 'wire', 'reg'):
+                self.declaration(mod, token)
+                self.expect(';')
+            elif token == 'assign':
+                self.assign(mod)
+            elif token in GATES:
+                self.gate(mod, token)
+            elif token in ('supply0', 'supply1'):
+                value = 0 if token == 'supply0' else 1
+                while self.peek() != ';':
+                    name = self.next()
+                    if name != ',':
+                        mod.drivers[name] = ('const', value)
+                self.next()
+            elif self.tokens[self.pos - 1][0] == 'id':
+                self.instance(mod, token)
+            else:
+                raise ValueError('Unexpected token {!r} in module {}'.format(token, mod.name))
+        return mod
+
+
+def _extend(bits, width):
+    bits = list(bits[:width])
+    return bits + [('const', 0)] * (width - len(bits))
+
+
+def _bitwise(op, lhs, rhs):
+    width = max(len(lhs), len(rhs))
+    lhs = _extend(lhs, width)
+    rhs = _extend(rhs, width)
+    if op == 'xnor':
+        return [('not', ('xor', a, b)) for a, b in zip(lhs, rhs)]
+    return [(op, a, b) for a, b in zip(lhs, rhs)]
+
+
+def _reduce(op, bits):
+    result = bits[0]
+    for b in bits[1:]:
+        result = (op, result, b)
+    return result
+
+
+def _signals(expr, found):
+    stack = [expr]
+    while stack:
+        e = stack.pop()
+        if e[0] == 'sig':
+            found.append(e[1])
+        elif e[0] != 'const':
+            stack.extend(e[1:])
+    return found
+
+
+class Netlist():
+    '''
+    Set of parsed verilog modules that can be simulated with packed patterns
+    '''
+    def __init__(self, files=()):
+        self.modules = {}
+        for f in files:
+            self.read(f)
+
+    def read(self, fname):
+        with open(fname) as f:
+            self.read_text(f.read())
+
+    def read_text(self, text):
+        parser = _Parser(_tokenize(text))
+        while parser.peek() is not None:
+            token = parser.next()
+            if token in ('module', 'macromodule'):
+                mod = parser.module()
+                self.modules[mod.name] = mod
+            else:
+                raise ValueError('Unexpected token {!r} outside module'.format(token))
+
+    def top(self):
+        '''
+        Name of the module that is not instantiated by any other module
+        '''
+        used = {child for mod in self.modules.values() for child, _ in mod.instances}
+        tops = [name for name in self.modules if name not in used]
+        if len(tops) != 1:
+            raise ValueError('Cannot determine top-level module')
+        return tops[0]
+
+    def _schedule(self, mod):
+        '''
+        Topological order of driven bits and instances in module mod
+        '''
+        if mod.order is not None:
+            return mod.order
+
+        inst_out = {}
+        for idx, (child, conns) in enumerate(mod.instances):
+            sub = self.modules.get(child)
+            if sub is None:
+                raise ValueError('Module {} is not defined'.format(child))
+            for port, bits in self._bind(sub, conns).items():
+                if port in sub.outputs and bits is not None:
+                    for b in bits:
+                        inst_out[b[1]] = idx
+
+        def deps(node):
+            if node[0] == 'bit':
+                sigs = _signals(mod.drivers[node[1]], [])
+            else:
+                child, conns = mod.instances[node[1]]
+                sub = self.modules[child]
+                sigs = []
+                for port, bits in self._bind(sub, conns).items():
+                    if port in sub.inputs and bits is not None:
+                        for b in bits:
+                            _signals(b, sigs)
+            result = []
+            for s in sigs:
+                if s in mod.drivers:
+                    result.append(('bit', s))
+                elif s in inst_out:
+                    result.append(('inst', inst_out[s]))
+            return result
+
+        order = []
+        state = {}
+        roots = [('bit', key) for key in mod.drivers] + [('inst', i) for i in range(len(mod.instances))]
+        for root in roots:
+            if root in state:
+                continue
+            stack = [(root, iter(deps(root)))]
+            state[root] = 1
+            while stack:
+                node, it = stack[-1]
+                for dep in it:
+                    if dep not in state:
+                        state[dep] = 1
+                        stack.append((dep, iter(deps(dep))))
+                        break
+                    if state[dep] == 1:
+                        raise ValueError('Combinational loop in module ' + mod.name)
+                else:
+                    stack.pop()
+                    state[node] = 2
+                    order.append(node)
+        mod.order = order
+        return order
+
+    def _bind(self, sub, conns):
+        '''
+        Map port name of sub to connected bit expressions (LSB first)
+        '''
+        if isinstance(conns, dict):
+            bound = conns
+        else:
+            bound = dict(zip(sub.ports, conns))
+        result = {}
+        for port, bits in bound.items():
+            if bits is not None:
+                bits = _extend(bits, len(sub.bits(port)))
+            result[port] = bits
+        return result
+
+    def simulate(self, name, inputs, nwords, overrides=None):
+        '''
+        Simulate module name. inputs maps input bit names to packed uint64
+        words; returns a dict of packed words for every output bit.
+        overrides maps module names to functions replacing their simulation.
+        '''
+        overrides = overrides or {}
+        if name in overrides:
+            return overrides[name](inputs, nwords)
+
+        mod = self.modules[name]
+        values = dict(inputs)
+        zero = np.zeros(nwords, dtype=np.uint64)
+        for node in self._schedule(mod):
+            if node[0] == 'bit':
+                values[node[1]] = _evaluate(mod.drivers[node[1]], values, zero)
+                continue
+            child, conns = mod.instances[node[1]]
+            sub = self.modules[child]
+            bound = self._bind(sub, conns)
+            sub_in = {}
+            for port in sub.inputs:
+                bits = bound.get(port)
+                for key, b in zip(sub.bits(port), bits or []):
+                    sub_in[key] = _evaluate(b, values, zero)
+            sub_out = self.simulate(child, sub_in, nwords, overrides)
+            for port in sub.outputs:
+                bits = bound.get(port)
+                for key, b in zip(sub.bits(port), bits or []):
+                    if b[0] == 'sig':
+                        values[b[1]] = sub_out[key]
+
+        return {key: _evaluate(('sig', key), values, zero) for key in mod.output_bits()}
+
+
+def _evaluate(expr, values, zero):
+    op = expr[0]
+    if op == 'sig':
+        if expr[1] not in values:
+            raise ValueError('Signal {} is undriven'.format(expr[1]))
+        return values[expr[1]]
+    if op == 'const':
+        return ~zero if expr[1] else zero
+    if op == 'not':
+        return ~_evaluate(expr[1], values, zero)
+    a = _evaluate(expr[1], values, zero)
+    b = _evaluate(expr[2], values, zero)
+    if op == 'and':
+        return a & b
+    if op == 'or':
+        return a | b
+    if op == 'xor':
+        return a ^ b
+    c = _evaluate(expr[3], values, zero)
+    return (a & b) | (~a & c)
+
+
+def pack_bits(bits):
+    '''
+    Pack a 0/1 vector of N patterns into ceil(N/64) uint64 words
+    '''
+    bits = np.asarray(bits, dtype=np.uint8)
+    pad = (-len(bits)) % 64
+    if pad:
+        bits = np.concatenate([bits, np.zeros(pad, dtype=np.uint8)])
+    return np.packbits(bits, bitorder='little').view('<u8').astype(np.uint64)
+
+
+def unpack_bits(words, num):
+    '''
+    Inverse of pack_bits; return uint8 array of the first num patterns
+    '''
+    words = np.ascontiguousarray(words, dtype=np.uint64)
+    bits = np.unpackbits(words.astype('<u8').view(np.uint8), bitorder='little')
+    return bits[:num]
+
+
+def exhaustive_patterns(n):
+    '''
+    Packed input patterns enumerating 0 .. 2^n-1; pattern[i] holds bit n-1-i
+    '''
+    index = np.arange(2 ** n, dtype=np.uint32)
+    return [pack_bits((index >> (n - 1 - i)) & 1) for i in range(n)]
+
+
+def partition_truth(fname):
+    '''
+    Exhaustively simulate a partition and return (#inputs, #outputs, truth)
+    where truth[j] holds the outputs under input pattern j
+    '''
+    netlist = Netlist([fname])
+    name = netlist.top()
+    mod = netlist.modules[name]
+    in_bits = mod.input_bits()
+    out_bits = mod.output_bits()
+    n = len(in_bits)
+    patterns = exhaustive_patterns(n)
+    nwords = len(patterns[0])
+    outputs = netlist.simulate(name, dict(zip(in_bits, patterns)), nwords)
+    truth = np.stack([unpack_bits(outputs[b], 2 ** n) for b in out_bits], axis=1)
+    return n, len(out_bits), truth
+
+
+def read_testbench(fname):
+    '''
+    Parse a BLASYS testbench, either with one statement per vector or with
+    a loop over all patterns or over a $readmemb vector file. Return the
+    name of the design under test, its positional port connections as lists
+    of (vector, index) bits (LSB first) and the stimulus matrix, where
+    stimulus[v, i] is pi[i] of vector v.
+    '''
+    with open(fname) as f:
+        text = _strip(f.read())
+
+    width = re.search(r'reg\s*\[\s*(\d+)\s*:\s*0\s*\]\s*pi\s*;', text)
+    inst = re.search(r'(\\\S+|\w+)\s+dut\s*\((.*?)\)\s*;', text, flags=re.S)
+    if width is None or inst is None:
+        raise ValueError('Cannot parse testbench ' + fname)
+    n = int(width.group(1)) + 1
+
+    conns = []
+    for conn in inst.group(2).split(','):
+        m = re.fullmatch(r'\s*(pi|po)\s*\[\s*(\d+)\s*(?::\s*(\d+)\s*)?\]\s*', conn)
+        if m is None:
+            raise ValueError('Cannot parse port connection {!r} in testbench'.format(conn))
+        hi = int(m.group(2))
+        lo = hi if m.group(3) is None else int(m.group(3))
+        step = 1 if hi >= lo else -1
+        conns.append([(m.group(1), i) for i in range(lo, hi + step, step)])
+
+    loop = re.search(r'for\s*\(\s*(\w+)\s*=\s*0\s*;\s*\1\s*<\s*(\d+)\s*;.*?pi\s*=\s*(\w+)\s*(\[\s*\1\s*\])?\s*;', text, flags=re.S)
+    if loop is not None:
+        num = int(loop.group(2))
+        if loop.group(4) is None:
+            # pi = i
+            index = np.arange(num, dtype=np.uint64)
+            stimulus = ((index[:, None] >> np.arange(n - 1, -1, -1, dtype=np.uint64)) & 1).astype(np.uint8)
+        else:
+            # pi = vectors[i], loaded by $readmemb
+            memfile = re.search(r'\$readmemb\s*\(\s*"([^"]*)"\s*,\s*' + loop.group(3) + r'\s*\)', text)
+            if memfile is None:
+                raise ValueError('No $readmemb for {} in testbench {}'.format(loop.group(3), fname))
+            path = memfile.group(1)
+            if not os.path.isabs(path) and not os.path.exists(path):
+                path = os.path.join(os.path.dirname(fname), path)
+            stimulus = read_truth(path)[:num]
+        if stimulus.shape != (num, n):
+            raise ValueError('Stimulus of testbench {} does not match pi'.format(fname))
+        return inst.group(1).lstrip('\\'), conns, stimulus[:, ::-1]
+
+    vectors = re.findall(r'pi\s*=\s*\d+\'b([01]+)\s*;', text)
+    if len(vectors) == 0:
+        raise ValueError('No test vectors in testbench ' + fname)
+    stimulus = np.frombuffer(''.join(vectors).encode(), dtype=np.uint8).reshape((len(vectors), n)) - ord('0')
+    return inst.group(1).lstrip('\\'), conns, stimulus[:, ::-1]
+
+
+def simulate_testbench(netlist, testbench, overrides=None):
+    '''
+    Apply the stimulus of a parsed testbench to the design in netlist and
+    return the output matrix in the order printed by $display("%b", po)
+    '''
+    name, conns, stimulus = testbench
+    mod = netlist.modules[name]
+    num = stimulus.shape[0]
+    pi = [pack_bits(stimulus[:, i]) for i in range(stimulus.shape[1])]
+    nwords = len(pi[0])
+
+    inputs = {}
+    po = {}
+    for port, bits in zip(mod.ports, conns):
+        for key, (vec, idx) in zip(mod.bits(port), bits):
+            if vec == 'pi':
+                inputs[key] = pi[idx]
+            else:
+                po[idx] = key
+
+    outputs = netlist.simulate(name, inputs, nwords, overrides)
+    width = max(po) + 1
+    result = np.zeros((num, width), dtype=np.uint8)
+    for idx, key in po.items():
+        result[:, width - 1 - idx] = unpack_bits(outputs[key], num)
+    return result
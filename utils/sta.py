@@ -0,0 +1,145 @@
+'''
+Timing and power analysis with OpenSTA.
+
+timing_power reports the delay and the power of a netlist with a single
+sta run, parsed from its output stream. A StaSession keeps one sta process
+that reads the liberty file once and analyzes netlist after netlist sent
+over stdin. Like the yosys sessions, every process gets its own session on
+first use.
+'''
+import os
+import atexit
+import tempfile
+import threading
+import subprocess
+import regex as re
+
+# Interactive prompt of sta
+PROMPT = re.compile(r'^(%\s)+')
+
+# Netlists linked by one session before it is restarted to free memory
+SESSION_JOBS = 500
+
+_sessions = {}
+
+
+def analysis(input_file, modulename, period):
+    '''
+    sta commands reporting timing and power of a netlist whose clock
+    period (for power) is period
+    '''
+    return ['read_verilog ' + input_file,
+            'link_design ' + modulename,
+            'create_clock -name clk -period {}'.format(period),
+            'set_input_delay -clock clk 0 [all_inputs]',
+            'set_output_delay -clock clk 0 [all_outputs]',
+            'report_checks -digits 6',
+            'report_power -digits 12']
+
+
+def parse_report(lines):
+    '''
+    Delay (ns) and power (uW) in the output lines of the analysis
+    '''
+    delay, power = None, None
+    for line in lines:
+        tokens = line.split()
+        if delay is None and len(tokens) >= 4 and tokens[1:4] == ['data', 'arrival', 'time']:
+            delay = float(tokens[0]) + 0.005
+        if power is None and len(tokens) >= 6 and tokens[0] == 'Total':
+            power = float(tokens[4]) * 1e6
+    if delay is None or power is None:
+        raise ValueError('sta did not report timing and power:\n' + ''.join(lines[-20:]))
+    return delay, power
+
+
+def timing_power(sta, liberty, input_file, modulename, period):
+    '''
+    Delay and power of a netlist, analyzed by one sta run
+    '''
+    commands = ['read_liberty ' + liberty] + analysis(input_file, modulename, period) + ['exit']
+    out = subprocess.run([sta, '-no_splash'], input='\n'.join(commands) + '\n',
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True).stdout
+    return parse_report(out.splitlines(True))
+
+
+class StaSession():
+    def __init__(self, sta, liberty):
+        self.sta = sta
+        self.liberty = liberty
+        self.process = None
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen([self.sta, '-no_splash'], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        self.linked = 0
+        self.process.stdin.write('read_liberty ' + self.liberty + '\n')
+
+    def run(self, input_file, modulename, period):
+        '''
+        Delay and power of a netlist
+        '''
+        with self.lock:
+            if self.process is None or self.process.poll() is not None or self.linked >= SESSION_JOBS:
+                self.close()
+                self._start()
+            self.jobs += 1
+            self.linked += 1
+
+            # Every netlist is linked under a top-level name of its own, so
+            # the modules of earlier netlists never clash with it
+            top = '{}_sta{}'.format(modulename, self.jobs)
+            with open(input_file) as f:
+                text = re.sub(r'\bmodule\s+' + re.escape(modulename) + r'\b', 'module ' + top, f.read())
+            fd, netlist = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(input_file)), suffix='_sta.v')
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+
+            marker = 'BLASYS_STA_{}_DONE'.format(self.jobs)
+            lines = []
+            try:
+                # Reports and the marker go through Tcl's stdout channel, which
+                # is buffered on a pipe
+                for command in analysis(netlist, top, period) + ['puts ' + marker, 'flush stdout']:
+                    self.process.stdin.write(command + '\n')
+                self.process.stdin.flush()
+                for line in self.process.stdout:
+                    line = PROMPT.sub('', line)
+                    if line.strip() == marker:
+                        break
+                    lines.append(line)
+                else:
+                    self.process = None
+                    raise ValueError('sta exited unexpectedly:\n' + ''.join(lines[-20:]))
+            except BrokenPipeError:
+                self.process = None
+                raise ValueError('sta exited unexpectedly')
+            finally:
+                os.remove(netlist)
+        return parse_report(lines)
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.write('exit\n')
+            self.process.stdin.close()
+            self.process.wait()
+        self.process = None
+
+
+def sta_session(sta, liberty):
+    '''
+    Session of this process analyzing with the liberty file liberty
+    '''
+    key = (os.getpid(), sta, liberty)
+    if key not in _sessions:
+        _sessions[key] = StaSession(sta, liberty)
+    return _sessions[key]
+
+
+@atexit.register
+def _close_sessions():
+    for key, session in list(_sessions.items()):
+        if key[0] == os.getpid():
+            session.close()
@@ -0,0 +1,103 @@
+'''
+Surrogate area model for screening candidate designs.
+
+The logic size of a design is the number of two-input AND nodes of its
+expressions after structural hashing (XOR and multiplexers count as three),
+summed over the Verilog files of the design. Synthesized area is modeled
+as a linear function of the logic size, fitted by least squares to every
+design that has been synthesized so far. The model also keeps the errors
+of every estimating tier (surrogate, light synthesis, hierarchical)
+against full synthesis, separately.
+'''
+import numpy as np
+from .simulator import Netlist
+
+# AND nodes of each operator of the simulator's expression trees
+AIG_NODES = {'and': 1, 'or': 1, 'xor': 3, 'mux': 3}
+
+# Logic size of parsed Verilog files, cached per process
+_sizes = {}
+
+
+def _module_size(netlist, name, sizes):
+    if name in sizes:
+        return sizes[name]
+    mod = netlist.modules[name]
+    found = set()
+    stack = list(mod.drivers.values())
+    while stack:
+        e = stack.pop()
+        if e[0] in ('sig', 'const') or e in found:
+            continue
+        found.add(e)
+        stack.extend(e[1:])
+    size = sum(AIG_NODES.get(e[0], 0) for e in found)
+    size += sum(_module_size(netlist, child, sizes) for child, _ in mod.instances if child in netlist.modules)
+    sizes[name] = size
+    return size
+
+
+def logic_size(fname):
+    '''
+    Logic size of the top-level module of a Verilog file
+    '''
+    if fname not in _sizes:
+        netlist = Netlist([fname])
+        _sizes[fname] = _module_size(netlist, netlist.top(), {})
+    return _sizes[fname]
+
+
+# Names of the estimating tiers in the error report
+TIER_NAMES = {'surrogate': 'Surrogate area model', 'light': 'Light synthesis', 'hier': 'Hierarchical synthesis'}
+
+
+class AreaModel():
+    def __init__(self):
+        # Logic size and synthesized area of every design seen
+        self.samples = []
+        # Relative errors of the estimated areas checked against synthesis,
+        # by tier
+        self.errors = {}
+        self.slope = None
+        self.intercept = 0.
+
+    def size(self, verilog_list):
+        return sum(logic_size(f) for f in verilog_list)
+
+    def predict(self, verilog_list):
+        '''
+        Estimated area of the design made of the files in verilog_list
+        '''
+        if self.slope is None:
+            raise ValueError('Area model has not been calibrated')
+        return self.slope * self.size(verilog_list) + self.intercept
+
+    def add(self, verilog_list, area):
+        '''
+        Calibrate with the synthesized area of a design
+        '''
+        self.samples.append((self.size(verilog_list), area))
+        size, area = np.array(self.samples, dtype=float).T
+        if len(np.unique(size)) > 1:
+            self.slope, self.intercept = np.polyfit(size, area, 1)
+        else:
+            # A single design gives the area per node only
+            self.slope, self.intercept = area.mean() / max(size.mean(), 1.), 0.
+
+    def check(self, tier, estimated, area):
+        '''
+        Record the error of the area estimated by a tier against the
+        synthesized area
+        '''
+        if area > 0:
+            self.errors.setdefault(tier, []).append(abs(estimated - area) / area)
+
+    def report(self, tier='surrogate'):
+        '''
+        Mean and largest relative error of the checked estimates of a tier
+        '''
+        errors = self.errors.get(tier, [])
+        if len(errors) == 0:
+            return '{}: no estimate checked yet'.format(TIER_NAMES[tier])
+        return '{} area error over {} designs: mean {:.2%}, max {:.2%}'.format(
+                TIER_NAMES[tier], len(errors), np.mean(errors), np.max(errors))
@@ -0,0 +1,111 @@
+'''
+Bit-packed truth table files.
+
+A packed file starts with a 24-byte header (magic "BLTT", uint32 version,
+uint64 number of vectors, uint64 width) followed by ceil(width/64) little
+endian uint64 words per vector. Bit b of a vector is the b-th bit counted
+from the right of the line that vvp prints with "%b", so a vector's words
+are its value as a multi-word unsigned integer.
+
+Readers accept both packed files and the text format (one line of 0/1
+digits per vector, optionally separated by spaces as written by asso).
+'''
+import numpy as np
+
+MAGIC = b'BLTT'
+VERSION = 1
+HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('num', '<u8'), ('width', '<u8')])
+
+
+def read_truth(fname):
+    '''
+    Read a text truth table (vvp output or asso "%d " matrices) as uint8 matrix
+    '''
+    with open(fname, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    rows = np.count_nonzero(data == ord('\n'))
+    digits = data[(data == ord('0')) | (data == ord('1'))] - ord('0')
+    if rows == 0:
+        return digits.reshape((0, 0))
+    return digits.reshape((rows, -1))
+
+
+def is_packed(fname):
+    with open(fname, 'rb') as f:
+        return f.read(4) == MAGIC
+
+
+def pack_rows(truth):
+    '''
+    Pack a 0/1 matrix (vector x bit, MSB first) into uint64 words per vector
+    '''
+    truth = np.asarray(truth, dtype=np.uint8)
+    num, width = truth.shape
+    nwords = (width + 63) // 64
+    bits = np.zeros((num, nwords * 64), dtype=np.uint8)
+    bits[:, :width] = truth[:, ::-1]
+    return np.packbits(bits, axis=1, bitorder='little').view('<u8')
+
+
+def unpack_rows(words, width):
+    '''
+    Inverse of pack_rows
+    '''
+    words = np.ascontiguousarray(words, dtype='<u8')
+    bits = np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+    return bits[:, width - 1::-1] if width > 0 else bits[:, :0]
+
+
+def save_truth(fname, truth, packed=True):
+    '''
+    Write a 0/1 matrix as packed (default) or text truth table
+    '''
+    truth = np.asarray(truth, dtype=np.uint8)
+    if not packed:
+        lines = np.empty((truth.shape[0], truth.shape[1] + 1), dtype=np.uint8)
+        lines[:, :-1] = truth + ord('0')
+        lines[:, -1] = ord('\n')
+        with open(fname, 'wb') as f:
+            f.write(lines.tobytes())
+        return
+
+    header = np.array([(MAGIC, VERSION, truth.shape[0], truth.shape[1])], dtype=HEADER)
+    with open(fname, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(pack_rows(truth).tobytes())
+
+
+def load_packed(fname):
+    '''
+    Memory-map a packed truth table; return (#vectors, width, words)
+    '''
+    header = np.fromfile(fname, dtype=HEADER, count=1)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError(fname + ' is not a packed truth table')
+    num, width = int(header['num']), int(header['width'])
+    nwords = (width + 63) // 64
+    if num == 0 or nwords == 0:
+        return num, width, np.zeros((num, nwords), dtype='<u8')
+    words = np.memmap(fname, dtype='<u8', mode='r', offset=HEADER.itemsize, shape=(num, nwords))
+    return num, width, words
+
+
+def load_words(fname):
+    '''
+    Packed words of a truth table in either format; return (width, words)
+    '''
+    if is_packed(fname):
+        _, width, words = load_packed(fname)
+        return width, words
+    truth = read_truth(fname)
+    return truth.shape[1], pack_rows(truth)
+
+
+def load_truth(fname):
+    '''
+    Read a truth table in either format as uint8 matrix (vector x bit, MSB first)
+    '''
+    if is_packed(fname):
+        _, width, words = load_packed(fname)
+        return unpack_rows(words, width)
+    return read_truth(fname)
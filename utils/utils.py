@@ -4,12 +4,192 @@ import os
 import numpy as np
 import shutil
 import subprocess
-from .asso import asso
-from .metric import distance
-
-def evaluate_design(k_stream, worker, filename, display=True, use_weight=False):
+import multiprocessing as mp
+import fcntl
+import tempfile
+from io import StringIO
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from . import asso_api
+except ImportError:
+    # _asso.so has not been built (make); only the NumPy backend works
+    asso_api = None
+from . import bmf
+from .cache import MODULE_PLACEHOLDER
+from .logic import bdd_verilog
+from .yosys import run_yosys
+from .sta import timing_power, sta_session
+from .metric import distance, stream_distance, batch_stream_distance
+from .truthtable import save_truth, load_truth
+from .composition import compose_outputs
+from .create_tb import write_stimulus
+
+def evaluate_design(k_stream, worker, filename, display=True, use_weight=False, abort_at=None, error=None, tier='full'):
+    '''
+    Simulate and synthesize a candidate design. If error is given, it is
+    the (err, err_s) of a batch simulation and only synthesis is run. The
+    area comes from the synthesis tier: 'full' synthesizes with the ABC
+    script of the worker, 'light' with its light script, and 'hier' and
+    'surrogate' estimate it (see estimate_area). Delay and power are only
+    computed by 'full' (nan otherwise).
+    '''
     if display:
         print('Evaluating Design:', k_stream)
+    verilog_list = candidate_verilog(k_stream, worker)
+
+    truth_dir = os.path.join(worker.output, 'truthtable', filename+'.truth')
+    ground_truth = os.path.join(worker.output, worker.modulename + '.truth')
+    simulated = False
+    if error is not None:
+        f, f_list = error
+    elif worker.native_sim:
+        # Simulate top-level with partitions replaced by truth table lookups
+        try:
+            save_truth(truth_dir, compose_outputs(k_stream, worker), worker.packed_truth)
+            simulated = True
+        except ValueError as e:
+            print('Built-in simulator failed ({}); falling back to iverilog'.format(e))
+    if error is None and not simulated:
+        # Compare vvp output with ground truth while it is being printed
+        subprocess.call([worker.path['iverilog'], '-o', truth_dir[:-5]+'iv'] + verilog_list + [worker.testbench])
+        vvp = subprocess.Popen([worker.path['vvp'], truth_dir[:-5]+'iv'], stdout=subprocess.PIPE)
+        f, f_list, aborted = stream_distance(ground_truth, vvp.stdout, use_weight, abort_at)
+        if aborted:
+            # f and f_list are lower bounds, above every threshold already
+            print('Error exceeds {:.6f}; simulation stopped early'.format(abort_at))
+            vvp.kill()
+        vvp.stdout.close()
+        vvp.wait()
+        os.remove(truth_dir[:-5] + 'iv')
+
+    if tier == 'full' or tier == 'light':
+        area, delay, power = synthesize_design(verilog_list, worker, filename, tier == 'light')
+    else:
+        area, delay, power = estimate_area(verilog_list, worker), np.nan, np.nan
+
+    if simulated:
+        f, f_list = distance(ground_truth, truth_dir, use_weight)
+
+    print('Simulation error: {:.6f}\tCircuit area ({}): {:.6f}\tCircuit delay: {:.6f}\tPower consumption: {:.6f}'.format(f, tier, area, delay, power))
+    return f, f_list, area, delay, power
+
+
+def synthesize_design(verilog_list, worker, filename, light=False):
+    '''
+    Area, delay and power of the flat synthesis of a candidate design. With
+    light, the light ABC script is used and only the area is computed.
+    '''
+    output_syn = os.path.join(worker.output, 'tmp', filename)
+    script = worker.light_script if light else worker.script
+    area  = synth_design(' '.join(verilog_list), output_syn, worker.library, script, worker.path['yosys'], worker.synth_cache)
+    if light:
+        return area, np.nan, np.nan
+
+    # Estimate time and power
+    delay, power = analyze_timing_power(output_syn+'_syn.v', worker)
+    return area, delay, power
+
+
+def analyze_timing_power(netlist, worker):
+    '''
+    Delay and power of a synthesized candidate, by one sta run or, with
+    batch_sta, by the sta session of this process
+    '''
+    if worker.batch_sta:
+        session = sta_session(worker.path['OpenSTA'], worker.library)
+        return session.run(netlist, worker.modulename, worker.delay)
+    return timing_power(worker.path['OpenSTA'], worker.library, netlist, worker.modulename, worker.delay)
+
+
+def estimate_area(verilog_list, worker):
+    '''
+    Area of a candidate design from its separately synthesized partitions
+    with --hier-synth, otherwise from the surrogate area model
+    '''
+    if worker.hier_synth:
+        return hier_area(verilog_list, worker)
+    return worker.area_model.predict(verilog_list)
+
+
+def hier_area(verilog_list, worker):
+    '''
+    Area of a candidate design (top-level first in verilog_list) as the
+    area of its top-level glue plus the areas of its partitions, each
+    synthesized on its own once
+    '''
+    return glue_area(worker) + sum(part_area(v, worker) for v in verilog_list[1:])
+
+
+def cached_area(path, synthesize):
+    '''
+    Area stored in the file path, computed by synthesize() on first use
+    '''
+    if not os.path.exists(path):
+        with locked(path + '.lock'):
+            if not os.path.exists(path):
+                write_atomic(path, str(synthesize()) + '\n')
+    with open(path) as f:
+        return float(f.read())
+
+
+def hier_dir(worker):
+    '''
+    Directory of the areas and netlists of --hier-synth, under tmp/ so
+    that the partition sources stay untouched
+    '''
+    directory = os.path.join(worker.output, 'tmp', 'hier')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def part_area(part_verilog, worker):
+    '''
+    Area of one partition, stored under hier_dir by the name of its Verilog
+    file. Its mapped netlist is kept there as <name>_part_syn.v.
+    '''
+    name = os.path.join(hier_dir(worker), os.path.basename(part_verilog)[:-2])
+    return cached_area(name + '.area', lambda: synth_design(part_verilog,
+            name + '_part', worker.library, worker.script, worker.path['yosys'], worker.synth_cache))
+
+
+def glue_area(worker):
+    '''
+    Area of the top-level module alone, with the partitions as blackboxes.
+    The glue logic is flattened, so submodules of the top level count too.
+    '''
+    part_dir = os.path.join(worker.output, 'partition')
+    parts = [os.path.join(part_dir, m + '.v') for m in worker.modulenames]
+    yosys_command = 'read_verilog -lib ' + ' '.join(parts) + '; ' \
+            + 'read_verilog ' + os.path.join(part_dir, worker.modulename + '.v') + '; ' \
+            + 'synth -flatten -top ' + worker.modulename + '; opt_clean -purge; abc -liberty ' + worker.library \
+            + ' -script ' + worker.script + '; stat -liberty ' + worker.library + ';'
+
+    def synthesize():
+        return chip_area(run_yosys(worker.path['yosys'], yosys_command))
+    return cached_area(os.path.join(hier_dir(worker), worker.modulename + '_glue.area'), synthesize)
+
+
+def chip_area(lines):
+    '''
+    Area reported by 'stat -liberty' in the yosys log lines, 0 if none.
+    Of a hierarchical design, the area of the whole top module.
+    '''
+    area = 0.
+    for line in lines:
+        if 'Chip area for top module' in line:
+            return float(line.split()[-1])
+        if 'Chip area' in line:
+            area = float(line.split()[-1])
+    return area
+
+
+
+def candidate_verilog(k_stream, worker):
+    '''
+    Verilog files of the design in which partition i is factorized to
+    degree k_stream[i], top-level first. Missing approximations are created.
+    '''
     verilog_list = [os.path.join(worker.output, 'partition', worker.modulename + '.v')]
 
     # Parse each subcircuit
@@ -22,55 +202,172 @@ def evaluate_design(k_stream, worker, filename, display=True, use_weight=False):
             verilog_list.append(part_verilog)
             continue
         
-        part_verilog = os.path.join(worker.output, modulename, modulename + '_approx_k=' + str(approx_degree) + '.v')
-        # If has not been approximated before
-        if not os.path.exists(part_verilog):
-            print('----- Approximating part ' + str(i) + ' to degree ' + str(approx_degree))
+        verilog_list.append(approximate_once(approx_degree, worker, i))
 
-            directory = os.path.join(worker.output, modulename, modulename)
-            approximate(directory, approx_degree, worker, i)
-        
-        verilog_list.append(part_verilog)
+    return verilog_list
+
+
+def approximate_once(k, worker, i):
+    '''
+    Verilog file of partition i factorized to degree k, created if it has
+    not been approximated before. Parallel workers needing the same
+    approximation wait for the first one instead.
+    '''
+    modulename = worker.modulenames[i]
+    part_verilog = os.path.join(worker.output, modulename, modulename + '_approx_k=' + str(k) + '.v')
+    if not os.path.exists(part_verilog):
+        with locked(part_verilog + '.lock'):
+            if not os.path.exists(part_verilog):
+                print('----- Approximating part ' + str(i) + ' to degree ' + str(k))
+
+                directory = os.path.join(worker.output, modulename, modulename)
+                approximate(directory, k, worker, i)
+    return part_verilog
+
+
+def prefetch(worker, step_size, processes=None):
+    '''
+    Factorize every partition and create its approximations at every degree
+    the greedy search can reach with step_size. Tasks are handed out one at
+    a time to a pool of processes, largest partitions first.
+    '''
+    size = lambda i: (2 ** worker.input_list[i]) * worker.output_list[i]
+    parts = sorted((i for i in range(len(worker.modulenames)) if worker.output_list[i] > 1),
+                   key=size, reverse=True)
+    ladders = []
+    for i in parts:
+        k = worker.output_list[i]
+        while k > 1:
+            k = max(k - step_size, 1)
+            ladders.append((k, worker, i))
+
+    with mp.Pool(processes or mp.cpu_count()) as pool:
+        # Factors first, so that no task waits for the factors of another
+        factors = [(os.path.join(worker.output, worker.modulenames[i], worker.modulenames[i]), 1,
+                    worker.packed_truth, worker.bmf_backend, worker.cache) for i in parts]
+        for _ in pool.imap_unordered(_ensure_factors_task, factors, chunksize=1):
+            pass
+        for _ in pool.imap_unordered(_approximate_once_task, ladders, chunksize=1):
+            pass
+
+
+def _ensure_factors_task(args):
+    ensure_factors(*args)
 
-    truth_dir = os.path.join(worker.output, 'truthtable', filename+'.truth')
-    subprocess.call([worker.path['iverilog'], '-o', truth_dir[:-5]+'iv'] + verilog_list + [worker.testbench])
-    with open(truth_dir, 'w') as f:
-        subprocess.call([worker.path['vvp'], truth_dir[:-5]+'iv'], stdout=f)
-    os.remove(truth_dir[:-5] + 'iv')
+
+def _approximate_once_task(args):
+    approximate_once(*args)
+
+
+def batch_simulate(k_lists, worker, filename, use_weight=False):
+    '''
+    Simulate all candidate designs in k_lists with one iverilog run. The
+    modules of every distinct verilog file get a unique suffix, every
+    candidate gets its own copy of the top-level module, and all copies are
+    driven by the stimulus of worker.testbench. Return (err, err_s) for
+    each candidate, as evaluate_design computes them.
+    '''
+    with open(os.path.join(worker.output, 'partition', worker.modulename + '.v')) as f:
+        top_text = f.read()
+    with open(worker.testbench) as f:
+        tb_text = f.read()
+
+    renamed = {}
+    texts = []
+    tops = []
+    for c, k_stream in enumerate(k_lists):
+        names = {}
+        for part_verilog in candidate_verilog(k_stream, worker)[1:]:
+            if part_verilog not in renamed:
+                with open(part_verilog) as f:
+                    text = f.read()
+                suffix = '__b' + str(len(renamed))
+                renamed[part_verilog] = {m: m + suffix for m in _module_names(text)}
+                texts.append(_rename_modules(text, renamed[part_verilog]))
+            names.update(renamed[part_verilog])
+        names.update({m: m + '__c' + str(c) for m in _module_names(top_text)})
+        texts.append(_rename_modules(top_text, names))
+        tops.append(names[worker.modulename])
+
+    texts.append(_batch_testbench(tb_text, tops))
+    batch_file = os.path.join(worker.output, 'tmp', filename + '_batch.v')
+    with open(batch_file, 'w') as f:
+        f.write('\n'.join(texts))
 
     ground_truth = os.path.join(worker.output, worker.modulename + '.truth')
-    
-    output_syn = os.path.join(worker.output, 'tmp', filename)
-    area  = synth_design(' '.join(verilog_list), output_syn, worker.library, worker.script, worker.path['yosys'])
+    subprocess.call([worker.path['iverilog'], '-o', batch_file[:-1]+'iv', batch_file])
+    vvp = subprocess.Popen([worker.path['vvp'], batch_file[:-1]+'iv'], stdout=subprocess.PIPE)
+    results = batch_stream_distance(ground_truth, vvp.stdout, len(k_lists), use_weight)
+    vvp.stdout.close()
+    vvp.wait()
+    os.remove(batch_file[:-1]+'iv')
+    os.remove(batch_file)
+    return results
 
-    f, f_list = distance(ground_truth, truth_dir, use_weight)
 
-    # Estimate time and power
-    sta_script = os.path.join(worker.output, 'tmp', filename+'_sta.script')
-    sta_output = os.path.join(worker.output, 'tmp', filename+'_sta.out')
-    delay = get_delay(worker.path['OpenSTA'], sta_script, worker.library, output_syn+'_syn.v', worker.modulename, sta_output)
-    power = get_power(worker.path['OpenSTA'], sta_script, worker.library, output_syn+'_syn.v', worker.modulename, sta_output, worker.delay)
+def _module_names(text):
+    return re.findall(r'\bmodule\s+(\w+)', text)
 
-    print('Simulation error: {:.6f}\tCircuit area: {:.6f}\tCircuit delay: {:.6f}\tPower consumption: {:.6f}'.format(f, area, delay, power))
 
-    os.remove(sta_script)
-    os.remove(sta_output)
-    return f, f_list, area, delay, power
+def _rename_modules(text, names):
+    '''
+    Replace every identifier in names (module definitions and instances)
+    '''
+    if len(names) == 0:
+        return text
+    pattern = r'(?<![\w$\\])(' + '|'.join(map(re.escape, names)) + r')(?![\w$])'
+    return re.sub(pattern, lambda m: names[m.group(1)], text)
+
+
+def _batch_testbench(tb_text, tops):
+    '''
+    Turn a testbench of the top-level module into one that instantiates
+    every module in tops on the same stimulus and prints the output of
+    the i-th one prefixed by "i "
+    '''
+    po = re.search(r'wire\s*(\[[^\]]*\])\s*po\s*;', tb_text)
+    dut = re.search(r'(\w+)\s+dut\s*\((.*?)\)\s*;', tb_text, flags=re.S)
+    display = re.search(r'\$display\s*\(\s*"%b"\s*,\s*po\s*\)\s*;', tb_text)
+    if po is None or dut is None or display is None:
+        raise ValueError('Cannot parse testbench for batch simulation')
+
+    wires = ''.join('wire {} po_{};\n'.format(po.group(1), i) for i in range(len(tops)))
+    duts = ''.join('{} dut_{}({});\n'.format(top, i, re.sub(r'\bpo\b', 'po_'+str(i), dut.group(2))) for i, top in enumerate(tops))
+    displays = ' '.join('$display("{} %b", po_{});'.format(i, i) for i in range(len(tops)))
+
+    tb_text = tb_text[:dut.start()] + duts + tb_text[dut.end():]
+    tb_text = re.sub(r'\$display\s*\(\s*"%b"\s*,\s*po\s*\)\s*;', lambda m: displays, tb_text)
+    return tb_text[:po.start()] + wires + tb_text[po.end():]
 
 
-def synth_design(input_file, output_file, lib_file, script, yosys):
+def synth_design(input_file, output_file, lib_file, script, yosys, cache=None):
+    '''
+    Synthesize the Verilog files input_file (separated by spaces) to
+    output_file.v and, mapped to the liberty file, output_file_syn.v, and
+    return the chip area. A SynthCache returns the results of identical
+    inputs without running yosys.
+    '''
+    if cache is not None:
+        key = cache.key('synth_design', input_file.split() + [lib_file, script])
+        entry = cache.get(key)
+        if entry is not None:
+            write_atomic(output_file + '.v', entry['generic'])
+            write_atomic(output_file + '_syn.v', entry['netlist'])
+            return entry['area']
+
     yosys_command = 'read_verilog ' + input_file + '; ' \
             + 'synth -flatten; opt; opt_clean -purge; techmap; opt; opt_clean -purge; write_verilog -noattr ' +output_file + '.v; abc -liberty '+lib_file \
             + ' -script ' + script + '; stat -liberty '+lib_file + '; write_verilog -noattr ' +output_file + '_syn.v;\n '
 
-    area = 0
-    line=subprocess.call(yosys+" -p \'"+ yosys_command+"\' > "+ output_file+".log", shell=True)
-    with open(output_file+".log", 'r') as file_handle:
-        for line in file_handle:
-            if 'Chip area' in line:
-                area = line.split()[-1]
-                break
-    return float(area)
+    log = run_yosys(yosys, yosys_command)
+    area = chip_area(log)
+    if cache is not None:
+        with open(output_file + '.v') as f:
+            generic = f.read()
+        with open(output_file + '_syn.v') as f:
+            netlist = f.read()
+        cache.put(key, {'area': area, 'generic': generic, 'netlist': netlist})
+    return area
 
 def inpout(fname):
     with open(fname) as file:
@@ -178,19 +475,7 @@ def gen_truth(fname, modulename):
                         out=0
             line=file.readline()
         file.close()
-    f.write("initial\n")
-    f.write("begin\n")
-    j=0
-    while j < 2**n_inputs:
-        f.write('# 1  pi='+str(n_inputs)+'\'b')
-        str1=bin(j).replace("0b", "")
-        str2="0"*(n_inputs-len(str1))
-        n=str2+str1
-        f.write(n)
-        f.write(';\n')
-        f.write("#1 $display(\"%b\", po);\n")
-        j+=1
-    f.write("end\n")
+    write_stimulus(f, n_inputs)
     f.write("endmodule\n")
     f.close()
     return n_inputs, n_outputs
@@ -215,39 +500,82 @@ def v2w(signal,  n):
     return s
 
 
-def create_w(n, k, W, f1, modulename, formula_file, abc):    
+# Largest number of inputs synthesized in-process with --logic native
+NATIVE_LOGIC_INPUTS = 16
+
+
+def create_w(n, k, W, f1, modulename, formula_file, abc, logic='abc'):
     f1.write('module '+modulename+'_w'+str(k)+'('+v2w('in', n)+', '+ v2w('k', k)+');\n')
     f1.write('input '+v2w('in', n)+';\n')
     f1.write('output '+v2w('k', k)+';\n')
 
-    for i in range(k-1, -1, -1):
-        f1.write('assign k'+str(k-i-1)+' = ')
-        
-        truth=""
-        for j in range(2 ** n-1,-1,-1):
-            truth= truth+str(W[j,i])
-#        print(truth)
-        if truth.find('1') != -1:
-            script='read_truth -x '+truth+';bdd;order;write_verilog '+formula_file
-            #os.system(abc+' -q '+'\''+script+'\'')
-            subprocess.call([abc, '-q', script])
-            with open(formula_file, 'r') as file_handle:
-                for line in file_handle:
-                    if 'assign' in line:
-                        formula=line
-            formula=formula.replace('assign F = ', '')
-#            print(formula)
-            for c in range(n):
-                formula=formula.replace(chr(97+c)+ ';', 'in'+str(n-c-1)+';')
-                formula=formula.replace(chr(97+c)+ ' ', 'in'+str(n-c-1)+' ')
-                formula=formula.replace(chr(97+c)+ ')', 'in'+str(n-c-1)+')')
-        else:
-            formula='0;\n'
- #       print(formula)
-        f1.write(formula)
+    # Output kj is column k-j-1 of W; constant-zero columns need no logic
+    columns = [i for i in range(k-1, -1, -1) if W[:, i].any()]
+    if logic == 'native' and n <= NATIVE_LOGIC_INPUTS:
+        f1.write(bdd_verilog(W[:, columns], n, ['k'+str(k-i-1) for i in columns]))
+        for i in range(k-1, -1, -1):
+            if i not in columns:
+                f1.write('assign k'+str(k-i-1)+' = 0;\n')
+    else:
+        formulas = dict(zip(columns, abc_formulas(n, W[:, columns], formula_file, abc)))
+        for i in range(k-1, -1, -1):
+            f1.write('assign k'+str(k-i-1)+' = '+formulas.get(i, '0')+';\n')
 
     f1.write('endmodule\n\n')
 
+
+# Outputs and inputs of ABC's read_truth: F and a, b, ... for a single
+# truth table, po<j> and pi<c> for several
+ABC_ASSIGN = re.compile(r'assign\s+(F|po(\d+))\s*=\s*(.*?);', re.S)
+ABC_INPUTS = re.compile(r'\binput\s+([^;]*);')
+ABC_INPUT = re.compile(r'pi(\d+)|([a-z])')
+
+
+def abc_formulas(n, T, truth_file, abc):
+    '''
+    Verilog expressions over in0..in(n-1) of the columns of the truth table
+    T (2^n x c, row j is minterm j), synthesized by a single ABC run.
+    truth_file is a scratch file for the truth tables. As in logic.py,
+    minterm bit c is input in<c>; it is ABC's variable c.
+    '''
+    if T.shape[1] == 0:
+        return []
+    # One binary truth table per line, minterm 0 rightmost
+    digits = np.ascontiguousarray((T[::-1].T + ord('0')).astype(np.uint8))
+    with open(truth_file, 'w') as f:
+        for row in digits:
+            f.write(row.tobytes().decode() + '\n')
+    script = 'read_truth -x -f '+truth_file+';bdd;order;write_verilog /dev/stdout'
+    out = subprocess.run([abc, '-q', script], stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return parse_abc_formulas(out, n, T.shape[1])
+
+
+def parse_abc_formulas(out, n, count):
+    '''
+    Expressions of the count outputs of the Verilog that ABC writes for
+    read_truth, with the declared inputs renamed to in0..in(n-1)
+    '''
+    formulas = [None] * count
+    for _, j, formula in ABC_ASSIGN.findall(out):
+        formulas[int(j or 0)] = formula
+    if None in formulas:
+        raise ValueError('ABC did not return all {} formulas'.format(count))
+
+    rename = {}
+    for declaration in ABC_INPUTS.findall(out):
+        for name in declaration.replace(',', ' ').split():
+            match = ABC_INPUT.fullmatch(name)
+            if match is None:
+                raise ValueError('Unexpected ABC input ' + name)
+            c = int(match.group(1)) if match.group(1) else ord(match.group(2)) - 97
+            if c >= n:
+                raise ValueError('ABC input {} out of {} inputs'.format(name, n))
+            rename[name] = 'in' + str(c)
+    if len(rename) == 0:
+        return [' '.join(f.split()) for f in formulas]
+    names = re.compile(r"(?<![\w'\\])(" + '|'.join(sorted(rename, key=len, reverse=True)) + r')(?!\w)')
+    return [' '.join(names.sub(lambda m: rename[m.group(1)], f).split()) for f in formulas]
+
 def create_h(m, k, H, f1, modulename):
     f1.write('module '+modulename+'_h'+str(k)+'('+v2w('k', k)+', '+ v2w('out', m)+');\n')
     f1.write('input '+v2w('k', k)+';\n')
@@ -273,8 +601,18 @@ def create_h(m, k, H, f1, modulename):
 
 
 
-def create_wh(n, m, k, W, H, fname, modulename, output_dir, abc, formula_file):
-    f1=open(fname+'_approx_k='+str(k)+'.v','w')
+def create_wh(n, m, k, W, H, fname, modulename, output_dir, abc, formula_file, logic='abc'):
+    f1 = StringIO()
+    write_wh(n, m, k, W, H, f1, modulename, abc, formula_file, logic)
+    write_atomic(fname+'_approx_k='+str(k)+'.v', f1.getvalue())
+
+
+def write_wh(n, m, k, W, H, f1, modulename, abc, formula_file, logic='abc'):
+    '''
+    Write the Verilog of the factorized module (W and H) to the file f1.
+    The W functions are synthesized by ABC, or in-process if logic is
+    'native' and there are at most NATIVE_LOGIC_INPUTS inputs.
+    '''
     f1.write('module ' +modulename+'(' + v2w_top('pi', n)+', '+ v2w_top('po', m)+');\n')
     f1.write('input '+v2w_top('pi', n)+';\n')
     f1.write('output '+v2w_top('po', m)+';\n')
@@ -282,23 +620,160 @@ def create_wh(n, m, k, W, H, fname, modulename, output_dir, abc, formula_file):
     f1.write(modulename+'_w'+str(k)+' DUT1 ('+v2w_top('pi', n)+', '+ v2w_top('k', k)+');\n')
     f1.write(modulename+'_h'+str(k)+' DUT2 ('+v2w_top('k', k)+', '+ v2w_top('po', m)+');\n')
     f1.write('endmodule\n\n')
-    create_w(n, k, W, f1, modulename, formula_file, abc)
+    create_w(n, k, W, f1, modulename, formula_file, abc, logic)
     create_h(m, k, H, f1, modulename)
-    f1.close
 
-def approximate(inputfile, k, worker, i):
 
-    modulename = worker.modulenames[i]
+@contextmanager
+def locked(path):
+    '''
+    Hold an exclusive lock on the file path, between processes and threads
+    '''
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
 
-    asso( inputfile+'.truth', k )
-    W = np.loadtxt(inputfile + '.truth_w_' + str(k), dtype=int)
-    H = np.loadtxt(inputfile + '.truth_h_' + str(k), dtype=int)
-    formula_file = os.path.join(worker.output, modulename, modulename+'_formula.v')
-    if k == 1:
-        W = W.reshape((W.size, 1))
-        H = H.reshape((1, H.size))
 
-    create_wh(worker.input_list[i], worker.output_list[i], k, W, H, inputfile, modulename, worker.output, worker.path['abc'], formula_file)
+def write_atomic(path, text):
+    '''
+    Write text to path through a temporary file, so that readers never see
+    a partial file
+    '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def bmf_backend(backend):
+    '''
+    Module factorizing truth tables for backend 'asso' (asso_api.py, on the
+    compiled _asso.so) or 'numpy' (bmf.py). Without _asso.so, both use NumPy.
+    '''
+    if backend not in ('asso', 'numpy'):
+        raise ValueError('Unknown BMF backend ' + str(backend))
+    if backend == 'numpy' or asso_api is None:
+        return bmf
+    return asso_api
+
+
+def save_factors(inputfile, factors, packed=True):
+    '''
+    Store W, H and WH of degree k (the (k-1)-th entry of factors) next to
+    inputfile.truth as .truth_w_k, .truth_h_k and .truth_wh_k
+    '''
+    for k, (W, H, WH, _) in enumerate(factors, 1):
+        # WH last: its presence means the factors of degree k are complete
+        for name, M in (('_w_', W), ('_h_', H), ('_wh_', WH)):
+            path = inputfile + '.truth' + name + str(k)
+            save_truth(path + '.tmp', M, packed)
+            os.replace(path + '.tmp', path)
+
+
+def factorize_degrees(inputfile, packed=True, backend='asso', cache=None, threads=0):
+    '''
+    Factorize inputfile.truth to every degree below its number of outputs
+    in one ASSO sweep and store the factors with save_factors. Factors
+    found in cache (a FactorCache) are not computed again.
+    '''
+    truth = load_truth(inputfile + '.truth')
+    factors = cache.get_factors(truth) if cache is not None else None
+    if factors is None:
+        factors = bmf_backend(backend).asso_degrees(truth, threads=threads)
+        if cache is not None:
+            cache.put_factors(truth, factors)
+    save_factors(inputfile, factors, packed)
+
+
+def factorize_batch(inputfiles, packed=True, cache=None):
+    '''
+    Factorize the truth tables of all inputfiles with batched NumPy ASSO
+    and store the factors with save_factors, as factorize_degrees does
+    '''
+    truths = [load_truth(f + '.truth') for f in inputfiles]
+    factors = [cache.get_factors(t) if cache is not None else None for t in truths]
+    missing = [i for i in range(len(truths)) if factors[i] is None]
+    for i, f in zip(missing, bmf.asso_batch([truths[i] for i in missing])):
+        factors[i] = f
+        if cache is not None:
+            cache.put_factors(truths[i], f)
+    for f, fac in zip(inputfiles, factors):
+        save_factors(f, fac, packed)
+
+
+def prefactorize(k_lists, worker, max_workers=None):
+    '''
+    Factorize every partition that some candidate in k_lists approximates
+    and that has no factors yet. ASSO releases the GIL, so partitions are
+    factorized concurrently by a thread pool, whose sweeps share the cores
+    instead of each starting one thread per core; the NumPy backend
+    factorizes them in batches instead.
+    '''
+    todo = []
+    for i, modulename in enumerate(worker.modulenames):
+        if not any(k[i] < worker.output_list[i] for k in k_lists):
+            continue
+        directory = os.path.join(worker.output, modulename, modulename)
+        if not os.path.exists(directory + '.truth_wh_1'):
+            todo.append(directory)
+    if len(todo) == 0:
+        return
+    if bmf_backend(worker.bmf_backend) is bmf:
+        factorize_batch(todo, worker.packed_truth, worker.cache)
+        return
+    cores = mp.cpu_count()
+    pool_size = min(len(todo), max_workers or cores)
+    threads = max(1, cores // pool_size)
+    with ThreadPoolExecutor(pool_size) as pool:
+        list(pool.map(lambda d: ensure_factors(d, 1, worker.packed_truth, 'asso', worker.cache, threads), todo))
+
+
+def ensure_factors(inputfile, k, packed=True, backend='asso', cache=None, threads=0):
+    '''
+    Factorize inputfile.truth with factorize_degrees, in at most threads
+    threads, unless its factors of degree k exist. Concurrent callers wait
+    for the first one.
+    '''
+    if os.path.exists(inputfile + '.truth_wh_' + str(k)):
+        return
+    with locked(inputfile + '.lock'):
+        if not os.path.exists(inputfile + '.truth_wh_' + str(k)):
+            factorize_degrees(inputfile, packed, backend, cache, threads)
+
+
+def approximate(inputfile, k, worker, i, backend=None):
+
+    modulename = worker.modulenames[i]
+    if backend is None:
+        backend = worker.bmf_backend
+
+    # Factors of all degrees are computed on the first request
+    ensure_factors(inputfile, k, worker.packed_truth, backend, worker.cache)
+
+    # Verilog of an identical truth table may be cached by an earlier run
+    part_verilog = inputfile + '_approx_k=' + str(k) + '.v'
+    if worker.cache is not None:
+        truth = load_truth(inputfile + '.truth')
+        text = worker.cache.get_verilog(truth, k, modulename, worker.logic)
+        if text is not None:
+            write_atomic(part_verilog, text)
+            return
+
+    W = load_truth(inputfile + '.truth_w_' + str(k)).astype(int)
+    H = load_truth(inputfile + '.truth_h_' + str(k)).astype(int)
+    # ABC scratch file of this call only
+    fd, formula_file = tempfile.mkstemp(dir=os.path.join(worker.output, modulename),
+                                        prefix=modulename+'_formula_', suffix='.v')
+    os.close(fd)
+
+    if worker.cache is None:
+        create_wh(worker.input_list[i], worker.output_list[i], k, W, H, inputfile, modulename, worker.output, worker.path['abc'], formula_file, worker.logic)
+    else:
+        # Write the cached copy for any module name
+        f1 = StringIO()
+        write_wh(worker.input_list[i], worker.output_list[i], k, W, H, f1, MODULE_PLACEHOLDER, worker.path['abc'], formula_file, worker.logic)
+        worker.cache.put_verilog(truth, k, f1.getvalue(), worker.logic)
+        write_atomic(part_verilog, f1.getvalue().replace(MODULE_PLACEHOLDER, modulename))
+    os.remove(formula_file)
 
 
 
@@ -309,14 +784,10 @@ def number_of_cell(input_file, yosys):
     yosys_command = 'read_verilog ' + input_file + '; ' \
             + 'synth -flatten; opt; opt_clean -purge; techmap; opt; opt_clean -purge; stat;\n'
     num_cell = 0
-    output_file = input_file[:-2] + '_syn.log'
-    line=subprocess.call(yosys+" -p \'"+ yosys_command+"\' > "+ output_file, shell=True)
-    with open(output_file, 'r') as file_handle:
-        for line in file_handle:
-            if 'Number of cells:' in line:
-                num_cell = line.split()[-1]
-                break
-    os.remove(output_file)
+    for line in run_yosys(yosys, yosys_command):
+        if 'Number of cells:' in line:
+            num_cell = line.split()[-1]
+            break
     return int(num_cell)
 
 def write_aiger(input_file, yosys, output_file, map_file):
@@ -325,7 +796,7 @@ def write_aiger(input_file, yosys, output_file, map_file):
     '''
     yosys_command = 'read_verilog ' + input_file + '; aigmap; write_aiger -vmap '\
             + map_file + ' ' + output_file + ';'
-    subprocess.call([yosys, '-p', yosys_command], stdout=subprocess.DEVNULL)
+    run_yosys(yosys, yosys_command)
     # Parse map file and return dict
     # input_map = {}
     # output_map = {}
@@ -432,7 +903,7 @@ def get_power(sta, script, liberty, input_file, modulename, output_file, delay):
 def create_wrapper(inp, out, top, vmap, worker):
     tmp = os.path.join(worker.output, 'tmp.v')
     yosys_command = 'read_verilog ' + inp + '; synth -flatten; opt; opt_clean; techmap; write_verilog ' + tmp + ';\n'
-    subprocess.call([worker.path['yosys'], '-p', yosys_command], stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    run_yosys(worker.path['yosys'], yosys_command)
 
     out_file = open(out, 'w')
 
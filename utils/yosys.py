@@ -0,0 +1,136 @@
+'''
+Long-lived yosys processes.
+
+Starting yosys costs more than many of the small jobs BLASYS gives it.
+A YosysSession keeps one interactive yosys process, sends it the commands
+of a job over stdin after 'design -reset', and reads its log from stdout
+up to a marker that the job ends with. Every process (e.g. each worker of
+a multiprocessing pool) gets its own session on first use, so there is one
+yosys per core in parallel mode. The session saves the start of yosys only:
+'abc -liberty' and 'stat -liberty' still parse the liberty file every job.
+
+A thread reads the output of yosys, so a job that does not reach its
+marker within JOB_TIMEOUT seconds kills the process; the next job starts
+a new one.
+'''
+import os
+import time
+import queue
+import atexit
+import threading
+import subprocess
+import regex as re
+
+# Interactive prompt, which precedes the output of every command
+PROMPT = re.compile(r'^(yosys(\s+\[[^\]]*\])?>\s*)+')
+
+# Seconds a job may take before its yosys process is killed
+JOB_TIMEOUT = 3600
+
+_sessions = {}
+
+
+def _read_lines(stream, lines):
+    '''
+    Put the lines of stream into the queue lines, then None at its end
+    '''
+    for line in stream:
+        lines.put(line)
+    lines.put(None)
+
+
+class YosysSession():
+    def __init__(self, yosys, timeout=JOB_TIMEOUT):
+        self.yosys = yosys
+        self.timeout = timeout
+        self.process = None
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.process = subprocess.Popen([self.yosys, '-Q'], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=_read_lines, args=(self.process.stdout, self.lines), daemon=True)
+        reader.start()
+
+    def _kill(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def run(self, commands):
+        '''
+        Run a list of yosys commands on an empty design and return the
+        lines of their log. Raise ValueError if a command fails, or if the
+        job times out.
+        '''
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self._start()
+            self.jobs += 1
+            marker = 'BLASYS_JOB_{}_DONE'.format(self.jobs)
+            try:
+                for command in ['design -reset'] + commands + ['log ' + marker]:
+                    self.process.stdin.write(command.strip().rstrip(';') + '\n')
+                self.process.stdin.flush()
+            except BrokenPipeError:
+                self._kill()
+                raise ValueError('yosys exited unexpectedly')
+
+            lines = []
+            deadline = time.time() + self.timeout
+            while True:
+                try:
+                    line = self.lines.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    self._kill()
+                    raise ValueError('yosys timed out after {} s:\n'.format(self.timeout) + ''.join(lines[-20:]))
+                if line is None:
+                    self._kill()
+                    raise ValueError('yosys exited unexpectedly:\n' + ''.join(lines[-20:]))
+                line = PROMPT.sub('', line)
+                if line.rstrip().endswith(marker):
+                    break
+                lines.append(line)
+
+        errors = [l for l in lines if l.startswith('ERROR:')]
+        if errors:
+            raise ValueError('yosys: ' + errors[0].strip())
+        return lines
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+
+def yosys_session(yosys):
+    '''
+    Session of this process running the yosys binary yosys
+    '''
+    key = (os.getpid(), yosys)
+    if key not in _sessions:
+        _sessions[key] = YosysSession(yosys)
+    return _sessions[key]
+
+
+def run_yosys(yosys, script):
+    '''
+    Run a yosys script (commands separated by ';') in the session of this
+    process and return the lines of its log
+    '''
+    return yosys_session(yosys).run([c for c in script.split(';') if c.strip()])
+
+
+@atexit.register
+def _close_sessions():
+    for key, session in list(_sessions.items()):
+        if key[0] == os.getpid():
+            session.close()